@@ -0,0 +1,78 @@
+import mimetypes
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import click
+from synthetic import library_options, make_library
+
+from quick_gallery.discovery import MediaScanner, classify
+from quick_gallery.media import Media
+
+
+def legacy_mimetype(media: Media) -> str | None:
+    mimetype, _ = mimetypes.guess_type(media.path, strict=False)
+    return mimetype
+
+
+def strip_extensions(root: Path, fraction: float, seed: int) -> int:
+    # extensionless medias are the ones that need their content sniffed
+    rng = random.Random(seed)
+    stripped = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(".tags") and rng.random() < fraction:
+                path = os.path.join(directory, name)
+                os.rename(path, os.path.splitext(path)[0])
+                stripped += 1
+    return stripped
+
+
+def timed(name, fxn):
+    start = time.perf_counter()
+    classified = fxn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {classified} classified in {elapsed:.3f}s")
+    return elapsed
+
+
+@click.command()
+@library_options
+@click.option("--extensionless", type=float, default=0.05, show_default=True)
+@click.option("--workers", type=int, default=None)
+@click.argument("path", type=click.Path(path_type=Path), required=False)
+def main(extensionless, workers, path, medias, **library):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if path is None:
+            path = Path(tmpdir) / "library"
+            make_library(str(path), medias, **library)
+            stripped = strip_extensions(path, extensionless, library["seed"])
+            print(f"stripped the extension of {stripped} medias")
+        scanned = list(MediaScanner(workers=workers).scan([path], recursive=True))
+        # both sides only look at extensions; sniffing is reported on its own
+        legacy = timed(
+            "legacy",
+            lambda: sum(legacy_mimetype(media) is not None for media in scanned),
+        )
+        fresh = [Media(media.path) for media in scanned]
+        current = timed(
+            "extension",
+            lambda: sum(media.mimetype() is not None for media in fresh),
+        )
+        print(f"speedup: {legacy / current:.2f}x")
+        fresh = [Media(media.path) for media in scanned]
+        unknown = sum(media.mimetype() is None for media in fresh)
+        timed(
+            "classify",
+            lambda: sum(
+                media.mimetype() is not None
+                for media in classify(fresh, workers=workers)
+            ),
+        )
+        print(f"  of which {unknown} were sniffed from their content")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import json
+from collections import abc
+
+import click
+
+
+def flatten(results: dict, prefix: str = "") -> abc.Iterator[tuple[str, float]]:
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
+
+
+@click.command()
+@click.argument("baseline", type=click.File())
+@click.argument("candidate", type=click.File())
+def main(baseline, candidate):
+    baseline, candidate = json.load(baseline), json.load(candidate)
+    if baseline["params"] != candidate["params"]:
+        click.echo("warning: the runs used different parameters", err=True)
+    print(
+        f"{'':<48} {baseline['commit'] or '?':>12.12} {candidate['commit'] or '?':>12.12}"
+    )
+    before = dict(flatten(baseline["results"]))
+    for key, value in flatten(candidate["results"]):
+        if key not in before:
+            continue
+        old = before[key]
+        change = f"{(value - old) / old:+8.1%}" if old else ""
+        print(f"{key:<48} {old:>12.4g} {value:>12.4g} {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import tempfile
+import time
+from pathlib import Path
+
+import click
+from synthetic import library_options, make_library
+
+from quick_gallery.discovery import MediaScanner
+from quick_gallery.media import Media
+
+
+def legacy_resolve_files(paths, recursive=False):
+    for path in paths:
+        if recursive and path.is_dir():
+            yield from legacy_resolve_files(path.iterdir(), recursive=recursive)
+        else:
+            yield Media(path, public_file=None)
+
+
+def timed(name, fxn):
+    start = time.perf_counter()
+    count = sum(1 for _ in fxn())
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>12}: {count} files in {elapsed:.3f}s ({count / elapsed:,.0f} files/s)"
+    )
+    return elapsed
+
+
+@click.command()
+@library_options
+@click.option("--workers", type=int, default=None)
+@click.argument("path", type=click.Path(path_type=Path), required=False)
+def main(workers, path, medias, **library):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if path is None:
+            path = Path(tmpdir) / "library"
+            make_library(str(path), medias, **library)
+        legacy = timed("legacy", lambda: legacy_resolve_files([path], recursive=True))
+        scanner = MediaScanner(workers=workers)
+        scandir = timed("scandir", lambda: scanner.scan([path], recursive=True))
+        print(f"speedup: {legacy / scandir:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
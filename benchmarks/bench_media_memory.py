@@ -0,0 +1,53 @@
+import gc
+import hashlib
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+
+from quick_gallery.media import Media
+
+EXTENSIONS = [".jpg", ".png", ".mp4", ".webm", ".gif"]
+
+
+class LegacyMedia(Path):
+    def __init__(self, host_file, public_file=None):
+        self.public_file = Path(public_file or host_file)
+        super().__init__(host_file)
+
+
+def synthetic_paths(count: int):
+    for i in range(count):
+        yield f"library/{i // 1000:04d}/media_{i:08d}{EXTENSIONS[i % len(EXTENSIONS)]}"
+
+
+def public_path(path: str) -> str:
+    return "media/" + hashlib.md5(path.encode("utf8")).hexdigest()
+
+
+def measure(name: str, factory, count: int):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    medias = [factory(path, public_path(path)) for path in synthetic_paths(count)]
+    lookup = {str(media.public_file): media for media in medias}
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>7} n={count:>8}: {current / 2**20:8.1f} MiB "
+        f"({current / count:6.0f} bytes/media), built in {elapsed:6.2f}s"
+    )
+    del medias, lookup
+
+
+@click.command()
+@click.option("--count", type=int, default=1_000_000)
+def main(count):
+    measure("legacy", LegacyMedia, count)
+    measure("slotted", Media, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+from quick_gallery.galleries.assets import script_json
+from quick_gallery.galleries.simple_gallery import SimpleGallery
+from quick_gallery.media import Media
+
+EXTENSIONS = [".jpg", ".png", ".mp4", ".webm", ".gif"]
+
+
+def synthetic_medias(count: int):
+    for i in range(count):
+        path = f"library/{i // 1000:04d}/media_{i:08d}{EXTENSIONS[i % len(EXTENSIONS)]}"
+        yield Media(path)
+
+
+def legacy_item(record: dict, index: int) -> str:
+    # per item markup from before the compact JSON payload, for page weight
+    attributes = {"src": record["src"], "mimetype": record["mimetype"]}
+    attributes["index"] = index
+    rendered = " ".join(f'data-{key}="{value}"' for key, value in attributes.items())
+    return f'<span class="media-container" {rendered}></span>'
+
+
+def buffered_render(gallery: SimpleGallery, output):
+    output.write(gallery.html())
+
+
+def streaming_render(gallery: SimpleGallery, output):
+    gallery.write_html(output)
+
+
+def measure(name: str, render, count: int):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "gallery.html")
+        gallery = SimpleGallery(synthetic_medias(count))
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(path, "w") as output:
+            render(gallery, output)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        size = os.path.getsize(path)
+    print(
+        f"{name:>9} n={count:>8}: {elapsed:7.2f}s, peak {peak / 2**20:8.1f} MiB, "
+        f"output {size / 2**20:8.1f} MiB"
+    )
+
+
+def page_weight(count: int):
+    gallery = SimpleGallery(list(synthetic_medias(count)))
+    records = gallery.records()
+    legacy = sum(len(legacy_item(r, i)) + 1 for i, r in enumerate(records))
+    compact = sum(len(script_json(item)) + 2 for item in gallery.gallery_items())
+    print(
+        f"item markup n={count:>8}: {legacy / count:6.1f} bytes/item as attributes, "
+        f"{compact / count:6.1f} bytes/item as compact JSON ({legacy / compact:.1f}x)"
+    )
+
+
+@click.command()
+@click.option("--sizes", default="10000,100000,500000", help="Comma separated counts")
+def main(sizes):
+    for size in map(int, sizes.split(",")):
+        measure("buffered", buffered_render, size)
+        measure("streaming", streaming_render, size)
+        page_weight(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import click
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+from synthetic import make_library
+
+from quick_gallery.cli import resolve_files
+from quick_gallery.galleries import PagedGallery
+from quick_gallery.media import public_media_path
+from quick_gallery.server import AioHttpServer
+
+
+def build_server(library: str) -> AioHttpServer:
+    medias = resolve_files(
+        [Path(library)], recursive=True, public_path_fxn=public_media_path
+    )
+    server = AioHttpServer("127.0.0.1", 0, PagedGallery([]), medias)
+    server.build_index_now()
+    return server
+
+
+async def resolve_latency(server: AioHttpServer, paths: list[str], samples: int):
+    # the router match plus the media lookup, without a connection
+    app = server.app
+    app.freeze()
+    timings = []
+    for path in random.choices(paths, k=samples):
+        request = make_mocked_request("GET", path, app=app)
+        start = time.perf_counter()
+        match_info = await app.router.resolve(request)
+        media = server.media_lookup.get(request.path)
+        timings.append(time.perf_counter() - start)
+        assert match_info.http_exception is None and media is not None
+    return timings
+
+
+async def request_latency(server: AioHttpServer, paths: list[str], samples: int):
+    # whole requests through the server's middleware and media handler
+    timings = []
+    async with TestClient(TestServer(server.app)) as client:
+        for path in random.choices(paths, k=samples):
+            start = time.perf_counter()
+            async with client.get(path) as response:
+                await response.read()
+            timings.append(time.perf_counter() - start)
+            assert response.status == 200
+    return timings
+
+
+def report(name: str, size: int, timings: list[float]):
+    timings.sort()
+    print(
+        f"{name:>8} n={size:>8}: median {statistics.median(timings) * 1e6:8.1f}us, "
+        f"p99 {timings[int(len(timings) * 0.99)] * 1e6:8.1f}us"
+    )
+
+
+@click.command()
+@click.option("--sizes", default="1000,10000,100000", help="Comma separated counts")
+@click.option("--samples", type=int, default=2000)
+@click.option("--seed", type=int, default=0)
+def main(sizes, samples, seed):
+    random.seed(seed)
+    for size in map(int, sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            library = os.path.join(tmpdir, "library")
+            make_library(library, size, seed=seed)
+            start = time.perf_counter()
+            server = build_server(library)
+            startup = time.perf_counter() - start
+            paths = list(server.media_lookup)
+            print(f"   index n={size:>8}: built in {startup:8.3f}s")
+            report(
+                "resolve", size, asyncio.run(resolve_latency(server, paths, samples))
+            )
+            report(
+                "request", size, asyncio.run(request_latency(server, paths, samples))
+            )
+
+
+if __name__ == "__main__":
+    main()
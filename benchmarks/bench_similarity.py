@@ -0,0 +1,112 @@
+import itertools
+import os
+import random
+import tempfile
+import time
+
+import click
+from PIL import Image, ImageDraw
+
+from quick_gallery.media import Media
+from quick_gallery.phash import SimilarityFinder, hamming
+
+
+class PrecomputedFinder(SimilarityFinder):
+    def __init__(self, keys: dict[int, int], threshold: int):
+        super().__init__(threshold=threshold)
+        self.keys = keys
+
+    def hashes(self, medias):
+        return self.keys
+
+
+def synthetic_hashes(count: int, duplicate_rate: float, flips: int) -> list[int]:
+    hashes = []
+    for _ in range(count):
+        if hashes and random.random() < duplicate_rate:
+            key = random.choice(hashes)
+            for bit in random.sample(range(64), flips):
+                key ^= 1 << bit
+        else:
+            key = random.getrandbits(64)
+        hashes.append(key)
+    return hashes
+
+
+def brute_force_pairs(hashes: list[int], threshold: int) -> int:
+    pairs = 0
+    for i, a in enumerate(hashes):
+        for b in itertools.islice(hashes, i + 1, None):
+            if hamming(a, b) <= threshold:
+                pairs += 1
+    return pairs
+
+
+def make_images(directory: str, count: int, duplicate_rate: float) -> list[Media]:
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i // 1000:03d}", f"{i}.jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if paths and random.random() < duplicate_rate:
+            with Image.open(random.choice(paths)) as source:
+                source.resize((48, 48)).save(path, quality=50)
+        else:
+            image = Image.new("L", (64, 64), random.randrange(256))
+            draw = ImageDraw.Draw(image)
+            for _ in range(4):
+                x, y = random.randrange(48), random.randrange(48)
+                draw.rectangle((x, y, x + 16, y + 16), fill=random.randrange(256))
+            image.save(path, quality=90)
+        paths.append(path)
+    return [Media(path) for path in paths]
+
+
+def timed(fxn, *args):
+    start = time.perf_counter()
+    result = fxn(*args)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option("--count", type=int, default=100_000, help="Number of hashes/images")
+@click.option("--threshold", type=int, default=6)
+@click.option("--duplicate-rate", type=float, default=0.2)
+@click.option(
+    "--brute-force-sample",
+    type=int,
+    default=5_000,
+    help="Pairwise comparison is timed on this many hashes and extrapolated",
+)
+@click.option("--images/--no-images", default=True, help="Also hash real files")
+@click.option("--workers", type=int, default=None)
+def main(count, threshold, duplicate_rate, brute_force_sample, images, workers):
+    random.seed(0)
+    hashes = synthetic_hashes(count, duplicate_rate, flips=threshold // 2)
+    finder = PrecomputedFinder(dict(enumerate(hashes)), threshold)
+    elapsed, clusters = timed(finder.clusters, [None] * count)
+    print(f"multi-index clustering n={count}: {elapsed:.2f}s, {len(clusters)} clusters")
+
+    sample = hashes[:brute_force_sample]
+    elapsed, _ = timed(brute_force_pairs, sample, threshold)
+    estimate = elapsed * (count / len(sample)) ** 2
+    print(f"brute force n={len(sample)}: {elapsed:.2f}s, ~{estimate:.0f}s at n={count}")
+
+    if not images:
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        elapsed, medias = timed(make_images, directory, count, duplicate_rate)
+        print(f"generated {count} images in {elapsed:.1f}s")
+        cache_path = os.path.join(directory, "perceptual.sqlite")
+        for run in ("cold", "cached"):
+            finder = SimilarityFinder(
+                threshold=threshold, cache_path=cache_path, workers=workers
+            )
+            elapsed, clusters = timed(finder.clusters, medias)
+            print(
+                f"{run:>6} hash + cluster: {elapsed:.2f}s "
+                f"({count / elapsed:.0f} images/s), {len(clusters)} clusters"
+            )
+
+
+if __name__ == "__main__":
+    main()
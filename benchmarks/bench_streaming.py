@@ -0,0 +1,104 @@
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import aiohttp
+import click
+from aiohttp import web
+
+from quick_gallery.streaming import MediaStreamer, parse_size
+
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, "video.mp4")
+    with open(path, "wb") as fd:
+        block = os.urandom(1024 * 1024)
+        for _ in range(0, size, len(block)):
+            fd.write(block)
+    return path
+
+
+def make_app(path: str, streamer: MediaStreamer) -> web.Application:
+    async def handler(request):
+        return await streamer.respond(
+            request, path, os.stat(path), content_type="video/mp4"
+        )
+
+    app = web.Application()
+    app.router.add_get("/media/video", handler)
+    return app
+
+
+async def reader(session, url: str, size: int, requests: int, span: int, stats):
+    for _ in range(requests):
+        start = random.randrange(0, max(size - span, 1))
+        headers = {"Range": f"bytes={start}-{start + span - 1}"}
+        began = time.perf_counter()
+        async with session.get(url, headers=headers) as response:
+            assert response.status == 206, response.status
+            first = True
+            async for chunk in response.content.iter_any():
+                if first:
+                    stats["ttfb"].append(time.perf_counter() - began)
+                    first = False
+                stats["bytes"] += len(chunk)
+
+
+async def run(path, size, streamer, clients, requests, span, port):
+    runner = web.AppRunner(make_app(path, streamer), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    stats = {"ttfb": [], "bytes": 0}
+    url = f"http://127.0.0.1:{port}/media/video"
+    try:
+        connector = aiohttp.TCPConnector(limit=clients)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    reader(session, url, size, requests, span, stats)
+                    for _ in range(clients)
+                )
+            )
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    return elapsed, stats
+
+
+@click.command()
+@click.option("--file-size", default="512M", help="Size of the synthetic video")
+@click.option("--clients", type=int, default=32, help="Parallel range readers")
+@click.option("--requests", type=int, default=20, help="Range requests per client")
+@click.option("--span", default="4M", help="Bytes requested per range")
+@click.option("--chunk-sizes", default="64K,256K,1M", help="Comma separated")
+@click.option("--rate-limit", default=None, help="Per-client limit, e.g. 10M")
+@click.option("--port", type=int, default=8799)
+def main(file_size, clients, requests, span, chunk_sizes, rate_limit, port):
+    size = parse_size(file_size)
+    span = parse_size(span)
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, size)
+        size = os.path.getsize(path)
+        for chunk_size in chunk_sizes.split(","):
+            streamer = MediaStreamer(
+                chunk_size=parse_size(chunk_size),
+                rate_limit=parse_size(rate_limit) if rate_limit else None,
+            )
+            elapsed, stats = asyncio.run(
+                run(path, size, streamer, clients, requests, span, port)
+            )
+            ttfb = sorted(stats["ttfb"])
+            print(
+                f"chunk {chunk_size:>5}: {stats['bytes'] / elapsed / 1024**2:8.1f} MiB/s, "
+                f"ttfb median {statistics.median(ttfb) * 1e3:7.2f}ms, "
+                f"p99 {ttfb[int(len(ttfb) * 0.99)] * 1e3:7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
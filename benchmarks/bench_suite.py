@@ -0,0 +1,214 @@
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import click
+from synthetic import (
+    BenchmarkResults,
+    children_peak_rss,
+    library_options,
+    make_library,
+    peak_rss,
+    percentiles,
+)
+
+from quick_gallery.cli import GALLERY_LOOKUP, relative_to, resolve_files
+from quick_gallery.export import ShardedExporter
+from quick_gallery.galleries import TagGallery
+
+
+class CountingWriter(io.TextIOBase):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text.encode("utf8"))
+        return len(text)
+
+
+def fetch(url: str) -> bytes:
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def wait_until_ready(url: str, server: subprocess.Popen, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        try:
+            fetch(url)
+            return time.perf_counter() - start
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def latencies(urls: list[str], requests: int) -> list[float]:
+    timings = []
+    for url in random.choices(urls, k=requests):
+        start = time.perf_counter()
+        fetch(url)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_build(results: BenchmarkResults, library: str, gallery_name: str):
+    with results.timed("scan_seconds"):
+        medias = list(resolve_files([Path(library)], recursive=True))
+    results.record("scanned_medias", len(medias))
+    output = CountingWriter()
+    with results.timed("gallery_build_seconds"):
+        GALLERY_LOOKUP[gallery_name](medias).write_html(output)
+    results.record("html_bytes", output.size)
+    results.record("peak_rss_bytes", peak_rss())
+
+
+def bench_export(results, library, gallery_name, output_dir):
+    # a cold export, then one over the unchanged library that rewrites nothing
+    GalleryType = GALLERY_LOOKUP[gallery_name]
+    exporter = ShardedExporter(
+        output_dir, tag_index=issubclass(GalleryType, TagGallery)
+    )
+    for run in ("cold", "unchanged"):
+        medias = sorted(resolve_files([Path(library)], recursive=True))
+        gallery = GalleryType(relative_to(medias, Path(output_dir)))
+        with results.timed(f"export_{run}_seconds"):
+            stats = exporter.export(gallery.gallery_records())
+        results.record(f"export_{run}_files_written", stats["written"])
+    results.record(
+        "export_bytes",
+        sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(output_dir)
+            for name in names
+        ),
+    )
+
+
+def bench_server(results, library, gallery_name, port, requests, timeout):
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "quick_gallery.cli",
+            "--silent",
+            "serve",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--gallery",
+            gallery_name,
+            "--recursive",
+            library,
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        startup = wait_until_ready(f"{base_url}/", server, timeout)
+        results.record("server_startup_seconds", round(startup, 6))
+        total = json.loads(fetch(f"{base_url}/api/items?limit=0"))["total"]
+        page = json.loads(fetch(f"{base_url}/api/items?limit=50"))["items"]
+        endpoints = {
+            "page": [f"{base_url}/"],
+            "items": [
+                f"{base_url}/api/items?offset={offset}&limit=50"
+                for offset in range(0, max(total, 1), 50)
+            ],
+            "tags": [f"{base_url}/api/tags"],
+            "media": [f"{base_url}/{item['src']}" for item in page],
+        }
+        for name, urls in endpoints.items():
+            if urls:
+                timings = latencies(urls, requests)
+                results.record(f"latency_{name}_seconds", percentiles(timings))
+    finally:
+        server.terminate()
+        server.wait()
+    results.record("server_peak_rss_bytes", children_peak_rss())
+
+
+@click.command()
+@library_options
+@click.option(
+    "--gallery",
+    "gallery_name",
+    type=click.Choice(list(GALLERY_LOOKUP), case_sensitive=False),
+    default="TagGallery",
+)
+@click.option("--requests", type=int, default=200, help="Requests per endpoint")
+@click.option("--port", type=int, default=8797)
+@click.option("--server-timeout", type=float, default=300.0)
+@click.option("--server/--no-server", default=True, help="Also benchmark serve")
+@click.option(
+    "--export/--no-export", default=True, help="Also benchmark a sharded export"
+)
+@click.option(
+    "--library",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Keep the generated library here instead of a temporary directory",
+)
+@click.option("--output", type=click.File("w"), default="-", help="JSON results")
+def main(
+    medias,
+    depth,
+    fanout,
+    tag_density,
+    mix,
+    file_size,
+    seed,
+    gallery_name,
+    requests,
+    port,
+    server_timeout,
+    server,
+    export,
+    library,
+    output,
+):
+    params = {
+        "medias": medias,
+        "depth": depth,
+        "fanout": fanout,
+        "tag_density": tag_density,
+        "mix": mix,
+        "file_size": file_size,
+        "seed": seed,
+        "gallery": gallery_name,
+        "requests": requests,
+    }
+    results = BenchmarkResults("suite", params)
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.fspath(library or Path(tmpdir) / "library")
+        if not os.path.isdir(root):
+            with results.timed("generate_seconds"):
+                summary = make_library(root, **params_for_library(params))
+            results.record("library", summary)
+        bench_build(results, root, gallery_name)
+        if export:
+            bench_export(results, root, gallery_name, os.path.join(tmpdir, "export"))
+        if server:
+            bench_server(results, root, gallery_name, port, requests, server_timeout)
+    results.write(output)
+
+
+def params_for_library(params: dict) -> dict:
+    keys = ("medias", "depth", "fanout", "tag_density", "mix", "file_size", "seed")
+    library = {key: params[key] for key in keys}
+    library["count"] = library.pop("medias")
+    return library
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+import click
+from synthetic import make_library
+
+
+def wait_until_ready(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+async def hammer(base_url: str, connections: int, duration: float, total: int):
+    done = 0
+    deadline = time.monotonic() + duration
+
+    async def loop(session, worker):
+        nonlocal done
+        i = worker
+        while time.monotonic() < deadline:
+            offset = (i * 97) % max(total - 50, 1)
+            async with session.get(
+                f"{base_url}/api/items?offset={offset}&limit=50"
+            ) as r:
+                await r.read()
+            done += 1
+            i += connections
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(loop(session, w) for w in range(connections)))
+    return done
+
+
+def client(args) -> int:
+    return asyncio.run(hammer(*args))
+
+
+def run(library, workers, port, clients, connections, duration, total):
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "quick_gallery.cli",
+            "serve",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--gallery",
+            "pagedgallery",
+            "--workers",
+            str(workers),
+            "--recursive",
+            library,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(f"{base_url}/api/items?limit=1")
+        with multiprocessing.Pool(clients) as pool:
+            counts = pool.map(
+                client, [(base_url, connections, duration, total)] * clients
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    return sum(counts) / duration
+
+
+@click.command()
+@click.option("--medias", type=int, default=50_000)
+@click.option("--workers", default="1,2,4,8", help="Comma separated worker counts")
+@click.option("--clients", type=int, default=4, help="Load generating processes")
+@click.option("--connections", type=int, default=16, help="Connections per client")
+@click.option("--duration", type=float, default=10.0)
+@click.option("--port", type=int, default=8798)
+def main(medias, workers, clients, connections, duration, port):
+    print(f"{os.cpu_count()} cpus available")
+    with tempfile.TemporaryDirectory() as library:
+        make_library(library, medias)
+        baseline = None
+        for count in map(int, workers.split(",")):
+            rate = run(library, count, port, clients, connections, duration, medias)
+            baseline = baseline or rate
+            print(f"workers {count:>3}: {rate:10.1f} req/s ({rate / baseline:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import click
+
+DEFAULT_MIX = "jpg=6,png=2,gif=1,mp4=1"
+TAG_VOCABULARY = [f"tag{i:03d}" for i in range(200)]
+
+
+def jpeg_header(width: int, height: int) -> bytes:
+    sof = struct.pack(">BHHB", 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8\xff\xc0" + struct.pack(">H", len(sof) + 2) + sof
+
+
+def png_header(width: int, height: int) -> bytes:
+    ihdr = struct.pack(">II5B", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr
+
+
+def gif_header(width: int, height: int) -> bytes:
+    return b"GIF89a" + struct.pack("<HH", width, height)
+
+
+def mp4_header(width: int, height: int) -> bytes:
+    return struct.pack(">I4s4sI", 16, b"ftyp", b"isom", 0x200)
+
+
+def webm_header(width: int, height: int) -> bytes:
+    return b"\x1a\x45\xdf\xa3"
+
+
+HEADERS = {
+    "jpg": jpeg_header,
+    "png": png_header,
+    "gif": gif_header,
+    "mp4": mp4_header,
+    "webm": webm_header,
+}
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        extension, _, weight = part.partition("=")
+        if extension not in HEADERS:
+            raise click.BadParameter(f"Unknown extension in mix: {extension}")
+        weights[extension] = float(weight or 1)
+    return weights
+
+
+def tree_directories(root: str, depth: int, fanout: int) -> list[str]:
+    directories = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [
+            os.path.join(parent, f"dir_{i:03d}")
+            for parent in level
+            for i in range(fanout)
+        ]
+        directories.extend(level)
+    return directories
+
+
+def make_library(
+    root: str,
+    count: int,
+    depth: int = 2,
+    fanout: int = 8,
+    tag_density: float = 0.3,
+    mix: str = DEFAULT_MIX,
+    file_size: int = 2048,
+    seed: int = 0,
+) -> dict:
+    # a deterministic tree of medias with valid headers, so scanning, mimetype
+    # detection and metadata extraction all see realistic files
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    extensions = rng.choices(list(weights), list(weights.values()), k=count)
+    directories = tree_directories(root, depth, fanout)
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    padding = rng.randbytes(file_size)
+    tag_files = 0
+    for i, extension in enumerate(extensions):
+        directory = directories[i % len(directories)]
+        stem = f"media_{i:08d}"
+        width, height = rng.randrange(64, 4096), rng.randrange(64, 4096)
+        with open(os.path.join(directory, f"{stem}.{extension}"), "wb") as fd:
+            fd.write(HEADERS[extension](width, height))
+            fd.write(padding)
+        if rng.random() < tag_density:
+            tags = rng.sample(TAG_VOCABULARY, rng.randrange(1, 6))
+            with open(os.path.join(directory, f"{stem}-{i % 3}.tags"), "w") as fd:
+                fd.write("\n".join(tags))
+            tag_files += 1
+    return {
+        "medias": count,
+        "directories": len(directories),
+        "tag_files": tag_files,
+        "extensions": {ext: extensions.count(ext) for ext in weights},
+    }
+
+
+def library_options(fxn):
+    fxn = click.option("--seed", type=int, default=0)(fxn)
+    fxn = click.option(
+        "--file-size", type=int, default=2048, help="Bytes of padding per media"
+    )(fxn)
+    fxn = click.option(
+        "--mix", default=DEFAULT_MIX, help="Extension weights, e.g. jpg=6,mp4=1"
+    )(fxn)
+    fxn = click.option(
+        "--tag-density",
+        type=float,
+        default=0.3,
+        help="Fraction of medias with a tag file",
+    )(fxn)
+    fxn = click.option("--fanout", type=int, default=8)(fxn)
+    fxn = click.option("--depth", type=int, default=2)(fxn)
+    fxn = click.option("--medias", type=int, default=10_000)(fxn)
+    return fxn
+
+
+def peak_rss() -> int:
+    # ru_maxrss is KiB on linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def children_peak_rss() -> int:
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def at(q: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": at(0.5),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": samples[-1],
+    }
+
+
+class BenchmarkResults:
+    def __init__(self, benchmark: str, params: dict):
+        self.data = {
+            "benchmark": benchmark,
+            "timestamp": time.time(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": params,
+            "results": {},
+        }
+
+    @property
+    def results(self) -> dict:
+        return self.data["results"]
+
+    def record(self, key: str, value):
+        self.results[key] = value
+        click.echo(f"{key:>32}: {value}", err=True)
+
+    @contextmanager
+    def timed(self, key: str):
+        start = time.perf_counter()
+        yield
+        self.record(key, round(time.perf_counter() - start, 6))
+
+    def write(self, output):
+        json.dump(self.data, output, indent=2, sort_keys=True)
+        output.write("\n")
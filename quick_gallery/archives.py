@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import stat
+import struct
+import tarfile
+import zipfile
+from collections import abc
+from dataclasses import astuple, dataclass
+from pathlib import Path
+
+from .cache import default_cache_dir
+from .media import Media, public_media_path
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ZIP_EXTENSIONS = (".zip", ".cbz")
+TAR_EXTENSIONS = (".tar", ".cbt")
+# signature, 22 bytes of versions/flags/sizes, then the name and extra lengths
+ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+
+ARCHIVE_MEMBERS = metrics.counter(
+    "archive_members_total", "Medias found inside zip and tar archives"
+)
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+
+
+def safe_member_name(name: str) -> bool:
+    # like tarfile's data filter, members may not point outside the archive
+    normalized = os.path.normpath(name)
+    return not (
+        os.path.isabs(normalized)
+        or normalized == "."
+        or ".." in normalized.split(os.sep)
+    )
+
+
+@dataclass(frozen=True)
+class ArchiveMember:
+    name: str
+    size: int
+    # where the member's bytes start inside the archive
+    offset: int
+    compressed: bool
+
+
+def index_zip(path: str) -> list[ArchiveMember]:
+    # the central directory lists every member, but data offsets need each
+    # local header since its extra field may differ from the central one
+    members = []
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as fd:
+        for info in archive.infolist():
+            if info.is_dir() or info.flag_bits & 0x1:
+                continue
+            fd.seek(info.header_offset)
+            header = fd.read(ZIP_LOCAL_HEADER.size)
+            if len(header) < ZIP_LOCAL_HEADER.size:
+                continue
+            signature, name_length, extra_length = ZIP_LOCAL_HEADER.unpack(header)
+            if signature != ZIP_LOCAL_SIGNATURE:
+                continue
+            offset = info.header_offset + len(header) + name_length + extra_length
+            compressed = info.compress_type != zipfile.ZIP_STORED
+            members.append(
+                ArchiveMember(info.filename, info.file_size, offset, compressed)
+            )
+    return members
+
+
+def index_tar(path: str) -> list[ArchiveMember]:
+    # "r:" refuses compressed tars, whose members can't be read in place
+    with tarfile.open(path, "r:") as archive:
+        return [
+            ArchiveMember(member.name, member.size, member.offset_data, False)
+            for member in archive
+            if member.isreg() and not member.issparse()
+        ]
+
+
+class ArchiveIndex:
+    # member lists are cached per archive and reused while its mtime and size
+    # are unchanged, so large tars are only read through once
+    def __init__(self, cache_dir: Path | str | None = None):
+        self.cache_dir = Path(cache_dir or default_cache_dir()) / "archives"
+
+    def members(self, path: str, archive_stat: os.stat_result) -> list[ArchiveMember]:
+        key = hashlib.md5(os.path.abspath(path).encode("utf8")).hexdigest()
+        cache_file = self.cache_dir / f"{key}.json"
+        validator = [archive_stat.st_mtime_ns, archive_stat.st_size]
+        try:
+            cached = json.loads(cache_file.read_text())
+            if cached["stat"] == validator:
+                metrics.cache("archives", hit=True)
+                return [ArchiveMember(*member) for member in cached["members"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        metrics.cache("archives", hit=False)
+        if path.lower().endswith(ZIP_EXTENSIONS):
+            members = index_zip(path)
+        else:
+            members = index_tar(path)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        partial = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.partial")
+        partial.write_text(
+            json.dumps(
+                {"stat": validator, "members": [astuple(m) for m in members]},
+                separators=(",", ":"),
+            )
+        )
+        os.replace(partial, cache_file)
+        return members
+
+
+class MemberFile(io.RawIOBase):
+    # a stored member read in place from its archive
+    def __init__(self, path: str, offset: int, size: int):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = os.pread(self.fd, length, self.offset + self.position)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: self.size}
+        self.position = max(base[whence] + position, 0)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
+
+
+class ArchiveMedia(Media):
+    __slots__ = ("archive", "member", "archive_mtime_ns")
+    local = False
+
+    def __init__(
+        self,
+        archive: str,
+        member: ArchiveMember,
+        archive_mtime_ns: int,
+        public_file=None,
+    ):
+        super().__init__(os.path.join(archive, member.name), public_file=public_file)
+        self.archive = archive
+        self.member = member
+        self.archive_mtime_ns = archive_mtime_ns
+
+    def stat(self) -> os.stat_result:
+        archive_stat = os.stat(self.archive)
+        if archive_stat.st_mtime_ns != self.archive_mtime_ns:
+            # offsets from the old index may now point anywhere
+            raise FileNotFoundError(f"Archive changed since it was indexed: {self}")
+        times = (archive_stat.st_atime, archive_stat.st_mtime, archive_stat.st_ctime)
+        return os.stat_result(
+            (stat.S_IFREG | 0o444, self.inode(archive_stat), archive_stat.st_dev, 1)
+            + (archive_stat.st_uid, archive_stat.st_gid, self.member.size)
+            + times,
+            {
+                "st_atime_ns": archive_stat.st_atime_ns,
+                "st_mtime_ns": archive_stat.st_mtime_ns,
+                "st_ctime_ns": archive_stat.st_ctime_ns,
+            },
+        )
+
+    def inode(self, archive_stat: os.stat_result) -> int:
+        # stable and distinct per member, since caches key on device and inode
+        key = f"{archive_stat.st_ino}:{self.member.offset}".encode("ascii")
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return int.from_bytes(digest, "little") >> 1
+
+    def open(self) -> io.BufferedIOBase:
+        if not self.member.compressed:
+            member_file = MemberFile(self.archive, self.member.offset, self.member.size)
+            return io.BufferedReader(member_file)
+        # only zips index compressed members; the member keeps the archive open
+        return zipfile.ZipFile(self.archive).open(self.member.name)
+
+
+def archive_medias(path: str, index: ArchiveIndex) -> abc.Iterator[ArchiveMedia]:
+    archive_stat = os.stat(path)
+    for member in index.members(path, archive_stat):
+        if not safe_member_name(member.name):
+            logger.warning(f"Skipping unsafe member {member.name!r} of {path}")
+            continue
+        member_path = os.path.join(path, member.name)
+        ARCHIVE_MEMBERS.inc()
+        yield ArchiveMedia(
+            path,
+            member,
+            archive_stat.st_mtime_ns,
+            public_file=public_media_path(member_path, archive_stat.st_mtime_ns),
+        )
+
+
+def expand_archives(
+    medias: abc.Iterable[Media], index: ArchiveIndex | None = None
+) -> abc.Iterator[Media]:
+    # archives in the scan are replaced by their members, which are only
+    # reachable through the server
+    index = index or ArchiveIndex()
+    for media in medias:
+        if not is_archive(media.path):
+            yield media
+            continue
+        try:
+            yield from archive_medias(media.path, index)
+        except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+            logger.warning(f"Could not read archive {media}: {e}")
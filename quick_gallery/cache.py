@@ -0,0 +1,7 @@
+import os
+from pathlib import Path
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "quick-gallery"
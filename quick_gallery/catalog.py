@@ -0,0 +1,245 @@
+import logging
+import os
+import sqlite3
+from collections import abc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .cache import default_cache_dir
+from .discovery import MediaScanner, sniff_medias
+from .media import Media
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    mimetype TEXT,
+    tags TEXT,
+    PRIMARY KEY (directory, name)
+);
+"""
+
+
+def default_catalog_path() -> Path:
+    return default_cache_dir() / "catalog.sqlite"
+
+
+class MediaCatalog:
+    def __init__(self, db_path: Path | str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # sqlite connections are bound to the thread that opened them, so this
+        # is the thread that consumes the scan rather than the one creating it
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path)
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        return self.connection
+
+    def directories(self) -> dict[str, tuple[int, list[str]]]:
+        rows = self.db.execute("SELECT path, mtime_ns, subdirs FROM directories")
+        return {
+            path: (mtime_ns, subdirs.split("\n") if subdirs else [])
+            for path, mtime_ns, subdirs in rows
+        }
+
+    def files(self, directory: str) -> list[tuple]:
+        return self.db.execute(
+            "SELECT name, size, mtime_ns, mimetype, tags FROM files WHERE directory = ?",
+            (directory,),
+        ).fetchall()
+
+    def update_directory(
+        self, directory: str, mtime_ns: int, subdirs: list[str], files: list[tuple]
+    ):
+        self.db.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (directory, mtime_ns, "\n".join(subdirs)),
+        )
+        self.db.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        self.db.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            ((directory, *row) for row in files),
+        )
+
+    def remove_directory(self, directory: str):
+        prefix = directory.rstrip(os.sep) + os.sep
+        for table, column in (("directories", "path"), ("files", "directory")):
+            self.db.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR substr({column}, 1, ?) = ?",
+                (directory, len(prefix), prefix),
+            )
+
+    def file(self, directory: str, name: str) -> tuple | None:
+        return self.db.execute(
+            "SELECT name, size, mtime_ns, mimetype, tags FROM files "
+            "WHERE directory = ? AND name = ?",
+            (directory, name),
+        ).fetchone()
+
+    def tag_files(self) -> dict[str, dict[str, int]]:
+        tag_files = {}
+        rows = self.db.execute(
+            "SELECT directory, name, mtime_ns FROM files WHERE name LIKE '%.tags'"
+        )
+        for directory, name, mtime_ns in rows:
+            tag_files.setdefault(directory, {})[name] = mtime_ns
+        return tag_files
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+def make_media(path: str, mtime_ns, mimetype, tags, public_path_fxn) -> Media:
+    return Media(
+        path,
+        public_file=public_path_fxn(path, mtime_ns),
+        mimetype=mimetype,
+        tags=set(tags.split("\n")) if tags is not None else None,
+    )
+
+
+class CatalogScanner(MediaScanner):
+    def __init__(
+        self, catalog: MediaCatalog, full_rescan=False, catalog_only=False, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.catalog = catalog
+        self.full_rescan = full_rescan
+        # only what the catalog remembers, with the same filters as a scan
+        self.catalog_only = catalog_only
+        self.known: dict[str, tuple[int, list[str]]] = {}
+        self.known_tags: dict[str, dict[str, int]] = {}
+        self.changed: dict[str, tuple[int, list[str]]] = {}
+
+    def scan(self, paths, recursive=False) -> abc.Iterator[Media]:
+        if self.catalog_only:
+            self.known = self.catalog.directories()
+        yield from super().scan(paths, recursive=recursive)
+
+    def walk(self, roots: abc.Iterable[str]) -> abc.Iterator[Media]:
+        self.known = self.catalog.directories()
+        self.known_tags = {} if self.catalog_only else self.catalog.tag_files()
+        self.changed = {}
+        self.sniff_pool = ThreadPoolExecutor(self.workers, thread_name_prefix="sniff")
+        try:
+            yield from super().walk(roots)
+        finally:
+            self.sniff_pool.shutdown(wait=False, cancel_futures=True)
+            self.catalog.commit()
+        logger.debug(
+            f"Catalog rescanned {len(self.changed)} of {len(self.known)} known directories"
+        )
+
+    def list_dir(self, path: str) -> tuple[list[str] | None, list[str]]:
+        key = os.path.abspath(path)
+        known = self.known.get(key)
+        if self.catalog_only:
+            if known is None:
+                raise FileNotFoundError(f"Not in the catalog: {path}")
+            return None, [os.path.join(path, subdir) for subdir in known[1]]
+        mtime_ns = os.stat(path).st_mtime_ns
+        if (
+            known
+            and known[0] == mtime_ns
+            and not self.full_rescan
+            and self.tags_unchanged(key)
+        ):
+            metrics.cache("catalog", hit=True)
+            return None, [os.path.join(path, subdir) for subdir in known[1]]
+        metrics.cache("catalog", hit=False)
+        files, subdirs = super().list_dir(path)
+        self.changed[path] = (mtime_ns, sorted(os.path.basename(s) for s in subdirs))
+        return files, subdirs
+
+    def tags_unchanged(self, directory: str) -> bool:
+        # tag files edited in place leave the directory mtime alone, but the
+        # catalog holds the tags they gave each media
+        for name, mtime_ns in self.known_tags.get(directory, {}).items():
+            try:
+                if os.stat(os.path.join(directory, name)).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def is_directory(self, path: Path) -> bool:
+        if self.catalog_only:
+            return os.path.abspath(path) in self.known
+        return super().is_directory(path)
+
+    def make_media(self, path: str) -> Media:
+        if self.catalog_only:
+            directory, name = os.path.split(os.path.abspath(path))
+            if row := self.catalog.file(directory, name):
+                _, _, mtime_ns, mimetype, tags = row
+                return make_media(path, mtime_ns, mimetype, tags, self.public_path_fxn)
+        return super().make_media(path)
+
+    def scan_dir(self, path: str) -> tuple[list | None, list[str]]:
+        # changed directories are stat'ed and sniffed here in the scan pool; the
+        # catalog itself is only used from the thread consuming the scan
+        files, subdirs = self.list_dir(path)
+        if files is None:
+            return None, subdirs
+        scanned = []
+        for file in files:
+            try:
+                stat = os.stat(file)
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+            except OSError:
+                size = mtime_ns = None
+            media = Media(file, public_file=self.public_path_fxn(file, mtime_ns))
+            scanned.append((media, size, mtime_ns))
+        # sniffed mimetypes are stored, so unchanged directories are never re-read
+        sniff_medias([media for media, _, _ in scanned], self.sniff_pool)
+        return scanned, subdirs
+
+    def medias_for(self, directory: str, scanned: list | None) -> abc.Iterator[Media]:
+        key = os.path.abspath(directory)
+        if scanned is None:
+            for name, _, mtime_ns, mimetype, tags in self.catalog.files(key):
+                path = os.path.join(directory, name)
+                if self.is_included(path):
+                    yield make_media(
+                        path, mtime_ns, mimetype, tags, self.public_path_fxn
+                    )
+            return
+
+        rows = []
+        medias = []
+        for media, size, mtime_ns in scanned:
+            mimetype = media.mimetype()
+            tags = "\n".join(sorted(media.tags())) if mimetype else None
+            rows.append((media.name, size, mtime_ns, mimetype, tags))
+            if self.is_included(media.path):
+                medias.append(media)
+
+        mtime_ns, subdirs = self.changed[directory]
+        previous = self.known.get(key)
+        if previous:
+            for removed in set(previous[1]) - set(subdirs):
+                self.catalog.remove_directory(os.path.join(key, removed))
+        self.catalog.update_directory(key, mtime_ns, subdirs, rows)
+        yield from medias
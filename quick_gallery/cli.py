@@ -1,34 +1,228 @@
-import hashlib
+import functools
 import logging
-import sys
+import os
+import time
 from collections import abc
 from pathlib import Path
 
 import click
 
 from . import galleries
-from .media import Media
+from .archives import expand_archives
+from .cache import default_cache_dir
+from .catalog import CatalogScanner, MediaCatalog, default_catalog_path
+from .dedup import Deduplicator
+from .discovery import MediaScanner, classify
+from .export import DEFAULT_SHARD_SIZE, ShardedExporter
+from .media import Media, public_media_path
+from .metadata import SORT_KEYS, MetadataExtractor, sort_medias
+from .metrics import metrics
 from .server import AioHttpServer
+from .streaming import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_OPEN_FILES,
+    MediaStreamer,
+    parse_size,
+)
+from .thumbnails import THUMBNAIL_SIZE, ThumbnailCache
+from .watcher import PollingWatcher
 
 GALLERY_LOOKUP = {g.name: g for g in galleries.galleries}
 logger = logging.getLogger(__name__)
 
 
-def resolve_files(
-    paths, recursive=False, public_path_fxn=lambda x: None
+class ByteSize(click.ParamType):
+    name = "size"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            size = parse_size(value)
+        except (ValueError, OverflowError):
+            self.fail(f"{value!r} is not a size like 512k or 10M", param, ctx)
+        if size <= 0:
+            self.fail(f"{value!r} must be larger than zero", param, ctx)
+        return size
+
+
+def resolve_files(paths, dedup=False, archives=False, **options) -> abc.Iterable[Media]:
+    medias = find_files(paths, **options)
+    if archives:
+        medias = expand_archives(medias)
+    medias = counted_scan(classify(medias))
+    if dedup:
+        return deduplicate_medias(medias)
+    return medias
+
+
+def deduplicate_medias(medias: abc.Iterable[Media]) -> list[Media]:
+    with phase_timer("dedup").time():
+        return Deduplicator().deduplicate(sorted(medias))
+
+
+def counted_scan(medias: abc.Iterable[Media]) -> abc.Iterator[Media]:
+    scanned = metrics.counter("files_scanned_total", "Medias produced by the scan")
+    for media in phase_timer("scan").timed_iter(medias):
+        scanned.inc()
+        yield media
+
+
+def phase_timer(phase: str):
+    return metrics.timer("phase_seconds", "Time spent per phase", phase=phase)
+
+
+def print_profile(wall: float):
+    # phases are lazy and nest, e.g. scanning happens while rendering pulls medias
+    click.echo(f"{'wall':<50} {wall:10.3f}s", err=True)
+    for name, count, total in metrics.timings():
+        click.echo(f"{name:<50} {total:10.3f}s {count:>10} calls", err=True)
+    for name, value in metrics.counts():
+        click.echo(f"{name:<50} {value:>11}", err=True)
+
+
+def find_files(
+    paths,
+    recursive=False,
+    public_path_fxn=lambda path, mtime_ns=None: None,
+    catalog=None,
+    full_rescan=False,
+    catalog_only=False,
+    use_catalog=False,
+    **scan_options,
 ) -> abc.Iterable[Media]:
-    for path in paths:
-        if recursive and path.is_dir():
-            yield from resolve_files(
-                path.iterdir(), recursive=recursive, public_path_fxn=public_path_fxn
-            )
-        elif path == Path("-"):
-            paths_stdin = (Path(line.strip()) for line in sys.stdin)
-            yield from resolve_files(
-                paths_stdin, recursive=recursive, public_path_fxn=public_path_fxn
-            )
-        else:
-            yield Media(path, public_file=public_path_fxn(path))
+    if use_catalog and catalog is None:
+        catalog = default_catalog_path()
+    if catalog is None:
+        scanner = MediaScanner(public_path_fxn=public_path_fxn, **scan_options)
+        return scanner.scan(paths, recursive=recursive)
+    scanner = CatalogScanner(
+        MediaCatalog(catalog),
+        full_rescan=full_rescan,
+        catalog_only=catalog_only,
+        public_path_fxn=public_path_fxn,
+        **scan_options,
+    )
+    return scanner.scan(paths, recursive=recursive)
+
+
+def order_medias(
+    medias: abc.Iterable[Media],
+    sort="path",
+    reverse=False,
+    metadata=False,
+    dedup=False,
+) -> list[Media]:
+    medias = deduplicate_medias(medias) if dedup else list(medias)
+    if metadata or sort != "path":
+        with phase_timer("metadata").time():
+            MetadataExtractor().extract(medias)
+    return sort_medias(medias, sort, reverse=reverse)
+
+
+def scan_options(fxn):
+    options = [
+        click.option(
+            "--include",
+            multiple=True,
+            help="Only include files matching this glob (repeatable)",
+        ),
+        click.option(
+            "--exclude",
+            multiple=True,
+            help="Skip files and directories matching this glob (repeatable)",
+        ),
+        click.option(
+            "--max-depth",
+            type=int,
+            default=None,
+            help="Maximum number of directory levels to descend when recursive",
+        ),
+        click.option(
+            "--scan-workers",
+            "workers",
+            type=int,
+            default=None,
+            help="Number of threads used to list directories",
+        ),
+        click.option(
+            "--catalog",
+            "use_catalog",
+            is_flag=True,
+            default=False,
+            help="Keep an on-disk media catalog and only rescan changed directories",
+        ),
+        click.option(
+            "--catalog-path",
+            "catalog",
+            type=click.Path(path_type=Path, dir_okay=False),
+            default=None,
+            help="Location of the media catalog (implies --catalog)",
+        ),
+        click.option(
+            "--full-rescan",
+            is_flag=True,
+            default=False,
+            help="Re-examine every directory even if the catalog says it is unchanged",
+        ),
+        click.option(
+            "--catalog-only",
+            is_flag=True,
+            default=False,
+            help="Load medias straight from the catalog without touching the filesystem",
+        ),
+        click.option(
+            "--dedup",
+            is_flag=True,
+            default=False,
+            help="Show byte-identical files only once (fingerprints are cached)",
+        ),
+    ]
+    for option in reversed(options):
+        fxn = option(fxn)
+    return fxn
+
+
+def thumbnail_options(fxn):
+    options = [
+        click.option(
+            "--cache-dir",
+            type=click.Path(path_type=Path, file_okay=False),
+            default=default_cache_dir,
+            help="Where generated thumbnails are cached",
+        ),
+        click.option("--thumbnail-size", type=int, default=THUMBNAIL_SIZE),
+        click.option(
+            "--thumbnail-workers",
+            type=int,
+            default=None,
+            help="Number of processes used to generate thumbnails",
+        ),
+    ]
+    for option in reversed(options):
+        fxn = option(fxn)
+    return fxn
+
+
+def metadata_options(fxn):
+    options = [
+        click.option(
+            "--sort",
+            type=click.Choice(SORT_KEYS, case_sensitive=False),
+            default=None,
+            help="Order of the gallery; anything but path reads media metadata",
+        ),
+        click.option("--reverse", is_flag=True, default=False),
+        click.option(
+            "--metadata",
+            is_flag=True,
+            default=False,
+            help="Read dimensions, dates and durations to reserve exact placeholders",
+        ),
+    ]
+    for option in reversed(options):
+        fxn = option(fxn)
+    return fxn
 
 
 @click.group()
@@ -56,12 +250,102 @@ def cli(debug, silent):
     type=click.Choice(list(GALLERY_LOOKUP.keys()), case_sensitive=False),
     default=galleries.default_gallery.name,
 )
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Print a per-phase timing breakdown to stderr when done",
+)
+@metadata_options
+@scan_options
 @click.argument("media", type=click.Path(path_type=Path, allow_dash=True), nargs=-1)
-def static(recursive, gallery_name, output, media):
-    medias = resolve_files(media, recursive=recursive)
+def static(
+    recursive,
+    gallery_name,
+    output,
+    media,
+    sort,
+    reverse,
+    metadata,
+    profile,
+    **scan_kwargs,
+):
     GalleryType = GALLERY_LOOKUP[gallery_name]
+    if GalleryType.requires_server:
+        raise click.UsageError(f"{gallery_name} can only be used with serve")
+    start = time.perf_counter()
+    medias = resolve_files(media, recursive=recursive, **scan_kwargs)
+    if sort or reverse or metadata:
+        medias = order_medias(medias, sort or "path", reverse, metadata)
     gallery = GalleryType(medias)
-    output.write(gallery.html())
+    gallery.write_html(output)
+    if profile:
+        output.flush()
+        print_profile(time.perf_counter() - start)
+
+
+@cli.command()
+@click.option("--recursive", is_flag=True, default=False)
+@click.option(
+    "--output",
+    type=click.Path(file_okay=False, path_type=Path),
+    required=True,
+    help="Directory for index.html, its assets and the item shards",
+)
+@click.option(
+    "--gallery",
+    "gallery_name",
+    type=click.Choice(list(GALLERY_LOOKUP.keys()), case_sensitive=False),
+    default=galleries.default_gallery.name,
+    help="Gallery whose records are exported",
+)
+@click.option(
+    "--shard-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SHARD_SIZE,
+    help="Average number of medias per shard",
+)
+@click.option(
+    "--tag-index",
+    is_flag=True,
+    default=False,
+    help="Write a tag to shard index so tag filters only fetch matching shards",
+)
+@click.option("--export-workers", type=int, default=None)
+@metadata_options
+@scan_options
+@click.argument("media", type=click.Path(path_type=Path, allow_dash=True), nargs=-1)
+def export(
+    recursive,
+    output,
+    gallery_name,
+    shard_size,
+    tag_index,
+    export_workers,
+    media,
+    sort,
+    reverse,
+    metadata,
+    **scan_kwargs,
+):
+    GalleryType = GALLERY_LOOKUP[gallery_name]
+    if tag_index and not issubclass(GalleryType, galleries.TagGallery):
+        raise click.UsageError("--tag-index needs a gallery with tags")
+    medias = resolve_files(media, recursive=recursive, **scan_kwargs)
+    # a stable order keeps unchanged shards byte identical between exports
+    medias = order_medias(medias, sort or "path", reverse, metadata)
+    gallery = GalleryType(relative_to(medias, output))
+    exporter = ShardedExporter(
+        output, shard_size=shard_size, tag_index=tag_index, workers=export_workers
+    )
+    exporter.export(gallery.gallery_records())
+
+
+def relative_to(medias: abc.Iterable[Media], directory: Path) -> abc.Iterator[Media]:
+    # the exported page lives in its own directory, so links are relative to it
+    for media in medias:
+        media.public_file = os.path.relpath(media.path, directory)
+        yield media
 
 
 @cli.command()
@@ -74,24 +358,160 @@ def static(recursive, gallery_name, output, media):
     type=click.Choice(list(GALLERY_LOOKUP.keys()), case_sensitive=False),
     default=galleries.default_gallery.name,
 )
+@click.option(
+    "--thumbnails",
+    is_flag=True,
+    default=False,
+    help="Show downscaled thumbnails and only load the highlighted original",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Pick up created, deleted and renamed files while serving (needs --recursive)",
+)
+@click.option("--watch-interval", type=float, default=2.0)
+@click.option(
+    "--chunk-size",
+    type=ByteSize(),
+    default=DEFAULT_CHUNK_SIZE,
+    help="Read size used when streaming media, e.g. 256k or 1M",
+)
+@click.option(
+    "--rate-limit",
+    type=ByteSize(),
+    default=None,
+    help="Per-client bandwidth limit in bytes per second, e.g. 10M",
+)
+@click.option(
+    "--max-open-files",
+    type=int,
+    default=DEFAULT_MAX_OPEN_FILES,
+    help="Maximum number of media files streamed at the same time",
+)
+@click.option(
+    "--workers",
+    "server_workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Worker processes sharing the listening socket and the media index; "
+    "/metrics only reports the worker answering it, labelled with its number",
+)
+@click.option(
+    "--archives",
+    is_flag=True,
+    default=False,
+    help="Show the medias inside zip and tar archives without extracting them",
+)
+@thumbnail_options
+@metadata_options
+@scan_options
 @click.argument("media", type=click.Path(path_type=Path, allow_dash=True), nargs=-1)
-def serve(host, port, gallery_name, recursive, media):
-    medias = list(
-        resolve_files(
-            media,
-            recursive=recursive,
-            public_path_fxn=lambda p: "media/"
-            + hashlib.md5(str(p).encode("utf8")).hexdigest(),
-        )
+def serve(
+    host,
+    port,
+    gallery_name,
+    recursive,
+    media,
+    thumbnails,
+    cache_dir,
+    thumbnail_size,
+    thumbnail_workers,
+    watch,
+    watch_interval,
+    chunk_size,
+    rate_limit,
+    max_open_files,
+    server_workers,
+    archives,
+    sort,
+    reverse,
+    metadata,
+    **scan_kwargs,
+):
+    if watch and not recursive:
+        raise click.UsageError("--watch requires --recursive")
+    if watch and server_workers > 1:
+        raise click.UsageError("--watch can only be used with a single worker")
+    if watch and scan_kwargs["dedup"]:
+        raise click.UsageError("--watch can not be combined with --dedup")
+    public_path_fxn = public_media_path
+    # scanned lazily by the server so it can start answering right away; dedup
+    # needs the whole library, so it runs with the ordering once the scan is done
+    dedup = scan_kwargs.pop("dedup")
+    medias = resolve_files(
+        media,
+        recursive=recursive,
+        public_path_fxn=public_path_fxn,
+        archives=archives,
+        **scan_kwargs,
     )
-    medias.sort()
-    logger.debug("Resolved %d medias", len(medias))
     GalleryType = GALLERY_LOOKUP[gallery_name]
-    gallery = GalleryType(medias)
-    server = AioHttpServer(host, port, gallery, medias)
+    gallery = GalleryType([], thumbnails=thumbnails)
+    thumbnail_cache = None
+    if thumbnails:
+        thumbnail_cache = ThumbnailCache(
+            cache_dir, size=thumbnail_size, workers=thumbnail_workers
+        )
+        if not thumbnail_cache.supported_types():
+            logger.warning("Install Pillow and/or ffmpeg to generate thumbnails")
+    watcher = None
+    if watch:
+        scanner = MediaScanner(
+            public_path_fxn=public_path_fxn,
+            include=scan_kwargs["include"],
+            exclude=scan_kwargs["exclude"],
+            max_depth=scan_kwargs["max_depth"],
+        )
+        watcher = PollingWatcher([m for m in media if m.is_dir()], scanner)
+    server = AioHttpServer(
+        host,
+        port,
+        gallery,
+        medias,
+        thumbnails=thumbnail_cache,
+        watcher=watcher,
+        watch_interval=watch_interval,
+        streamer=MediaStreamer(
+            chunk_size=chunk_size,
+            rate_limit=rate_limit,
+            max_open_files=max_open_files,
+        ),
+        workers=server_workers,
+        order=functools.partial(
+            order_medias,
+            sort=sort or "path",
+            reverse=reverse,
+            metadata=metadata,
+            dedup=dedup,
+        ),
+    )
     server.start()
 
 
+@cli.command()
+@click.option("--recursive", is_flag=True, default=False)
+@thumbnail_options
+@scan_options
+@click.argument("media", type=click.Path(path_type=Path, allow_dash=True), nargs=-1)
+def thumbnails(
+    recursive, media, cache_dir, thumbnail_size, thumbnail_workers, **scan_kwargs
+):
+    thumbnail_cache = ThumbnailCache(
+        cache_dir, size=thumbnail_size, workers=thumbnail_workers
+    )
+    if not thumbnail_cache.supported_types():
+        raise click.ClickException(
+            "Install Pillow and/or ffmpeg to generate thumbnails"
+        )
+    medias = resolve_files(media, recursive=recursive, **scan_kwargs)
+    try:
+        generated = thumbnail_cache.prewarm(medias)
+    finally:
+        thumbnail_cache.close()
+    logger.info(f"Generated {generated} thumbnails in {thumbnail_cache.cache_dir}")
+
+
 def main():
     cli(auto_envvar_prefix="QUICK_GALLERY_")
 
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import abc, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .cache import default_cache_dir
+from .media import Media
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_BLOCK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial TEXT,
+    full TEXT,
+    PRIMARY KEY (device, inode)
+);
+"""
+
+
+def default_fingerprint_path() -> Path:
+    return default_cache_dir() / "fingerprints.sqlite"
+
+
+def partial_hash(media: Media, size: int) -> str:
+    # first and last block; most distinct files of equal size differ in either
+    digest = hashlib.blake2b(digest_size=16)
+    with media.open() as fd:
+        digest.update(fd.read(PARTIAL_BLOCK_SIZE))
+        if size > 2 * PARTIAL_BLOCK_SIZE:
+            fd.seek(-PARTIAL_BLOCK_SIZE, os.SEEK_END)
+            digest.update(fd.read(PARTIAL_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(media: Media) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with media.open() as fd:
+        while chunk := fd.read(READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_media_path(digest: str, stat: os.stat_result) -> str:
+    # same shape as public_media_path so the mtime suffix still drives caching
+    return f"media/{digest}-{stat.st_mtime_ns:x}"
+
+
+class FingerprintCache:
+    def __init__(self, db_path: Path | str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def lookup(self, stat: os.stat_result) -> tuple[str | None, str | None]:
+        row = self.db.execute(
+            "SELECT partial, full FROM fingerprints "
+            "WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        return row or (None, None)
+
+    def store(self, stat: os.stat_result, partial: str | None, full: str | None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                stat.st_dev,
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime_ns,
+                partial,
+                full,
+            ),
+        )
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class Deduplicator:
+    def __init__(
+        self, cache_path: Path | str | None = None, workers: int | None = None
+    ):
+        self.cache = FingerprintCache(cache_path or default_fingerprint_path())
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+
+    def deduplicate(self, medias: abc.Iterable[Media]) -> list[Media]:
+        # keeps the first media of every group of identical files, in order
+        medias = list(medias)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="dedup") as pool:
+            stats = list(pool.map(self.safe_stat, medias))
+            by_size = defaultdict(list)
+            for media, stat in zip(medias, stats):
+                if stat is not None and stat.st_size:
+                    by_size[stat.st_size].append((media, stat))
+            groups = [(None, group) for group in by_size.values() if len(group) > 1]
+            groups = self.split(pool, groups, "partial")
+            # the partial hash of a small file already covers all of its bytes
+            small = [g for g in groups if g[1][0][1].st_size <= PARTIAL_BLOCK_SIZE]
+            large = [g for g in groups if g[1][0][1].st_size > PARTIAL_BLOCK_SIZE]
+            groups = small + self.split(pool, large, "full")
+        self.cache.close()
+
+        dropped = set()
+        saved = 0
+        for digest, ((first, first_stat), *rest) in groups:
+            if first.public_file != first.path:
+                # served medias get one content addressed url per group
+                first.public_file = content_media_path(digest, first_stat)
+            dropped.update(media.path for media, _ in rest)
+            saved += first_stat.st_size * len(rest)
+        if dropped:
+            logger.info(
+                f"Collapsed {len(dropped)} duplicate medias ({saved / 1024**2:.1f} MiB)"
+            )
+        return [media for media in medias if media.path not in dropped]
+
+    def split(self, pool, groups: list[tuple], kind: str) -> list[tuple]:
+        entries = [entry for _, group in groups for entry in group]
+        column = 0 if kind == "partial" else 1
+        cached = [self.cache.lookup(stat) for _, stat in entries]
+        missing = [i for i, row in enumerate(cached) if row[column] is None]
+        computed = pool.map(self.safe_hash, ((kind, *entries[i]) for i in missing))
+        digests = [row[column] for row in cached]
+        for i, digest in zip(missing, computed):
+            digests[i] = digest
+            if digest is not None:
+                row = list(cached[i])
+                row[column] = digest
+                self.cache.store(entries[i][1], *row)
+        self.cache.commit()
+
+        by_key = defaultdict(list)
+        for (media, stat), digest in zip(entries, digests):
+            if digest is not None:
+                by_key[(stat.st_size, digest)].append((media, stat))
+        return [
+            (digest, group) for (_, digest), group in by_key.items() if len(group) > 1
+        ]
+
+    @staticmethod
+    def safe_stat(media: Media) -> os.stat_result | None:
+        try:
+            return media.stat()
+        except OSError as e:
+            logger.debug(f"Could not stat {media}: {e}")
+            return None
+
+    @staticmethod
+    def safe_hash(args) -> str | None:
+        kind, media, stat = args
+        try:
+            if kind == "partial":
+                return partial_hash(media, stat.st_size)
+            return full_hash(media)
+        except OSError as e:
+            logger.debug(f"Could not fingerprint {media}: {e}")
+            return None
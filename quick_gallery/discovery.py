@@ -0,0 +1,161 @@
+import fnmatch
+import logging
+import os
+import re
+import sys
+from collections import abc
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
+from pathlib import Path
+
+from .media import Media
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIES_LISTED = metrics.counter(
+    "directories_listed_total", "Directories listed from the filesystem"
+)
+MEDIAS_SNIFFED = metrics.counter(
+    "medias_sniffed_total", "Medias classified by reading their first bytes"
+)
+CLASSIFY_BATCH_SIZE = 1024
+
+
+def sniff_medias(medias: abc.Iterable[Media], pool: Executor) -> int:
+    # extensions are memoized, so only files with unknown ones are read
+    unknown = [media for media in medias if media.mimetype() is None]
+    if unknown:
+        for _ in pool.map(Media.sniff_mimetype, unknown):
+            pass
+        MEDIAS_SNIFFED.inc(len(unknown))
+    return len(unknown)
+
+
+def classify(
+    medias: abc.Iterable[Media],
+    workers: int | None = None,
+    batch_size: int = CLASSIFY_BATCH_SIZE,
+) -> abc.Iterator[Media]:
+    # medias stream through in batches so lazy scans stay lazy
+    pool = ThreadPoolExecutor(
+        workers or min(32, (os.cpu_count() or 1) * 4), thread_name_prefix="classify"
+    )
+    medias = iter(medias)
+    try:
+        while batch := list(islice(medias, batch_size)):
+            sniff_medias(batch, pool)
+            yield from batch
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def compile_globs(patterns: abc.Iterable[str]) -> re.Pattern | None:
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+class MediaScanner:
+    def __init__(
+        self,
+        include: abc.Iterable[str] = (),
+        exclude: abc.Iterable[str] = (),
+        max_depth: int | None = None,
+        workers: int | None = None,
+        public_path_fxn=lambda path, mtime_ns=None: None,
+    ):
+        self.include = compile_globs(include)
+        self.exclude = compile_globs(exclude)
+        self.max_depth = max_depth
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.public_path_fxn = public_path_fxn
+
+    def scan(self, paths, recursive=False) -> abc.Iterator[Media]:
+        directories = []
+        for path in paths:
+            if path == Path("-"):
+                paths_stdin = (Path(line.strip()) for line in sys.stdin)
+                yield from self.scan(paths_stdin, recursive=recursive)
+            elif recursive and self.is_directory(path):
+                if not self.is_excluded(str(path)):
+                    directories.append(str(path))
+            elif self.is_included(str(path)):
+                yield self.make_media(str(path))
+        if directories:
+            yield from self.walk(directories)
+
+    def walk(self, roots: abc.Iterable[str]) -> abc.Iterator[Media]:
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="scan")
+        pending: dict[Future, tuple[str, int]] = {}
+        try:
+            for root in roots:
+                pending[pool.submit(self.scan_dir, root)] = (root, 0)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, depth = pending.pop(future)
+                    try:
+                        listed, subdirs = future.result()
+                    except OSError as e:
+                        logger.warning(f"Could not list directory: {e}")
+                        continue
+                    if self.max_depth is None or depth < self.max_depth:
+                        for subdir in subdirs:
+                            if not self.is_excluded(subdir):
+                                listing = pool.submit(self.scan_dir, subdir)
+                                pending[listing] = (subdir, depth + 1)
+                    yield from self.medias_for(directory, listed)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def scan_dir(self, path: str) -> tuple[list, list[str]]:
+        # runs in the scan pool, so the stat behind each public path happens in
+        # parallel rather than on the thread consuming the scan
+        files, subdirs = self.list_dir(path)
+        medias = [self.make_media(file) for file in files if self.is_included(file)]
+        return medias, subdirs
+
+    def medias_for(self, directory: str, medias: list[Media]) -> abc.Iterator[Media]:
+        yield from medias
+
+    def list_dir(self, path: str) -> tuple[list[str], list[str]]:
+        DIRECTORIES_LISTED.inc()
+        files, subdirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                (subdirs if is_dir else files).append(entry.path)
+        return files, subdirs
+
+    def is_directory(self, path: Path) -> bool:
+        return path.is_dir()
+
+    def make_media(self, path: str) -> Media:
+        return Media(path, public_file=self.public_path_fxn(path))
+
+    def is_included(self, path: str) -> bool:
+        if self.is_excluded(path):
+            return False
+        if self.include is None:
+            return True
+        return bool(
+            self.include.match(os.path.basename(path)) or self.include.match(path)
+        )
+
+    def is_excluded(self, path: str) -> bool:
+        if self.exclude is None:
+            return False
+        return bool(
+            self.exclude.match(os.path.basename(path)) or self.exclude.match(path)
+        )
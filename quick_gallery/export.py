@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+from collections import Counter, abc, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .galleries.assets import CompactRecords
+from .galleries.sharded_gallery import ShardedGallery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_SIZE = 5000
+SHARD_DIR = "shards"
+ASSET_DIR = "assets"
+
+
+def is_boundary(src: str, shard_size: int) -> bool:
+    return zlib.crc32(src.encode("utf8")) % max(shard_size // 2, 1) == 0
+
+
+def content_defined_shards(
+    records: abc.Iterable[dict], shard_size: int
+) -> abc.Iterator[list[dict]]:
+    # cut points depend on the records themselves rather than their position, so
+    # adding or removing a media only changes the shard it falls into
+    minimum, maximum = shard_size // 2, shard_size * 4
+    shard = []
+    for record in records:
+        shard.append(record)
+        if len(shard) >= maximum or (
+            len(shard) >= minimum and is_boundary(record["src"], shard_size)
+        ):
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def compact_json(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf8")
+
+
+class ShardedExporter:
+    def __init__(
+        self,
+        output_dir: Path | str,
+        shard_size: int = DEFAULT_SHARD_SIZE,
+        tag_index: bool = False,
+        workers: int | None = None,
+    ):
+        self.output_dir = Path(output_dir)
+        self.shard_size = shard_size
+        self.tag_index = tag_index
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+
+    def export(self, records: abc.Iterable[dict]) -> dict:
+        (self.output_dir / SHARD_DIR).mkdir(parents=True, exist_ok=True)
+        shards = []
+        tag_shards = defaultdict(set)
+        tag_counts = Counter()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="export") as pool:
+            writes = []
+            for number, shard in enumerate(
+                content_defined_shards(records, self.shard_size)
+            ):
+                encoder = CompactRecords()
+                items = encoder.encode_all(shard)
+                body = compact_json({"tables": encoder.tables(), "items": items})
+                name = self.file_name(SHARD_DIR, "items", body)
+                shards.append({"name": name, "count": len(shard)})
+                writes.append(pool.submit(self.write, name, body))
+                for record in shard:
+                    for tag in record.get("tags", ()):
+                        tag_shards[tag].add(number)
+                        tag_counts[tag] += 1
+            tag_index = None
+            if self.tag_index:
+                body = compact_json(
+                    {tag: sorted(ids) for tag, ids in sorted(tag_shards.items())}
+                )
+                tag_index = self.file_name(SHARD_DIR, "tags", body)
+                writes.append(pool.submit(self.write, tag_index, body))
+            written = sum(write.result() for write in writes)
+        keep = {shard["name"] for shard in shards} | {tag_index}
+        removed = self.remove_stale(SHARD_DIR, keep)
+        manifest = {
+            "total": sum(shard["count"] for shard in shards),
+            "shards": shards,
+            "tag_index": tag_index,
+            "tag_counts": dict(tag_counts.most_common()),
+        }
+        self.write_page(ShardedGallery(manifest))
+        stats = {
+            "medias": manifest["total"],
+            "files": len(writes),
+            "written": written,
+            "unchanged": len(writes) - written,
+            "removed": removed,
+        }
+        logger.info(
+            f"Exported {stats['medias']} medias in {len(shards)} shards: "
+            f"{written} written, {stats['unchanged']} unchanged, {removed} removed"
+        )
+        return stats
+
+    @staticmethod
+    def file_name(directory: str, kind: str, body: bytes) -> str:
+        digest = hashlib.blake2b(body, digest_size=10).hexdigest()
+        return f"{directory}/{kind}-{digest}.json.gz"
+
+    def write(self, name: str, body: bytes) -> bool:
+        # names are content addressed, so an existing file is already up to date
+        path = self.output_dir / name
+        if path.exists():
+            return False
+        self.replace(path, gzip.compress(body, compresslevel=9, mtime=0))
+        return True
+
+    @staticmethod
+    def replace(path: Path, data: bytes):
+        partial = path.with_name(f".{path.name}.partial")
+        partial.write_bytes(data)
+        os.replace(partial, path)
+
+    def remove_stale(self, directory: str, keep: abc.Collection[str]) -> int:
+        removed = 0
+        for entry in os.scandir(self.output_dir / directory):
+            if entry.is_file() and f"{directory}/{entry.name}" not in keep:
+                os.unlink(entry.path)
+                removed += 1
+        return removed
+
+    def write_page(self, gallery: ShardedGallery):
+        (self.output_dir / ASSET_DIR).mkdir(exist_ok=True)
+        assets = gallery.assets().files
+        for name, (_, body) in assets.items():
+            if not (path := self.output_dir / ASSET_DIR / name).exists():
+                self.replace(path, body)
+        self.remove_stale(ASSET_DIR, {f"{ASSET_DIR}/{name}" for name in assets})
+        page = gallery.html().encode("utf8")
+        path = self.output_dir / "index.html"
+        if not path.exists() or path.read_bytes() != page:
+            self.replace(path, page)
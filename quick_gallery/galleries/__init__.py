@@ -1,6 +1,8 @@
 from .base_gallery import BaseGallery
+from .paged_gallery import PagedGallery
+from .similar_gallery import SimilarGallery
 from .simple_gallery import SimpleGallery
 from .tag_gallery import TagGallery
 
 default_gallery = SimpleGallery
-galleries = [TagGallery, SimpleGallery]
+galleries = [TagGallery, SimpleGallery, PagedGallery, SimilarGallery]
@@ -0,0 +1,228 @@
+import hashlib
+import json
+from collections import abc
+
+# record keys the compact item encoding stores positionally
+CORE_KEYS = {"src", "mimetype", "thumb", "tags", "width", "height"}
+
+
+def fingerprint(stem: str, extension: str, body: bytes) -> str:
+    return f"{stem}-{hashlib.sha256(body).hexdigest()[:16]}.{extension}"
+
+
+def script_json(value) -> str:
+    # safe to embed in a <script> element: "</script>" can never appear
+    return json.dumps(value, separators=(",", ":")).replace("<", "\\u003c")
+
+
+def split_template(template: str, *names: str) -> list[str]:
+    segments = []
+    for name in names:
+        segment, template = template.split(f"{{{name}}}")
+        segments.append(segment)
+    segments.append(template)
+    return segments
+
+
+class GalleryAssets:
+    def __init__(self, css: str, js: str):
+        self.css = css
+        self.js = js
+        self.files: dict[str, tuple[str, bytes]] = {}
+        self.css_name = self.add("gallery", "css", "text/css", css)
+        self.js_name = self.add("gallery", "js", "application/javascript", js)
+
+    def add(self, stem: str, extension: str, content_type: str, body: str) -> str:
+        encoded = body.encode("utf8")
+        name = fingerprint(stem, extension, encoded)
+        self.files[name] = (content_type, encoded)
+        return name
+
+    def head(self, inline: bool) -> str:
+        if inline:
+            return f"<style>{self.css}</style>\n    <script>{self.js}</script>"
+        return (
+            f'<link rel="stylesheet" href="assets/{self.css_name}">\n'
+            f'    <script src="assets/{self.js_name}" defer></script>'
+        )
+
+
+class CompactRecords:
+    # items are [directory, name, mimetype << 1 | thumb, tags, width, height, extra]
+    # with directories, mimetypes and tags interned into tables sent once per
+    # page; trailing defaults are dropped. EXPAND_ITEM_JS undoes this
+    def __init__(self):
+        self.directories: dict[str, int] = {}
+        self.mimetypes: dict[str, int] = {}
+        self.tags: dict[str, int] = {}
+
+    @staticmethod
+    def intern(table: dict[str, int], value: str) -> int:
+        return table.setdefault(value, len(table))
+
+    def encode(self, record: dict) -> list:
+        src = record["src"]
+        split = src.rfind("/") + 1
+        name = src[split:]
+        extra = {key: value for key, value in record.items() if key not in CORE_KEYS}
+        thumb = record.get("thumb")
+        if thumb is not None and thumb != f"thumb/{name}":
+            extra["thumb"] = thumb
+        kind = self.intern(self.mimetypes, record["mimetype"]) << 1
+        item = [
+            self.intern(self.directories, src[:split]),
+            name,
+            kind | (thumb == f"thumb/{name}"),
+            (
+                [self.intern(self.tags, tag) for tag in record["tags"]]
+                if "tags" in record
+                else 0
+            ),
+            record.get("width", 0),
+            record.get("height", 0),
+        ]
+        if extra:
+            item.append(extra)
+        else:
+            while len(item) > 3 and item[-1] == 0:
+                item.pop()
+        return item
+
+    def encode_all(self, records: abc.Iterable[dict]) -> list[list]:
+        return [self.encode(record) for record in records]
+
+    def tables(self) -> dict[str, list[str]]:
+        return {
+            "directories": list(self.directories),
+            "mimetypes": list(self.mimetypes),
+            "tags": list(self.tags),
+        }
+
+
+EXPAND_ITEM_JS = """
+            function expandItem(tables, [directory, name, kind, tags = 0, width = 0, height = 0, extra = {}]) {
+                const record = {src: tables.directories[directory] + name, mimetype: tables.mimetypes[kind >> 1]};
+                if (kind & 1) record.thumb = `thumb/${name}`;
+                if (Array.isArray(tags)) record.tags = tags.map(tag => tables.tags[tag]);
+                if (width && height) [record.width, record.height] = [width, height];
+                return Object.assign(record, extra);
+            }
+"""
+
+PREFETCH_JS = """
+            // loads and decodes the next medias in navigation order so slideshows and
+            // keyboard navigation don't wait on the network; downloads that fall out
+            // of the window or the byte budget are cancelled
+            function createPrefetcher({ahead = 4, budget = 64 * 1024 * 1024} = {}) {
+                const entries = new Map();
+                let typicalBytes = 2 * 1024 * 1024;
+
+                function transferredBytes(src) {
+                    const timing = performance.getEntriesByName(new URL(src, document.baseURI).href).pop();
+                    return timing ? timing.encodedBodySize || timing.transferSize : 0;
+                }
+
+                function mediaReady(element) {
+                    if (element.tagName === "IMG") return element.decode();
+                    if (element.readyState >= 2) return Promise.resolve();
+                    return new Promise((resolve, reject) => {
+                        element.addEventListener("loadeddata", resolve, {once: true});
+                        element.addEventListener("error", reject, {once: true});
+                    });
+                }
+
+                function start(item) {
+                    const kind = item.mimetype.split("/")[0];
+                    if (!["image", "video", "audio"].includes(kind)) return null;
+                    const element = document.createElement(kind === "image" ? "img" : kind);
+                    if (kind === "image") element.decoding = "async";
+                    else [element.preload, element.muted] = ["auto", true];
+                    element.src = item.src;
+                    const entry = {element, bytes: item.size || typicalBytes, loaded: false};
+                    entry.ready = mediaReady(element).then(() => {
+                        entry.loaded = true;
+                        const bytes = transferredBytes(item.src);
+                        if (bytes) [entry.bytes, typicalBytes] = [bytes, (3 * typicalBytes + bytes) / 4];
+                    }, () => {
+                        if (entries.get(item.src) === entry) entries.delete(item.src);
+                    });
+                    return entry;
+                }
+
+                function cancel(src) {
+                    const entry = entries.get(src);
+                    entries.delete(src);
+                    if (entry && !entry.loaded) {
+                        entry.element.removeAttribute("src");
+                        if (entry.element.load) entry.element.load();
+                    }
+                }
+
+                return {
+                    schedule(items) {
+                        const wanted = [];
+                        let bytes = 0;
+                        for (const item of items.slice(0, ahead)) {
+                            const entry = entries.get(item.src);
+                            bytes += entry ? entry.bytes : item.size || typicalBytes;
+                            if (wanted.length && bytes > budget) break;
+                            wanted.push(item);
+                        }
+                        const keep = new Set(wanted.map(item => item.src));
+                        Array.from(entries.keys()).filter(src => !keep.has(src)).forEach(cancel);
+                        wanted.filter(item => !entries.has(item.src)).forEach(item => {
+                            const entry = start(item);
+                            if (entry) entries.set(item.src, entry);
+                        });
+                    },
+                    // moves a prefetched element into the container, so videos keep
+                    // their buffer and images needn't be decoded again
+                    adopt(container, src) {
+                        const entry = entries.get(src);
+                        if (!entry) return false;
+                        entries.delete(src);
+                        const element = entry.element;
+                        if (element.tagName !== "IMG") {
+                            [element.loop, element.controls] = [true, true];
+                            element.play().catch(() => {});
+                        }
+                        container.replaceChildren(element);
+                        return true;
+                    },
+                    cancel: () => Array.from(entries.keys()).forEach(cancel),
+                    mediaReady,
+                };
+            }
+
+            // time from navigating to a slide until its media can be shown, reported
+            // in batches to the server's metrics when there is one
+            function createSlideTimer(prefetcher) {
+                const samples = [];
+                let pending = null;
+
+                function flush() {
+                    if (!samples.length || !location.protocol.startsWith("http")) return;
+                    const body = JSON.stringify({samples: samples.splice(0)});
+                    navigator.sendBeacon("api/timings", new Blob([body], {type: "application/json"}));
+                }
+                window.addEventListener("pagehide", flush);
+
+                return {
+                    start() {
+                        pending = {started: performance.now()};
+                        return pending;
+                    },
+                    shown(slide, element, prefetched) {
+                        if (!slide || !element || slide !== pending) return;
+                        prefetcher.mediaReady(element).then(() => {
+                            if (slide !== pending) return;
+                            pending = null;
+                            const seconds = (performance.now() - slide.started) / 1000;
+                            console.debug(`Slide shown in ${seconds.toFixed(3)}s`, element.currentSrc, prefetched);
+                            samples.push({seconds, prefetched});
+                            if (samples.length >= 20) flush();
+                        }, () => {});
+                    },
+                };
+            }
+"""
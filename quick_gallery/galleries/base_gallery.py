@@ -1,18 +1,34 @@
+import io
 from collections import abc
 
 from ..media import Media
 
 
 class BaseGallery:
-    def __init__(self, medias: abc.Iterable[Media]):
+    requires_server = False
+    live = False
+    # the server's event sequence the page was rendered at
+    sequence = 0
+    # static pages are self contained; the server links fingerprinted assets
+    inline_assets = True
+
+    def __init__(self, medias: abc.Iterable[Media], thumbnails: bool = False):
         self.medias = medias
+        self.thumbnails = thumbnails
+        self.compiled_assets = None
 
     def gallery_items(self) -> abc.Sequence[str]:
         raise NotImplementedError()
 
+    def records(self) -> list[dict]:
+        raise NotImplementedError()
+
     def html(self):
         raise NotImplementedError()
 
+    def write_html(self, output: io.TextIOBase):
+        output.write(self.html())
+
     @classmethod
     @property
     def name(cls):
@@ -0,0 +1,495 @@
+import io
+import logging
+
+from .assets import PREFETCH_JS, split_template
+from .simple_gallery import INDEX_PROGRESS_JS
+from .tag_gallery import TagGallery
+
+logger = logging.getLogger(__name__)
+
+
+class PagedGallery(TagGallery):
+    requires_server = True
+
+    def render_html(self, output: io.TextIOBase):
+        head, body, tail = PAGED_PAGE_SEGMENTS
+        output.write(head)
+        output.write(self.assets().head(inline=self.inline_assets))
+        output.write(body)
+        if self.live:
+            output.write(f' data-live="1" data-sequence="{self.sequence}"')
+        output.write(tail)
+
+    def asset_templates(self) -> tuple[str, str, str]:
+        return PAGED_GALLERY_CSS, PAGED_GALLERY_JS, PAGED_LIVE_JS
+
+    def css_extra(self) -> str:
+        return ""
+
+    def js_extra(self) -> str:
+        return ""
+
+
+PAGED_LIVE_JS = """
+            const liveEvents = new EventSource(`events?since=${document.body.dataset.sequence}`);
+            ["add", "remove", "reset"].forEach(type => liveEvents.addEventListener(type, () => reset()));
+""" + INDEX_PROGRESS_JS
+
+PAGED_GALLERY_CSS = """
+        body { margin: 0; padding: 20px 0; }
+        .gallery { position: relative; width: 75%; max-width: 1000px; margin: 0 auto; }
+        .media-container {
+            position: absolute; left: 0; right: 0;
+            display: flex; justify-content: center; align-items: center;
+            box-sizing: border-box; border: 3px solid transparent;
+        }
+        .highlighted { border-color: red; }
+        img, video { max-width: 100%; max-height: 100%; border-radius: 5px; object-fit: contain; }
+        button, input, select { padding: 5px; font-size: 14px; cursor: pointer; }
+        .controls {
+            position: fixed;
+            top: 10px; left: 10px;
+            display: flex;
+            flex-direction: column;
+            gap: 5px;
+            z-index: 1000;
+            background: rgba(255, 255, 255, 0.6);
+            padding: 5px;
+            border-radius: 5px;
+            min-width: 140px;
+            max-height: 80vh;
+            overflow-y: auto;
+        }
+        .tag-filter { display: flex; flex-direction: column; gap: 5px; overflow-y: auto; }
+        label { font-size: 12px; cursor: pointer; }
+        .tag-query-error { outline: 2px solid red; }
+
+        @media (max-width: 768px) {
+            .gallery { width: 100%; }
+            button, input, select { font-size: 10px; padding: 3px; }
+        }
+"""
+
+PAGED_GALLERY_JS = """
+        console.log("Loading gallery");
+        document.addEventListener("DOMContentLoaded", function() {
+{PREFETCH_JS}
+            const gallery = document.querySelector(".gallery");
+            const PAGE_SIZE = 100;
+            const OVERSCAN = 3;
+            const ROW_GAP = 20;
+            // browsers cap element heights (about 17.9M px in Firefox), so past this
+            // the spacer stays fixed and scrolling maps onto rows through a scale
+            const MAX_SPACER_HEIGHT = 8000000;
+            let urlQP = new URLSearchParams(window.location.search);
+            let rowHeight = 0;
+            let total = 0;
+            let generation = 0;
+            let pages = new Map();
+            let rendered = new Map();
+            let currentIndex = Number(urlQP.get("i")) || 0;
+            let startMuted = true;
+            let slideshowActive = false;
+            let slideshowInterval = null;
+            let renderQueued = false;
+            let filters = {
+                mimetype: urlQP.get("mimetype") || "", tags: urlQP.getAll("tag"), query: urlQP.get("q") || "",
+                order: urlQP.get("order") || "", seed: urlQP.get("seed") || "",
+            };
+            let direction = 1;
+            let currentSlide = null;
+            const PREFETCH_AHEAD = 4;
+            const prefetcher = createPrefetcher({ahead: PREFETCH_AHEAD});
+            const slideTimer = createSlideTimer(prefetcher);
+
+            function setUrlParam(key, value) {
+                urlQP.set(key, value);
+                history.replaceState(null, null, "?"+urlQP.toString());
+            }
+
+            function setFilterParams() {
+                ["mimetype", "tag", "q", "order", "seed"].forEach(key => urlQP.delete(key));
+                if (filters.mimetype) urlQP.set("mimetype", filters.mimetype);
+                if (filters.query) urlQP.set("q", filters.query);
+                if (filters.order) urlQP.set("order", filters.order);
+                if (filters.order === "random") urlQP.set("seed", filters.seed);
+                filters.tags.forEach(tag => urlQP.append("tag", tag));
+                history.replaceState(null, null, "?"+urlQP.toString());
+            }
+
+            function rowStride() {
+                return rowHeight + ROW_GAP;
+            }
+
+            function spacerHeight() {
+                return Math.min(total * rowStride(), MAX_SPACER_HEIGHT);
+            }
+
+            function scrollScale() {
+                const spacer = spacerHeight();
+                const virtual = total * rowStride();
+                if (virtual <= spacer || spacer <= window.innerHeight) return 1;
+                return (virtual - window.innerHeight) / (spacer - window.innerHeight);
+            }
+
+            function galleryScroll() {
+                return window.scrollY - gallery.offsetTop;
+            }
+
+            // scroll offsets inside the gallery and offsets in the full list of rows
+            function toVirtual(scroll) {
+                return scroll > 0 ? scroll * scrollScale() : scroll;
+            }
+
+            function fromVirtual(offset) {
+                return offset > 0 ? offset / scrollScale() : offset;
+            }
+
+            function resize() {
+                rowHeight = Math.max(300, Math.round(window.innerHeight * 0.8));
+                gallery.style.height = `${spacerHeight()}px`;
+                rendered.forEach((container, position) => placeContainer(container, position));
+                queueRender();
+            }
+
+            function setTotal(n) {
+                total = n;
+                gallery.style.height = `${spacerHeight()}px`;
+                document.getElementById("item-count").textContent = `${total} items`;
+            }
+
+            function apiUrl(path, params) {
+                const qp = new URLSearchParams(params);
+                if (filters.mimetype) qp.set("mimetype", filters.mimetype);
+                if (filters.query) qp.set("q", filters.query);
+                if (filters.order) qp.set("order", filters.order);
+                if (filters.order === "random") qp.set("seed", filters.seed);
+                filters.tags.forEach(tag => qp.append("tag", tag));
+                return path + "?" + qp.toString();
+            }
+
+            function itemsUrl(offset, limit) {
+                return apiUrl("api/items", {offset: offset, limit: limit});
+            }
+
+            // galleries without a server replace this in their js_extra
+            let itemSource = {
+                page: (offset, limit) => fetch(itemsUrl(offset, limit)).then(response => {
+                    document.getElementById("tag-query").classList.toggle("tag-query-error", !response.ok);
+                    return response.ok ? response.json() : {total: 0, items: []};
+                }),
+                tags: () => fetch("api/tags").then(response => response.json()),
+                upcoming: (position, step, limit) => fetch(apiUrl("api/upcoming", {position, direction: step, limit}))
+                    .then(response => response.ok ? response.json() : {items: []})
+                    .then(data => data.items),
+            };
+
+            function fetchPage(page) {
+                if (!pages.has(page)) {
+                    const gen = generation;
+                    pages.set(page, itemSource.page(page * PAGE_SIZE, PAGE_SIZE)
+                        .then(data => {
+                            if (gen === generation) setTotal(data.total);
+                            return data.items;
+                        }));
+                }
+                return pages.get(page);
+            }
+
+            function placeContainer(container, position) {
+                // rows follow the viewport, which only differs from their own
+                // offset once the list is taller than the spacer
+                const scroll = galleryScroll();
+                container.style.top = `${position * rowStride() - toVirtual(scroll) + scroll}px`;
+                container.style.height = `${rowHeight}px`;
+            }
+
+            function createContainer(position, item) {
+                const container = document.createElement("span");
+                container.className = "media-container";
+                container.setAttribute("data-src", item.src);
+                container.setAttribute("data-mimetype", item.mimetype);
+                container.setAttribute("data-index", item.index);
+                if (item.thumb) container.setAttribute("data-thumb", item.thumb);
+                placeContainer(container, position);
+                container.addEventListener("click", () => updateCurrentIndex(position));
+                if (position === currentIndex) container.classList.add("highlighted");
+                const prefetched = loadMedia(container);
+                if (position === currentIndex) {
+                    slideTimer.shown(currentSlide, container.querySelector("img, video, audio"), prefetched);
+                }
+                return container;
+            }
+
+            function loadMedia(container) {
+                const thumb = container.getAttribute("data-thumb");
+                if (thumb && !container.classList.contains("highlighted")) {
+                    container.innerHTML = `<img src="${thumb}" decoding="async">`;
+                    return;
+                }
+                const src = container.getAttribute("data-src");
+                const mimetype = container.getAttribute("data-mimetype");
+                const prefetched = prefetcher.adopt(container, src);
+                if (prefetched) {
+                    // already loaded and decoded
+                } else if (mimetype.startsWith("video/")) {
+                    container.innerHTML = `<video src="${src}" muted loop controls autoplay></video>`;
+                } else if (mimetype.startsWith("audio/")) {
+                    container.innerHTML = `<audio src="${src}" muted loop controls></audio>`;
+                } else if (mimetype.startsWith("image/")) {
+                    container.innerHTML = `<img src="${src}" decoding="async">`;
+                } else {
+                    console.log("Unknown mimetype:", container);
+                }
+                const video = container.querySelector("video");
+                if (video && container.classList.contains("highlighted")) video.muted = startMuted;
+                return prefetched;
+            }
+
+            function visibleRange() {
+                const top = toVirtual(galleryScroll());
+                const first = Math.max(0, Math.floor(top / rowStride()) - OVERSCAN);
+                const last = Math.min(total - 1, Math.ceil((top + window.innerHeight) / rowStride()) + OVERSCAN);
+                return [first, last];
+            }
+
+            function render() {
+                renderQueued = false;
+                const [first, last] = visibleRange();
+                const scaled = scrollScale() !== 1;
+                rendered.forEach((container, position) => {
+                    if (position < first || position > last) {
+                        container.remove();
+                        rendered.delete(position);
+                    } else if (scaled) {
+                        placeContainer(container, position);
+                    }
+                });
+                if (last < first) return;
+                const gen = generation;
+                for (let page = Math.floor(first / PAGE_SIZE); page <= Math.floor(last / PAGE_SIZE); page++) {
+                    fetchPage(page).then(items => {
+                        if (gen !== generation) return;
+                        const [first, last] = visibleRange();
+                        items.forEach((item, i) => {
+                            const position = page * PAGE_SIZE + i;
+                            if (position >= first && position <= last && !rendered.has(position)) {
+                                const container = createContainer(position, item);
+                                rendered.set(position, container);
+                                gallery.appendChild(container);
+                            }
+                        });
+                    });
+                }
+            }
+
+            function queueRender() {
+                if (!renderQueued) {
+                    renderQueued = true;
+                    requestAnimationFrame(render);
+                }
+            }
+
+            function upcomingItems() {
+                if (itemSource.upcoming) return itemSource.upcoming(currentIndex, direction, PREFETCH_AHEAD);
+                const positions = Array.from({length: Math.min(PREFETCH_AHEAD, total - 1)},
+                    (_, i) => (currentIndex + direction * (i + 1) + total) % total);
+                return Promise.all(positions.map(position => fetchPage(Math.floor(position / PAGE_SIZE))
+                    .then(items => items[position % PAGE_SIZE])))
+                    .then(items => items.filter(Boolean));
+            }
+
+            function prefetchUpcoming() {
+                const gen = generation;
+                upcomingItems().then(items => {
+                    if (gen === generation) prefetcher.schedule(items);
+                });
+            }
+
+            function reset() {
+                generation++;
+                prefetcher.cancel();
+                pages.clear();
+                rendered.forEach(container => container.remove());
+                rendered.clear();
+                return fetchPage(0).then(() => queueRender());
+            }
+
+            function scrollToIndex(index) {
+                const offset = index * rowStride() - (window.innerHeight - rowHeight) / 2;
+                const target = gallery.offsetTop + fromVirtual(offset);
+                const far = Math.abs(target - window.scrollY) > 3 * window.innerHeight;
+                window.scrollTo({top: target, behavior: far ? "auto" : "smooth"});
+            }
+
+            function updateCurrentIndex(newIndex) {
+                if (total === 0) return;
+                setUrlParam("i", newIndex);
+                const prevMedia = rendered.get(currentIndex);
+                if (prevMedia) {
+                    prevMedia.classList.remove("highlighted");
+                    if (prevMedia.hasAttribute("data-thumb")) loadMedia(prevMedia);
+                    const prevVideo = prevMedia.querySelector("video");
+                    if (prevVideo) prevVideo.muted = true;
+                }
+                currentIndex = newIndex;
+                currentSlide = slideTimer.start();
+                const currentMedia = rendered.get(currentIndex);
+                if (currentMedia) {
+                    currentMedia.classList.add("highlighted");
+                    const prefetched = currentMedia.hasAttribute("data-thumb") && loadMedia(currentMedia);
+                    const currentVideo = currentMedia.querySelector("video");
+                    if (currentVideo) currentVideo.muted = startMuted;
+                    slideTimer.shown(currentSlide, currentMedia.querySelector("img, video, audio"), prefetched);
+                }
+                scrollToIndex(currentIndex);
+                queueRender();
+                prefetchUpcoming();
+            }
+
+            function startSlideshow() {
+                if (slideshowActive) return;
+                slideshowActive = true;
+                let delay = parseInt(document.getElementById("slideshow-delay").value) || 3;
+                slideshowInterval = setInterval(() => {
+                    direction = 1;
+                    updateCurrentIndex((currentIndex + 1) % total);
+                }, delay * 1000);
+            }
+
+            function stopSlideshow() {
+                slideshowActive = false;
+                clearInterval(slideshowInterval);
+            }
+
+            // orders are computed by the server; a random order is fixed by its seed,
+            // so the url reproduces it
+            function shuffle() {
+                document.getElementById("order").value = "random";
+                filters.seed = "";
+                applyFilters();
+            }
+
+            function applyFilters() {
+                filters.order = document.getElementById("order").value;
+                if (filters.order === "random" && !filters.seed) filters.seed = Math.random().toString(36).slice(2, 10);
+                if (filters.order !== "random") filters.seed = "";
+                filters.mimetype = document.getElementById("mimetype-filter").value;
+                filters.query = document.getElementById("tag-query").value.trim();
+                filters.tags = Array.from(document.querySelectorAll("#tag-filter input[type='checkbox']:checked"))
+                    .map(input => input.value);
+                setFilterParams();
+                currentIndex = 0;
+                setUrlParam("i", 0);
+                window.scrollTo({top: 0});
+                reset();
+            }
+
+            function populateTagControls() {
+                itemSource.tags().then(counts => {
+                    const tagFilterDiv = document.getElementById("tag-filter");
+                    Object.entries(counts).forEach(([tag, count]) => {
+                        const label = document.createElement("label");
+                        const checkbox = document.createElement("input");
+                        checkbox.type = "checkbox";
+                        checkbox.value = tag;
+                        checkbox.checked = filters.tags.includes(tag);
+                        checkbox.addEventListener("change", applyFilters);
+                        label.appendChild(checkbox);
+                        label.appendChild(document.createTextNode(` ${tag} (${count})`));
+                        tagFilterDiv.appendChild(label);
+                    });
+                });
+            }
+
+            document.addEventListener("keydown", function(event) {
+                if (event.code === "ArrowDown") {
+                    event.preventDefault();
+                    direction = 1;
+                    updateCurrentIndex((currentIndex + 1) % total);
+                } else if (event.code === "ArrowUp") {
+                    event.preventDefault();
+                    direction = -1;
+                    updateCurrentIndex((currentIndex - 1 + total) % total);
+                } else if (event.code === "Space") {
+                    event.preventDefault();
+                    if (slideshowActive) { stopSlideshow(); } else { startSlideshow(); }
+                } else if (event.code === "KeyR" && event.target.tagName !== "INPUT") {
+                    shuffle();
+                }
+            });
+
+            document.getElementById("toggle-sound").addEventListener("click", function() {
+                startMuted = !startMuted;
+                this.textContent = startMuted ? "Muted" : "Unmuted";
+            });
+
+            document.getElementById("toggle-slideshow").addEventListener("click", function() {
+                if (slideshowActive) { stopSlideshow(); this.textContent = "▶"; }
+                else { startSlideshow(); this.textContent = "⏹"; }
+            });
+
+            document.getElementById("randomize").addEventListener("click", shuffle);
+            document.getElementById("order").value = filters.order;
+            document.getElementById("order").addEventListener("change", applyFilters);
+            document.getElementById("mimetype-filter").value = filters.mimetype;
+            document.getElementById("tag-query").value = filters.query;
+            document.getElementById("tag-query").addEventListener("change", applyFilters);
+            document.getElementById("mimetype-filter").addEventListener("change", applyFilters);
+            window.addEventListener("scroll", queueRender, {passive: true});
+            window.addEventListener("resize", resize);
+
+            {JS}
+
+            resize();
+            populateTagControls();
+            reset().then(() => {
+                if (currentIndex) updateCurrentIndex(Math.min(currentIndex, total - 1));
+            });
+            if (document.body.dataset.live) {
+                {LIVE_JS}
+            }
+            console.log("Gallery initialized");
+        });
+""".replace("{PREFETCH_JS}", PREFETCH_JS)
+
+PAGED_GALLERY_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Gallery</title>
+    {ASSETS}
+</head>
+<body{BODY_ATTRIBUTES}>
+    <div class="controls" id="controls">
+        <span id="item-count"></span>
+        <button id="randomize">shuffle</button>
+        <select id="order">
+            <option value="">original order</option>
+            <option value="random">shuffled</option>
+            <option value="path">by path</option>
+            <option value="-mtime">newest first</option>
+            <option value="mtime">oldest first</option>
+            <option value="-size">largest first</option>
+            <option value="size">smallest first</option>
+        </select>
+        <button id="toggle-sound">Muted</button>
+        <input type="number" id="slideshow-delay" placeholder="Delay (s)" value="3">
+        <button id="toggle-slideshow">▶</button>
+        <select id="mimetype-filter">
+            <option value="">all</option>
+            <option value="image">image</option>
+            <option value="video">video</option>
+            <option value="audio">audio</option>
+        </select>
+        <input type="text" id="tag-query" placeholder="cat AND NOT dog">
+        <div id="tag-filter" class="tag-filter"></div>
+    </div>
+    <div class="gallery"></div>
+</body>
+</html>
+"""
+
+PAGED_PAGE_SEGMENTS = split_template(PAGED_GALLERY_HTML, "ASSETS", "BODY_ATTRIBUTES")
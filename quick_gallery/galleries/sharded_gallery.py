@@ -0,0 +1,121 @@
+import io
+import logging
+
+from .assets import EXPAND_ITEM_JS, script_json, split_template
+from .paged_gallery import PAGED_GALLERY_HTML, PagedGallery
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedGallery(PagedGallery):
+    # the shell page of an `export`; items live in the shards of its manifest
+    requires_server = False
+    inline_assets = False
+
+    def __init__(self, manifest: dict):
+        super().__init__([])
+        self.manifest = manifest
+
+    def render_html(self, output: io.TextIOBase):
+        head, body, controls, tail = SHARDED_PAGE_SEGMENTS
+        output.write(head)
+        output.write(self.assets().head(inline=self.inline_assets))
+        output.write(body)
+        output.write(controls)
+        output.write(script_json(self.manifest))
+        output.write(tail)
+
+    def css_extra(self) -> str:
+        return SHARDED_CSS
+
+    def js_extra(self) -> str:
+        return EXPAND_ITEM_JS + SHARDED_JS
+
+
+SHARDED_CSS = """
+        #tag-query, #randomize, #order { display: none; }
+"""
+
+SHARDED_JS = """
+            // pages come from the gzipped JSON shards listed in the manifest; without
+            // filters only the shards overlapping a page are fetched, with tag filters
+            // only the shards the tag index lists for those tags
+            const manifest = JSON.parse(document.getElementById("gallery-manifest").textContent);
+            const shardStarts = [];
+            manifest.shards.reduce((start, shard) => (shardStarts.push(start), start + shard.count), 0);
+            const shardCache = new Map();
+            let tagShards = null;
+            let filtered = null;
+            let filteredKey = null;
+
+            function readShard(response) {
+                return response.arrayBuffer().then(buffer => {
+                    const bytes = new Uint8Array(buffer);
+                    // servers may have decoded the file already because of its extension
+                    if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) return JSON.parse(new TextDecoder().decode(bytes));
+                    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+                    return new Response(stream).json();
+                });
+            }
+
+            function loadShard(i) {
+                if (!shardCache.has(i)) {
+                    shardCache.set(i, fetch(manifest.shards[i].name).then(readShard).then(shard =>
+                        shard.items.map((item, j) => ({index: shardStarts[i] + j, ...expandItem(shard.tables, item)}))));
+                }
+                return shardCache.get(i);
+            }
+
+            function candidateShards() {
+                if (!filters.tags.length || !manifest.tag_index) {
+                    return Promise.resolve(manifest.shards.map((_, i) => i));
+                }
+                tagShards = tagShards || fetch(manifest.tag_index).then(readShard);
+                return tagShards.then(index => {
+                    const ids = new Set(filters.tags.flatMap(tag => index[tag] || []));
+                    return Array.from(ids).sort((a, b) => a - b);
+                });
+            }
+
+            function matchesFilters(item) {
+                if (filters.mimetype && item.mimetype !== filters.mimetype && !item.mimetype.startsWith(`${filters.mimetype}/`)) {
+                    return false;
+                }
+                return !filters.tags.length || filters.tags.some(tag => (item.tags || []).includes(tag));
+            }
+
+            function filteredPage(offset, limit) {
+                const key = JSON.stringify([filters.mimetype, filters.tags]);
+                if (key !== filteredKey) {
+                    filteredKey = key;
+                    filtered = candidateShards()
+                        .then(ids => Promise.all(ids.map(loadShard)))
+                        .then(shards => shards.flat().filter(matchesFilters));
+                }
+                return filtered.then(items => ({total: items.length, items: items.slice(offset, offset + limit)}));
+            }
+
+            function shardPage(offset, limit) {
+                if (filters.tags.length || filters.mimetype) return filteredPage(offset, limit);
+                const ids = manifest.shards
+                    .map((shard, i) => i)
+                    .filter(i => shardStarts[i] < offset + limit && shardStarts[i] + manifest.shards[i].count > offset);
+                return Promise.all(ids.map(loadShard)).then(shards => ({
+                    total: manifest.total,
+                    items: shards.flat().filter(item => item.index >= offset && item.index < offset + limit),
+                }));
+            }
+
+            itemSource = {page: shardPage, tags: () => Promise.resolve(manifest.tag_counts)};
+"""
+
+SHARDED_PAGE_SEGMENTS = split_template(
+    PAGED_GALLERY_HTML.replace(
+        "</body>",
+        '    <script type="application/json" id="gallery-manifest">{MANIFEST}</script>\n'
+        "</body>",
+    ),
+    "ASSETS",
+    "BODY_ATTRIBUTES",
+    "MANIFEST",
+)
@@ -0,0 +1,127 @@
+import logging
+from collections import abc
+
+from ..media import Media
+from ..phash import SimilarityFinder
+from .tag_gallery import TagGallery
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarGallery(TagGallery):
+    algorithm = "phash"
+    threshold = 6
+
+    def __init__(self, medias: abc.Iterable[Media], thumbnails: bool = False):
+        super().__init__(medias, thumbnails=thumbnails)
+        self.similar: dict[str, list[Media]] = {}
+        # shared with the copies the server renders, so clustering only reruns
+        # when a media is added, removed or modified
+        self.groups_cache: dict = {}
+
+    def gallery_medias(self) -> list[Media]:
+        medias = list(self.medias)
+        groups = self.similar_groups(medias)
+        self.similar = {}
+        representatives = []
+        for representative, *similar in groups:
+            if similar:
+                self.similar[medias[representative].path] = [medias[i] for i in similar]
+            representatives.append(medias[representative])
+        logger.info(f"Collapsed {len(medias) - len(representatives)} similar images")
+        return representatives
+
+    def similar_groups(self, medias: list[Media]) -> list[list[int]]:
+        # positions of each cluster's members, its representative first
+        key = [(media.path, media.public_file) for media in medias]
+        if self.groups_cache.get("key") == key:
+            return self.groups_cache["groups"]
+        finder = SimilarityFinder(self.algorithm, self.threshold)
+        positions = {id(media): i for i, media in enumerate(medias)}
+        groups = []
+        for cluster in finder.clusters(medias):
+            # the largest file is most likely the best quality copy
+            representative = max(cluster, key=file_size)
+            groups.append(
+                [positions[id(representative)]]
+                + [positions[id(m)] for m in cluster if m is not representative]
+            )
+        self.groups_cache.update(key=key, groups=groups)
+        return groups
+
+    def gallery_record(self, media: Media, mimetype: str) -> dict:
+        record = super().gallery_record(media, mimetype)
+        if similar := self.similar.get(media.path):
+            record["similar"] = [self.similar_record(other) for other in similar]
+        return record
+
+    def similar_record(self, media: Media) -> dict:
+        record = {"src": media.public_file}
+        if self.thumbnails:
+            record["thumb"] = f"thumb/{media.public_name}"
+        return record
+
+    def css_extra(self):
+        return super().css_extra() + SIMILAR_CSS
+
+    def js_extra(self):
+        return super().js_extra() + SIMILAR_JS
+
+
+def file_size(media: Media) -> int:
+    try:
+        return media.stat().st_size
+    except OSError:
+        return 0
+
+
+SIMILAR_CSS = """
+    .similar-group { display: flex; flex-direction: column; align-items: flex-start; gap: 5px; }
+    .media-container[style*="display: none"] + .similar-group { display: none; }
+    .similar-strip { display: none; flex-wrap: wrap; gap: 5px; }
+    .similar-strip.open { display: flex; }
+    .similar-strip img { width: 150px; height: 150px; object-fit: cover; }
+"""
+
+SIMILAR_JS = """
+    // each collapsed cluster gets a toggle right after its representative
+    const similarGroups = new Map();
+
+    function addSimilarGroup(container) {
+        const similar = container.getAttribute("data-similar");
+        if (!similar || similarGroups.has(container)) return;
+        const items = JSON.parse(similar);
+        const group = document.createElement("div");
+        group.className = "similar-group";
+        const toggle = document.createElement("button");
+        toggle.textContent = `+${items.length} similar`;
+        const strip = document.createElement("div");
+        strip.className = "similar-strip";
+        toggle.addEventListener("click", function() {
+            if (!strip.innerHTML) {
+                strip.innerHTML = items
+                    .map(item => `<a href="${item.src}" target="_blank"><img src="${item.thumb || item.src}" loading="lazy"></a>`)
+                    .join("");
+            }
+            const open = strip.classList.toggle("open");
+            toggle.textContent = open ? "hide similar" : `+${items.length} similar`;
+        });
+        group.append(toggle, strip);
+        container.after(group);
+        similarGroups.set(container, group);
+    }
+
+    // keep groups next to their representative when containers are shuffled or removed
+    new MutationObserver(() => {
+        similarGroups.forEach((group, container) => {
+            if (!container.isConnected) {
+                group.remove();
+                similarGroups.delete(container);
+            } else if (container.nextElementSibling !== group) {
+                container.after(group);
+            }
+        });
+    }).observe(gallery, {childList: true});
+
+    galleryItems.forEach(addSimilarGroup);
+"""
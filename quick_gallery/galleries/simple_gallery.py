@@ -1,7 +1,17 @@
+import io
 import logging
 from collections import Counter, abc
 
 from ..media import Media
+from ..metrics import metrics
+from .assets import (
+    EXPAND_ITEM_JS,
+    PREFETCH_JS,
+    CompactRecords,
+    GalleryAssets,
+    script_json,
+    split_template,
+)
 from .base_gallery import BaseGallery
 
 logger = logging.getLogger(__name__)
@@ -10,34 +20,85 @@ logger = logging.getLogger(__name__)
 class SimpleGallery(BaseGallery):
     valid_types = {"image", "video", "audio"}
 
-    def gallery_items(self):
+    def gallery_medias(self) -> abc.Iterable[Media]:
+        return self.medias
+
+    def gallery_records(self) -> abc.Iterator[dict]:
         mimetypes_count = Counter()
-        gallery_items = []
-
-        index = 0
-        for media in self.medias:
-            mimetype = media.mimetype()
-            if not mimetype:
-                logger.debug(f"No mimetype for file: {media=}, {mimetype=}")
-                continue
-            file_type = media.media_type()
-            if file_type in self.valid_types:
-                mimetypes_count[mimetype] += 1
-                gallery_items.append(
-                    f'<span class="media-container" data-src="{media.public_file}" data-mimetype="{mimetype}" data-index="{index}"></span>'
-                )
-                index += 1
+        for media in self.gallery_medias():
+            if (record := self.record_for(media)) is not None:
+                mimetypes_count[record["mimetype"]] += 1
+                yield record
         logger.info(f"Found mime-types: {mimetypes_count.most_common(None)}")
-        return gallery_items
+
+    def record_for(self, media: Media) -> dict | None:
+        mimetype = media.mimetype()
+        if not mimetype:
+            logger.debug(f"No mimetype for file: {media=}, {mimetype=}")
+            return None
+        file_type = media.media_type()
+        if file_type in self.valid_types:
+            return self.gallery_record(media, mimetype)
+        return None
+
+    def gallery_record(self, media: Media, mimetype: str) -> dict:
+        record = {"src": media.public_file, "mimetype": mimetype}
+        if self.thumbnails and media.media_type() in {"image", "video"}:
+            record["thumb"] = f"thumb/{media.public_name}"
+        if media.metadata is not None and (size := media.metadata.display_size):
+            record["width"], record["height"] = size
+        return record
+
+    def gallery_items(self) -> list[list]:
+        with metrics.timer(
+            "phase_seconds", "Time spent per phase", phase="items"
+        ).time():
+            return CompactRecords().encode_all(self.gallery_records())
+
+    def records(self) -> list[dict]:
+        return list(self.gallery_records())
 
     def html(self):
-        return (
-            SIMPLE_GALLERY_HTML.replace(
-                "{GALLERY_ITEMS}", "\n".join(self.gallery_items())
+        output = io.StringIO()
+        self.write_html(output)
+        return output.getvalue()
+
+    def write_html(self, output: io.TextIOBase):
+        with metrics.timer(
+            "phase_seconds", "Time spent per phase", phase="render"
+        ).time():
+            self.render_html(output)
+
+    def render_html(self, output: io.TextIOBase):
+        # items stream out one by one; the tables they reference follow them
+        encoder = CompactRecords()
+        head, body, items, tables, tail = PAGE_SEGMENTS
+        output.write(head)
+        output.write(self.assets().head(inline=self.inline_assets))
+        output.write(body)
+        if self.live:
+            output.write(f' data-live="1" data-sequence="{self.sequence}"')
+        output.write(items)
+        for index, record in enumerate(self.gallery_records()):
+            if index:
+                output.write(",\n")
+            output.write(script_json(encoder.encode(record)))
+        output.write(tables)
+        output.write(script_json(encoder.tables()))
+        output.write(tail)
+
+    def assets(self) -> GalleryAssets:
+        # subclasses only contribute css_extra/js_extra, so this is built once
+        if self.compiled_assets is None:
+            css, js, live_js = self.asset_templates()
+            self.compiled_assets = GalleryAssets(
+                css + self.css_extra(),
+                js.replace("{JS}", self.js_extra()).replace("{LIVE_JS}", live_js),
             )
-            .replace("{CSS}", self.css_extra())
-            .replace("{JS}", self.js_extra())
-        )
+        return self.compiled_assets
+
+    def asset_templates(self) -> tuple[str, str, str]:
+        return SIMPLE_GALLERY_CSS, SIMPLE_GALLERY_JS, LIVE_JS
 
     def css_extra(self) -> str:
         return ""
@@ -46,19 +107,57 @@ class SimpleGallery(BaseGallery):
         return ""
 
 
-SIMPLE_GALLERY_HTML = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Gallery</title>
-    <style>
+INDEX_PROGRESS_JS = """
+            const indexProgress = document.createElement("div");
+            indexProgress.style.cssText = "position: fixed; bottom: 10px; right: 10px; z-index: 1000; padding: 5px; " +
+                "border-radius: 5px; font-size: 12px; background: rgba(255, 255, 255, 0.8);";
+            liveEvents.addEventListener("progress", function(event) {
+                const progress = JSON.parse(event.data);
+                indexProgress.textContent = progress.state === "failed"
+                    ? "Indexing failed, see the server log"
+                    : `Indexing... ${progress.indexed} medias from ${progress.scanned} files`;
+                if (!indexProgress.isConnected) document.body.appendChild(indexProgress);
+            });
+            liveEvents.addEventListener("ready", () => indexProgress.remove());
+"""
+
+LIVE_JS = """
+            const liveEvents = new EventSource(`events?since=${document.body.dataset.sequence}`);
+            liveEvents.addEventListener("add", function(event) {
+                JSON.parse(event.data).forEach(item => {
+                    const container = createContainer(item, mediaContainers().length);
+                    container.addEventListener("click", function() {
+                        updateCurrentIndex(Array.from(mediaContainers()).indexOf(container));
+                    });
+                    gallery.appendChild(container);
+                    galleryItems.push(container);
+                    observer.observe(container);
+                });
+                if (typeof filterGallery === "function") filterGallery();
+            });
+            liveEvents.addEventListener("remove", function(event) {
+                const removed = new Set(JSON.parse(event.data));
+                mediaContainers().forEach(container => {
+                    if (removed.has(container.getAttribute("data-src"))) {
+                        observer.unobserve(container);
+                        container.remove();
+                    }
+                });
+                galleryItems = galleryItems.filter(container => !removed.has(container.getAttribute("data-src")));
+                currentIndex = Math.min(currentIndex, Math.max(mediaContainers().length - 1, 0));
+                if (typeof filterGallery === "function") filterGallery(true);
+            });
+            liveEvents.addEventListener("reset", () => window.location.reload());
+""" + INDEX_PROGRESS_JS
+
+SIMPLE_GALLERY_CSS = """
         body { display: flex; flex-direction: column; align-items: center; gap: 20px; margin: 0; padding: 20px; }
         .gallery {
 width: 75%; max-width: 1000px;
         }
         .media-container {  display: flex; justify-content: center; min-height: 300px; border: 3px solid transparent; }
+        .media-container[data-aspect] { min-height: 0; }
+        .media-container[data-aspect] img, .media-container[data-aspect] video { height: 100%; object-fit: contain; }
         .highlighted { border-color: red; }
         img, video { width: 100%; border-radius: 5px; }
             position: fixed;
@@ -93,22 +192,62 @@ width: 75%; max-width: 1000px;
             .media-container { width: 100%; }
             button, input { font-size: 10px; padding: 3px; }
         }
-        {CSS}
-    </style>
-    <script>
+"""
+
+SIMPLE_GALLERY_JS = """
         console.log("Loading gallery");
         document.addEventListener("DOMContentLoaded", function() {
             console.log("Loaded");
             const gallery = document.querySelector(".gallery");
+            const galleryTables = JSON.parse(document.getElementById("gallery-tables").textContent);
+
+{EXPAND_ITEM_JS}
+            function createContainer(record, index) {
+                const container = document.createElement("span");
+                container.className = "media-container";
+                Object.entries(record).forEach(([key, value]) => {
+                    if (key === "width" || key === "height") return;
+                    if (Array.isArray(value) && typeof value[0] !== "object") value = value.join(",");
+                    else if (typeof value === "object") value = JSON.stringify(value);
+                    container.setAttribute(`data-${key}`, value);
+                });
+                if (record.width && record.height) {
+                    container.dataset.aspect = `${record.width} / ${record.height}`;
+                    container.style.aspectRatio = container.dataset.aspect;
+                }
+                container.dataset.index = index;
+                return container;
+            }
+
+            const fragment = document.createDocumentFragment();
+            JSON.parse(document.getElementById("gallery-items").textContent)
+                .forEach((item, index) => fragment.appendChild(createContainer(expandItem(galleryTables, item), index)));
+            gallery.appendChild(fragment);
+            let galleryItems = Array.from(gallery.querySelectorAll('.media-container'));
             let urlQP = new URLSearchParams(window.location.search);
             let currentIndex = 0;
             let startMuted = true;
             let slideshowActive = false;
             let slideshowInterval = null;
+            let direction = 1;
+            const PREFETCH_AHEAD = 4;
+            const prefetcher = createPrefetcher({ahead: PREFETCH_AHEAD});
+            const slideTimer = createSlideTimer(prefetcher);
 
-            function shuffleArray(a) {
+            // mulberry32 seeded from the seed string, so ?seed= reproduces a shuffle
+            function seededRandom(seed) {
+                let state = Array.from(seed).reduce((h, c) => Math.imul(h ^ c.charCodeAt(0), 2654435761), 1779033703);
+                return function() {
+                    state = (state + 0x6D2B79F5) | 0;
+                    let t = Math.imul(state ^ (state >>> 15), 1 | state);
+                    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+                    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+                };
+            }
+
+            function shuffleArray(a, random) {
                 for (let i = a.length; i; i--) {
-                    let j = Math.floor(Math.random() * i);
+                    let j = Math.floor(random() * i);
                     [a[i - 1], a[j]] = [a[j], a[i - 1]];
                 }
             }
@@ -122,26 +261,50 @@ width: 75%; max-width: 1000px;
                 return urlQP.get(key);
             }
 
-            function shuffleContent() {
+            function shuffleContent(seed) {
                 console.log("Shuffling");
-                let children = Array.from(mediaContainers());
-                for (var i = 0; i <= Math.log2(children.length); i++) {
-                    shuffleArray(children)
-                };
+                seed = seed || Math.random().toString(36).slice(2, 10);
+                setUrlParam("seed", seed);
+                // one pass from the original order, moved in a single fragment insert
+                let children = galleryItems.slice();
+                shuffleArray(children, seededRandom(seed));
+                const fragment = document.createDocumentFragment();
                 children.forEach((e, i) => {
-                    gallery.removeChild(e);
-                    gallery.appendChild(e);
-                    e.setAttribute('data-index', i)
-                })
+                    e.setAttribute('data-index', i);
+                    fragment.appendChild(e);
+                });
+                gallery.appendChild(fragment);
+                prefetchUpcoming();
+            }
+
+            function prefetchUpcoming() {
+                const medias = mediaContainers();
+                const upcoming = [];
+                for (let i = 1; i <= Math.min(PREFETCH_AHEAD, medias.length - 1); i++) {
+                    const container = medias[(currentIndex + direction * i + medias.length) % medias.length];
+                    upcoming.push({src: container.getAttribute("data-src"), mimetype: container.getAttribute("data-mimetype")});
+                }
+                prefetcher.schedule(upcoming);
             }
 
             function mediaContainers() {
                 return gallery.querySelectorAll('.media-container');
             }
             
-            function loadMedia(container) {
-                if (!container.innerHTML) {
-                    container.style.height = null;
+            function loadMedia(container, full) {
+                const thumb = container.getAttribute("data-thumb");
+                const wantFull = full || !thumb;
+                if (container.innerHTML && (container.dataset.full === "1" || !wantFull)) {
+                    return;
+                }
+                container.dataset.full = wantFull ? "1" : "0";
+                container.style.height = null;
+                if (wantFull && prefetcher.adopt(container, container.getAttribute("data-src"))) {
+                    return true;
+                }
+                if (!wantFull) {
+                    container.innerHTML = `<img src="${thumb}" loading="lazy">`;
+                } else {
                     const src = container.getAttribute("data-src");
                     const mimetype = container.getAttribute("data-mimetype");
                     if (mimetype.startsWith("video/")) {
@@ -158,8 +321,11 @@ width: 75%; max-width: 1000px;
 
             function unloadMedia(container) {
                 if (container.innerHTML) {
-                    container.style.height = `${container.clientHeight}px`;
+                    if (!container.dataset.aspect) {
+                        container.style.height = `${container.clientHeight}px`;
+                    }
                     container.innerHTML = null;
+                    delete container.dataset.full;
                 }
             }
             
@@ -169,7 +335,6 @@ width: 75%; max-width: 1000px;
                 const prevMedia = medias[currentIndex];
                 const prevVideo = prevMedia.querySelector("video");
                 const currentMedia = medias[newIndex];
-                const currentVideo = currentMedia.querySelector("video")
                 currentIndex = newIndex;
 
                 prevMedia.classList.remove("highlighted");
@@ -178,7 +343,11 @@ width: 75%; max-width: 1000px;
                 }
 
                 currentMedia.classList.add("highlighted");
-                loadMedia(currentMedia);
+                const slide = slideTimer.start();
+                const prefetched = loadMedia(currentMedia, true);
+                slideTimer.shown(slide, currentMedia.querySelector("img, video, audio"), Boolean(prefetched));
+                prefetchUpcoming();
+                const currentVideo = currentMedia.querySelector("video");
                 currentMedia.scrollIntoView({ behavior: "smooth", block: "center" });
                 if (currentVideo) {
                     currentVideo.muted = startMuted;
@@ -190,6 +359,7 @@ width: 75%; max-width: 1000px;
                 slideshowActive = true;
                 let delay = parseInt(document.getElementById("slideshow-delay").value) || 3;
                 slideshowInterval = setInterval(() => {
+                    direction = 1;
                     updateCurrentIndex((currentIndex + 1) % mediaContainers().length);
                 }, delay * 1000);
             }
@@ -202,9 +372,11 @@ width: 75%; max-width: 1000px;
             document.addEventListener("keydown", function(event) {
                 if (event.code === "ArrowDown") {
                     event.preventDefault();
+                    direction = 1;
                     updateCurrentIndex((currentIndex + 1) % mediaContainers().length);
                 } else if (event.code === "ArrowUp") {
                     event.preventDefault();
+                    direction = -1;
                     updateCurrentIndex((currentIndex - 1 + mediaContainers().length) % mediaContainers().length);
                 } else if (event.code === "Space") {
                     event.preventDefault();
@@ -253,25 +425,45 @@ width: 75%; max-width: 1000px;
                 shuffleContent();
             });
 
+            if (getUrlParam("seed")) {
+                shuffleContent(getUrlParam("seed"));
+            }
+
             if (getUrlParam("i")) {
                 updateCurrentIndex(Number(getUrlParam("i")));
             }
 
             {JS}
+            if (document.body.dataset.live) {
+                {LIVE_JS}
+            }
             console.log("Gallery initialized");
         });
-    </script>
+""".replace("{EXPAND_ITEM_JS}", EXPAND_ITEM_JS + PREFETCH_JS)
+
+SIMPLE_GALLERY_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Gallery</title>
+    {ASSETS}
 </head>
-<body>
+<body{BODY_ATTRIBUTES}>
     <div class="controls" id="controls">
         <button id="randomize">shuffle</button>
         <button id="toggle-sound">Muted</button>
         <input type="number" id="slideshow-delay" placeholder="Delay (s)" value="3">
         <button id="toggle-slideshow">▶</button>
     </div>
-    <div class="gallery">
-        {GALLERY_ITEMS}
-    </div>
+    <div class="gallery"></div>
+    <script type="application/json" id="gallery-items">[{ITEMS}]</script>
+    <script type="application/json" id="gallery-tables">{TABLES}</script>
 </body>
 </html>
 """
+
+PAGE_SEGMENTS = split_template(
+    SIMPLE_GALLERY_HTML, "ASSETS", "BODY_ATTRIBUTES", "ITEMS", "TABLES"
+)
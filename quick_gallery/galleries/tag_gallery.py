@@ -1,5 +1,4 @@
 import logging
-from collections import Counter, abc
 
 from ..media import Media
 from .simple_gallery import SimpleGallery
@@ -8,28 +7,10 @@ logger = logging.getLogger(__name__)
 
 
 class TagGallery(SimpleGallery):
-    valid_types = {"image", "video", "audio"}
-
-    def gallery_items(self):
-        mimetypes_count = Counter()
-        gallery_items = []
-
-        index = 0
-        for media in self.medias:
-            mimetype = media.mimetype()
-            if not mimetype:
-                logger.debug(f"No mimetype for file: {media=}, {mimetype=}")
-                continue
-            file_type = media.media_type()
-            if file_type in self.valid_types:
-                mimetypes_count[mimetype] += 1
-                tags = ",".join(media.tags())
-                gallery_items.append(
-                    f'<span class="media-container" data-src="{media.public_file}" data-mimetype="{mimetype}" data-tags="{tags}"  data-index="{index}"></span>'
-                )
-                index += 1
-        logger.info(f"Found mime-types: {mimetypes_count.most_common(None)}")
-        return gallery_items
+    def gallery_record(self, media: Media, mimetype: str) -> dict:
+        record = super().gallery_record(media, mimetype)
+        record["tags"] = sorted(media.tags())
+        return record
 
     def css_extra(self):
         return TAG_CSS
@@ -45,37 +26,44 @@ TAG_CSS = """
         gap: 5px;
         overflow-y: auto;
     }
+    .tag-query-error { outline: 2px solid red; }
     label { font-size: 12px; cursor: pointer; }
 """
 
 TAG_JS = """
-    document.getElementById("controls")?.insertAdjacentHTML("beforeend", '<div id="tag-filter" class="tag-filter"></div>');
+    document.getElementById("controls")?.insertAdjacentHTML("beforeend", '<input type="text" id="tag-query" placeholder="cat AND NOT dog"><div id="tag-filter" class="tag-filter"></div>');
+
+    // the server evaluates boolean queries over its inverted index; a static
+    // page falls back to OR-ing the selected tags in the browser
+    const serverQueries = window.location.protocol.startsWith("http");
+    let visibleItems = null;
+    let filterRequest = 0;
+
+    function containerTags(container) {
+        const dataTags = container.getAttribute("data-tags");
+        return dataTags ? dataTags.split(",") : [];
+    }
 
     function getUniqueTags() {
         let tags = new Set();
-        mediaContainers().forEach(container => {
-            const dataTags = container.getAttribute("data-tags");
-            if (dataTags) {
-                dataTags.split(",").forEach(tag => tags.add(tag.trim()));
-            }
-        });
+        galleryItems.forEach(container => containerTags(container).forEach(tag => tags.add(tag)));
         return Array.from(tags).sort();
     }
-    
+
     function populateTagControls() {
         const tagFilterDiv = document.getElementById("tag-filter");
         tagFilterDiv.innerHTML = ""; // Clear previous tags
-    
+
         getUniqueTags().forEach(tag => {
             const label = document.createElement("label");
             const checkbox = document.createElement("input");
             checkbox.type = "checkbox";
             checkbox.value = tag;
             checkbox.checked = false;
-    
+
             // Regular click: Toggle individual tag
-            checkbox.addEventListener("change", filterGallery);
-    
+            checkbox.addEventListener("change", () => filterGallery());
+
             // Double-click: Select only this tag (deselect others)
             label.addEventListener("dblclick", function() {
                 document.querySelectorAll("#tag-filter input[type='checkbox']").forEach(cb => {
@@ -84,39 +72,80 @@ TAG_JS = """
                 checkbox.checked = true;
                 filterGallery();
             });
-    
+
             label.appendChild(checkbox);
             label.appendChild(document.createTextNode(" " + tag));
             tagFilterDiv.appendChild(label);
         });
-    
+
+        if (serverQueries) {
+            document.getElementById("tag-query").addEventListener("change", () => filterGallery());
+        } else {
+            document.getElementById("tag-query").style.display = "none";
+        }
         filterGallery(); // Ensure proper display on load
     }
-    
-    
+
+    // Only touches containers whose visibility actually changes
+    function applyVisibility(visible, reset) {
+        galleryItems.forEach((container, id) => {
+            const show = visible === null || visible[id] === 1;
+            const shown = reset || visibleItems === null || visibleItems[id] !== 0;
+            if (reset || show !== shown) {
+                container.style.display = show ? "flex" : "none";
+            }
+        });
+        visibleItems = visible;
+    }
+
+    function decodeBitmap(encoded, size) {
+        const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+        const visible = new Uint8Array(size);
+        for (let id = 0; id < size; id++) {
+            visible[id] = (bytes[id >> 3] >> (id & 7)) & 1;
+        }
+        return visible;
+    }
+
+    function selectedQuery() {
+        const typed = document.getElementById("tag-query").value.trim();
+        if (typed) return typed;
+        return Array.from(document.querySelectorAll("#tag-filter input[type='checkbox']:checked"))
+            .map(input => `"${input.value}"`)
+            .join(" OR ");
+    }
+
     // Filters gallery based on selected tags
-    function filterGallery() {
-        const selectedTags = Array.from(document.querySelectorAll("#tag-filter input[type='checkbox']:checked"))
-            .map(input => input.value);
-    
-        if (selectedTags.length === 0) {
-            // If no tags are selected, show all images
-            mediaContainers().forEach(container => {
-                container.style.display = "flex";
-            });
+    function filterGallery(reset) {
+        const query = selectedQuery();
+        const request = ++filterRequest;
+        if (!query) {
+            applyVisibility(null, reset);
+        } else if (serverQueries) {
+            const queryInput = document.getElementById("tag-query");
+            fetch("api/query?q=" + encodeURIComponent(query))
+                .then(response => {
+                    queryInput.classList.toggle("tag-query-error", !response.ok);
+                    return response.ok ? response.json() : null;
+                })
+                .then(result => {
+                    if (result && request === filterRequest) {
+                        applyVisibility(decodeBitmap(result.bitmap, result.size), reset);
+                    }
+                });
         } else {
-            // Show only matching media
-            mediaContainers().forEach(container => {
-                const tags = container.getAttribute("data-tags");
-                if (!tags || !selectedTags.some(tag => tags.includes(tag))) {
-                    container.style.display = "none";
-                } else {
-                    container.style.display = "flex";
-                }
+            const selectedTags = new Set(
+                Array.from(document.querySelectorAll("#tag-filter input[type='checkbox']:checked"))
+                    .map(input => input.value)
+            );
+            const visible = new Uint8Array(galleryItems.length);
+            galleryItems.forEach((container, id) => {
+                visible[id] = containerTags(container).some(tag => selectedTags.has(tag)) ? 1 : 0;
             });
+            applyVisibility(visible, reset);
         }
     }
-    
+
     // Initialize
     populateTagControls();
 """
@@ -0,0 +1,83 @@
+import gzip
+import hashlib
+import time
+
+from aiohttp import web
+
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def etag_matches(request: web.Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def accepted_encodings(request: web.Request) -> set[str]:
+    encodings = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in {"q=0", "q=0.0"}:
+            continue
+        encodings.add(encoding.lower())
+    return encodings
+
+
+class CachedPage:
+    def __init__(
+        self,
+        body: str | bytes,
+        content_type: str = "text/html",
+        cache_control: str = REVALIDATE,
+    ):
+        self.body = body.encode("utf8") if isinstance(body, str) else body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = f'"{hashlib.md5(self.body).hexdigest()}"'
+        self.last_modified = time.time()
+        self.encoded = {"gzip": gzip.compress(self.body, compresslevel=6)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.body, quality=9)
+
+    def headers(self) -> dict:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": time.strftime(
+                "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(self.last_modified)
+            ),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+    def response(self, request: web.Request) -> web.Response:
+        headers = self.headers()
+        matches = etag_matches(request, self.etag)
+        metrics.cache("page_etag", hit=matches)
+        if matches:
+            return web.Response(status=304, headers=headers)
+        accepted = accepted_encodings(request)
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encoded:
+                headers["Content-Encoding"] = encoding
+                return web.Response(
+                    body=self.encoded[encoding],
+                    content_type=self.content_type,
+                    charset="utf-8",
+                    headers=headers,
+                )
+        return web.Response(
+            body=self.body,
+            content_type=self.content_type,
+            charset="utf-8",
+            headers=headers,
+        )
@@ -0,0 +1,206 @@
+from array import array
+from collections import Counter, OrderedDict, abc, defaultdict
+
+from .tag_query import evaluate, parse_query
+
+BIT_POSITIONS = [
+    tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)
+]
+
+
+# a key keeps a sorted id array until its ids would take more room than a
+# bitmap over every record, at 4 bytes per id against 1 bit per record
+DENSE_RATIO = 32
+
+
+def collect_ids(
+    keys_per_id: abc.Iterable[abc.Iterable[str]], start: int = 0
+) -> dict[str, list[int]]:
+    postings = defaultdict(list)
+    for i, keys in enumerate(keys_per_id, start):
+        for key in keys:
+            postings[key].append(i)
+    return postings
+
+
+def ids_bitmap(ids: abc.Iterable[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+class Postings:
+    def __init__(self, keys_per_id: abc.Iterable[abc.Iterable[str]] = (), size=0):
+        self.size = 0
+        self.dense: dict[str, int] = {}
+        self.sparse: dict[str, array] = {}
+        self.extend(keys_per_id, size)
+
+    def extend(self, keys_per_id: abc.Iterable[abc.Iterable[str]], count: int):
+        # new ids all come after the existing ones, so arrays stay sorted and
+        # bitmaps of the batch alone are shifted into place
+        start = self.size
+        self.size += count
+        for key, ids in collect_ids(keys_per_id, start).items():
+            if key in self.dense:
+                batch = ids_bitmap((i - start for i in ids), count)
+                self.dense[key] |= batch << start
+                continue
+            merged = self.sparse.get(key, array("I"))
+            merged.extend(ids)
+            if len(merged) * DENSE_RATIO > self.size:
+                self.dense[key] = ids_bitmap(merged, self.size)
+                self.sparse.pop(key, None)
+            else:
+                self.sparse[key] = merged
+
+    def keys(self) -> abc.Iterator[str]:
+        yield from self.dense
+        yield from self.sparse
+
+    def get(self, key: str, default: int = 0) -> int:
+        if (bitmap := self.dense.get(key)) is not None:
+            return bitmap
+        if (ids := self.sparse.get(key)) is not None:
+            return ids_bitmap(ids, self.size)
+        return default
+
+    def count(self, key: str) -> int:
+        if (bitmap := self.dense.get(key)) is not None:
+            return bitmap.bit_count()
+        return len(self.sparse.get(key, ()))
+
+    def counts(self, bitmap: int) -> dict[str, int]:
+        counts = {
+            key: (dense & bitmap).bit_count() for key, dense in self.dense.items()
+        }
+        bits = bitmap.to_bytes((self.size + 7) // 8, "little")
+        for key, ids in self.sparse.items():
+            counts[key] = sum(bits[i >> 3] >> (i & 7) & 1 for i in ids)
+        return {key: count for key, count in counts.items() if count}
+
+
+def bitmap_ids(bitmap: int, size: int) -> list[int]:
+    ids = []
+    for byte_index, byte in enumerate(bitmap.to_bytes((size + 7) // 8, "little")):
+        if byte:
+            base = byte_index << 3
+            ids.extend(base + bit for bit in BIT_POSITIONS[byte])
+    return ids
+
+
+class GalleryIndex:
+    max_cached_queries = 32
+
+    def __init__(self, records: list[dict]):
+        self.records = records
+        self.queries: OrderedDict[tuple, abc.Sequence[int]] = OrderedDict()
+        self.rankings: dict[abc.Hashable, list[int]] = {}
+        self.version = 0
+        self.rebuild()
+
+    def rebuild(self):
+        size = len(self.records)
+        self.universe = (1 << size) - 1
+        self.tag_postings = Postings((r.get("tags", ()) for r in self.records), size)
+        self.mimetype_postings = Postings(
+            ((r["mimetype"],) for r in self.records), size
+        )
+        self.changed()
+
+    def changed(self):
+        self.queries.clear()
+        self.rankings.clear()
+        self.version += 1
+
+    @property
+    def tag_counts(self) -> Counter:
+        postings = self.tag_postings
+        return Counter({tag: postings.count(tag) for tag in postings.keys()})
+
+    def bitmap(
+        self,
+        mimetype: str | None = None,
+        tags: abc.Iterable[str] = (),
+        query: str | None = None,
+    ) -> int:
+        result = self.universe
+        if mimetype:
+            matching = 0
+            for candidate in self.mimetype_postings.keys():
+                if candidate == mimetype or candidate.startswith(f"{mimetype}/"):
+                    matching |= self.mimetype_postings.get(candidate)
+            result &= matching
+        if tags:
+            matching = 0
+            for tag in tags:
+                matching |= self.tag_postings.get(tag.lower(), 0)
+            result &= matching
+        if query:
+            result &= evaluate(parse_query(query), self.tag_postings, self.universe)
+        return result
+
+    def rank(
+        self,
+        ordering: abc.Hashable,
+        values: abc.Sequence,
+        version: int,
+        reverse: bool = False,
+    ) -> bool:
+        # values are computed off the event loop; they are stale if the index
+        # changed meanwhile
+        if version != self.version or len(values) != len(self.records):
+            return False
+        # a reverse sort is still stable, so ties stay in index order both ways
+        positions = sorted(range(len(values)), key=values.__getitem__, reverse=reverse)
+        ranks = [0] * len(values)
+        for rank, i in enumerate(positions):
+            ranks[i] = rank
+        self.rankings[ordering] = ranks
+        return True
+
+    def query(
+        self,
+        mimetype: str | None = None,
+        tags: abc.Iterable[str] = (),
+        query: str | None = None,
+        ordering: abc.Hashable | None = None,
+    ) -> abc.Sequence[int]:
+        tags = frozenset(tags)
+        if not mimetype and not tags and not query and ordering is None:
+            return range(len(self.records))
+        key = (mimetype, tags, query, ordering)
+        if (ids := self.queries.get(key)) is not None:
+            self.queries.move_to_end(key)
+            return ids
+        if ordering is not None:
+            ranks = self.rankings[ordering]
+            ids = self.query(mimetype, tags, query)
+            ids = sorted(ids, key=ranks.__getitem__)
+        else:
+            ids = bitmap_ids(self.bitmap(mimetype, tags, query), len(self.records))
+        self.queries[key] = ids
+        if len(self.queries) > self.max_cached_queries:
+            self.queries.popitem(last=False)
+        return ids
+
+    def counts(self, bitmap: int) -> dict[str, int]:
+        return self.tag_postings.counts(bitmap)
+
+    def add(self, records: list[dict]):
+        self.records.extend(records)
+        self.universe = (1 << len(self.records)) - 1
+        self.tag_postings.extend((r.get("tags", ()) for r in records), len(records))
+        self.mimetype_postings.extend(((r["mimetype"],) for r in records), len(records))
+        self.changed()
+
+    def remove(self, srcs: abc.Collection[str]) -> list[dict]:
+        removed = [r for r in self.records if r["src"] in srcs]
+        self.records[:] = [r for r in self.records if r["src"] not in srcs]
+        self.rebuild()
+        return removed
+
+    def page(self, ids: abc.Sequence[int], offset: int, limit: int) -> list[dict]:
+        end = offset + limit
+        return [{"index": i, **self.records[i]} for i in ids[offset:end]]
@@ -1,34 +1,138 @@
+import functools
+import hashlib
 import mimetypes
+import os
+import sys
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, List
+
+from .metrics import metrics
+from .sniff import OCTET_STREAM, SNIFF_SIZE, sniff
+from .tag_index import tag_index
 
 mimetypes.add_type("image/jfif", ".jfif", strict=False)
+# tag sidecars are known not to be medias, so they are never sniffed
+mimetypes.add_type("text/plain", ".tags", strict=False)
+
+UNKNOWN = object()
+TAGS_TIMER = metrics.timer("media_tags_seconds", "Time spent resolving media tags")
+
+
+def public_media_path(path, mtime_ns: int | None = None) -> str:
+    if mtime_ns is None:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+    digest = hashlib.md5(str(path).encode("utf8")).hexdigest()
+    return f"media/{digest}-{mtime_ns:x}"
+
+
+@functools.lru_cache(maxsize=4096)
+def extension_mimetype(extension: str) -> str | None:
+    if not mimetypes.inited:
+        mimetypes.init()
+    mimetype, _ = mimetypes.guess_type(f"media{extension}", strict=False)
+    return sys.intern(mimetype) if mimetype else None
+
+
+def public_path_mtime(public_path: str) -> int | None:
+    _, _, mtime = str(public_path).rpartition("-")
+    try:
+        return int(mtime, 16)
+    except ValueError:
+        return None
+
+
+class Media:
+    __slots__ = ("path", "public_file", "metadata", "_mimetype", "_media_type", "_tags")
+    # False for medias that have no file of their own at `path`
+    local = True
+
+    def __init__(self, host_file, public_file=None, mimetype=UNKNOWN, tags=None):
+        self.path = os.fspath(host_file)
+        self.public_file = os.fspath(public_file) if public_file else self.path
+        self.metadata = None
+        self._mimetype = mimetype
+        self._media_type = UNKNOWN
+        self._tags = tags
 
+    def __fspath__(self) -> str:
+        return self.path
 
-class Media(Path):
-    def __init__(self, host_file, public_file=None):
-        self.public_file = Path(public_file or host_file)
-        super().__init__(host_file)
+    def __str__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"Media({self.path!r})"
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Media):
+            return self.path == other.path
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def __lt__(self, other: "Media") -> bool:
+        # match pathlib ordering, which compares path components
+        return self.path.split(os.sep) < other.path.split(os.sep)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def stem(self) -> str:
+        return os.path.splitext(self.name)[0]
+
+    @property
+    def parent(self) -> str:
+        return os.path.dirname(self.path) or "."
+
+    @property
+    def public_name(self) -> str:
+        return os.path.basename(self.public_file)
+
+    def stat(self) -> os.stat_result:
+        return os.stat(self.path)
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
 
     def mimetype(self) -> str | None:
-        if not mimetypes.inited:
-            mimetypes.init()
-        mimetype, _ = mimetypes.guess_type(self, strict=False)
-        return mimetype
+        if self._mimetype is UNKNOWN:
+            self._mimetype = extension_mimetype(os.path.splitext(self.path)[1])
+        return self._mimetype
+
+    def sniff_mimetype(self) -> str | None:
+        # only for files whose extension is unknown; the result is never None
+        # afterwards, so catalogs store it and nothing is read twice
+        if self.mimetype() is None:
+            try:
+                with self.open() as fd:
+                    head = fd.read(SNIFF_SIZE)
+            except OSError:
+                head = b""
+            self._mimetype = sniff(head) or OCTET_STREAM
+            self._media_type = UNKNOWN
+        return self._mimetype
 
     def media_type(self) -> str | None:
-        if mimetype := self.mimetype():
-            return mimetype.split("/", 1)[0]
-        return None
+        if self._media_type is UNKNOWN:
+            if mimetype := self.mimetype():
+                self._media_type = sys.intern(mimetype.split("/", 1)[0])
+            else:
+                self._media_type = None
+        return self._media_type
 
     def tags(self) -> set:
-        tags = set([self.media_type()])
-        for tag_file in self.tag_files():
-            if tag_file.exists():
-                tags.update(tag.lower() for tag in tag_file.read_text().splitlines())
+        if self._tags is not None:
+            return set(self._tags)
+        with TAGS_TIMER.time():
+            tags = set([self.media_type()])
+            tags.update(tag_index.tags(self.parent, self.stem))
         return tags
 
     def tag_files(self) -> List[Path]:
-        base = self.stem
-        pattern = f"{base}-*.tags"
-        return list(self.parent.glob(pattern))
+        return [Path(p) for p in tag_index.tag_files(self.parent, self.stem)]
@@ -0,0 +1,354 @@
+import datetime
+import logging
+import os
+import sqlite3
+import struct
+from collections import abc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from .cache import default_cache_dir
+from .media import Media
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SORT_KEYS = ("path", "date", "size", "duration")
+MP4_EPOCH_OFFSET = 2082844800
+MP4_CONTAINERS = {b"moov", b"trak"}
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,
+    taken REAL,
+    duration REAL
+);
+"""
+
+
+@dataclass(frozen=True)
+class MediaMetadata:
+    mtime_ns: int
+    size: int
+    width: int | None = None
+    height: int | None = None
+    orientation: int | None = None
+    taken: float | None = None
+    duration: float | None = None
+
+    @property
+    def date(self) -> float:
+        return self.taken if self.taken is not None else self.mtime_ns / 1e9
+
+    @property
+    def display_size(self) -> tuple[int, int] | None:
+        if not self.width or not self.height:
+            return None
+        # EXIF orientations 5-8 (and rotated videos) are displayed transposed
+        if self.orientation in {5, 6, 7, 8}:
+            return self.height, self.width
+        return self.width, self.height
+
+
+def default_metadata_path() -> Path:
+    return default_cache_dir() / "metadata.sqlite"
+
+
+def parse_exif_date(value: bytes) -> float | None:
+    try:
+        text = value.split(b"\0", 1)[0].decode("ascii").strip()
+        return datetime.datetime.strptime(text, "%Y:%m:%d %H:%M:%S").timestamp()
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def parse_exif(data: bytes) -> dict:
+    byte_order = {b"II": "<", b"MM": ">"}.get(data[:2])
+    if byte_order is None:
+        return {}
+    found = {}
+
+    def read_ifd(offset: int):
+        (count,) = struct.unpack_from(f"{byte_order}H", data, offset)
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, kind, length, value = struct.unpack_from(
+                f"{byte_order}HHI4s", data, entry
+            )
+            if tag == EXIF_ORIENTATION:
+                found["orientation"] = struct.unpack_from(f"{byte_order}H", value)[0]
+            elif tag == EXIF_IFD_POINTER:
+                found["exif_ifd"] = struct.unpack(f"{byte_order}I", value)[0]
+            elif tag in {EXIF_DATETIME, EXIF_DATETIME_ORIGINAL} and kind == 2:
+                (start,) = struct.unpack(f"{byte_order}I", value)
+                end = start + length
+                found[tag] = parse_exif_date(data[start:end])
+
+    try:
+        read_ifd(struct.unpack_from(f"{byte_order}I", data, 4)[0])
+        if "exif_ifd" in found:
+            read_ifd(found["exif_ifd"])
+    except struct.error:
+        pass
+    return {
+        "orientation": found.get("orientation"),
+        "taken": found.get(EXIF_DATETIME_ORIGINAL) or found.get(EXIF_DATETIME),
+    }
+
+
+def read_jpeg(fd) -> dict:
+    info = {}
+    if fd.read(2) != b"\xff\xd8":
+        return info
+    while True:
+        marker = fd.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return info
+        code = marker[1]
+        if code == 0xFF:
+            fd.seek(-1, os.SEEK_CUR)
+            continue
+        if 0xD0 <= code <= 0xD8 or code == 0x01:
+            continue
+        if code in {0xD9, 0xDA}:
+            return info
+        (length,) = struct.unpack(">H", fd.read(2))
+        if code == 0xE1 and "taken" not in info:
+            segment = fd.read(length - 2)
+            if segment.startswith(b"Exif\0\0"):
+                info.update(parse_exif(segment[6:]))
+        elif code in JPEG_SOF_MARKERS:
+            info["height"], info["width"] = struct.unpack(">xHH", fd.read(5))
+            return info
+        else:
+            fd.seek(length - 2, os.SEEK_CUR)
+
+
+def read_png(fd) -> dict:
+    header = fd.read(24)
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        return {}
+    width, height = struct.unpack(">II", header[16:24])
+    return {"width": width, "height": height}
+
+
+def read_gif(fd) -> dict:
+    header = fd.read(10)
+    if not header.startswith(b"GIF8"):
+        return {}
+    width, height = struct.unpack("<HH", header[6:10])
+    return {"width": width, "height": height}
+
+
+def read_webp(fd) -> dict:
+    header = fd.read(30)
+    if header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+        return {}
+    chunk = header[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", header[26:30])
+        return {"width": width & 0x3FFF, "height": height & 0x3FFF}
+    if chunk == b"VP8L":
+        (bits,) = struct.unpack("<I", header[21:25])
+        return {"width": (bits & 0x3FFF) + 1, "height": (bits >> 14 & 0x3FFF) + 1}
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return {"width": width, "height": height}
+    return {}
+
+
+def read_mp4_boxes(fd, end: int, info: dict):
+    while fd.tell() + 8 <= end:
+        start = fd.tell()
+        size, kind = struct.unpack(">I4s", fd.read(8))
+        if size == 1:
+            (size,) = struct.unpack(">Q", fd.read(8))
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            return
+        if kind in MP4_CONTAINERS:
+            read_mp4_boxes(fd, start + size, info)
+        elif kind == b"mvhd":
+            read_mvhd(fd.read(min(size, 120)), info)
+        elif kind == b"tkhd" and "width" not in info:
+            read_tkhd(fd.read(min(size, 120)), info)
+        fd.seek(start + size)
+
+
+def read_mvhd(box: bytes, info: dict):
+    if box[0] == 1:
+        created, _, timescale, duration = struct.unpack_from(">QQIQ", box, 4)
+    else:
+        created, _, timescale, duration = struct.unpack_from(">IIII", box, 4)
+    if timescale:
+        info["duration"] = duration / timescale
+    if created > MP4_EPOCH_OFFSET:
+        info["taken"] = float(created - MP4_EPOCH_OFFSET)
+
+
+def read_tkhd(box: bytes, info: dict):
+    # skip version/flags, the times, ids and duration, then layer/volume fields
+    offset = 4 + (32 if box[0] == 1 else 20) + 16
+    matrix = struct.unpack_from(">9i", box, offset)
+    width, height = struct.unpack_from(">II", box, offset + 36)
+    if width >> 16 and height >> 16:
+        info["width"], info["height"] = width >> 16, height >> 16
+        # a rotation matrix with a non zero b term means the video is turned 90
+        if matrix[1]:
+            info["orientation"] = 6
+
+
+def read_mp4(fd) -> dict:
+    info = {}
+    end = fd.seek(0, os.SEEK_END)
+    fd.seek(0)
+    read_mp4_boxes(fd, end, info)
+    return info
+
+
+READERS = {
+    "image/jpeg": read_jpeg,
+    "image/pjpeg": read_jpeg,
+    "image/jfif": read_jpeg,
+    "image/png": read_png,
+    "image/gif": read_gif,
+    "image/webp": read_webp,
+    "video/mp4": read_mp4,
+    "video/quicktime": read_mp4,
+    "video/x-m4v": read_mp4,
+    "audio/mp4": read_mp4,
+}
+
+
+def read_metadata(media: Media, mimetype: str | None) -> MediaMetadata | None:
+    try:
+        stat = media.stat()
+    except OSError as e:
+        logger.debug(f"Could not stat {media}: {e}")
+        return None
+    info = {}
+    if reader := READERS.get(mimetype):
+        try:
+            with media.open() as fd:
+                info = reader(fd)
+        except (OSError, struct.error, IndexError) as e:
+            logger.debug(f"Could not read metadata for {media}: {e}")
+            info = {}
+    return MediaMetadata(stat.st_mtime_ns, stat.st_size, **info)
+
+
+class MetadataCache:
+    def __init__(self, db_path: Path | str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def load(self) -> dict[str, MediaMetadata]:
+        rows = self.db.execute(
+            "SELECT path, mtime_ns, size, width, height, orientation, taken, duration "
+            "FROM metadata"
+        )
+        return {path: MediaMetadata(*values) for path, *values in rows}
+
+    def store(self, rows: abc.Iterable[tuple[str, MediaMetadata]]):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    path,
+                    meta.mtime_ns,
+                    meta.size,
+                    meta.width,
+                    meta.height,
+                    meta.orientation,
+                    meta.taken,
+                    meta.duration,
+                )
+                for path, meta in rows
+            ),
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class MetadataExtractor:
+    def __init__(
+        self, cache_path: Path | str | None = None, workers: int | None = None
+    ):
+        self.cache_path = cache_path or default_metadata_path()
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+
+    def extract(self, medias: abc.Sequence[Media]) -> int:
+        # attaches metadata to every media and returns how many were (re)read
+        cache = MetadataCache(self.cache_path)
+        known = cache.load()
+        missing = []
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="metadata") as pool:
+            paths = [os.path.abspath(media) for media in medias]
+            for media, path, mtime_ns in zip(
+                medias, paths, pool.map(safe_mtime_ns, medias)
+            ):
+                cached = known.get(path)
+                if cached is not None and cached.mtime_ns == mtime_ns:
+                    media.metadata = cached
+                elif mtime_ns is not None:
+                    missing.append((media, path))
+            results = pool.map(
+                read_metadata,
+                [media for media, _ in missing],
+                [media.mimetype() for media, _ in missing],
+            )
+            rows = []
+            for (media, path), meta in zip(missing, results):
+                media.metadata = meta
+                if meta is not None:
+                    rows.append((path, meta))
+        cache.store(rows)
+        cache.close()
+        metrics.cache("metadata", hit=True, amount=len(medias) - len(missing))
+        metrics.cache("metadata", hit=False, amount=len(missing))
+        logger.info(
+            f"Read metadata for {len(missing)} medias ({len(medias) - len(missing)} cached)"
+        )
+        return len(missing)
+
+
+def safe_mtime_ns(media: Media) -> int | None:
+    try:
+        return media.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def sort_medias(
+    medias: abc.Iterable[Media], key: str = "path", reverse: bool = False
+) -> list[Media]:
+    if key == "path":
+        return sorted(medias, reverse=reverse)
+
+    def sort_value(media: Media):
+        value = getattr(media.metadata, key, None)
+        # medias without a value always go last, ties keep path order
+        if value is None:
+            return (1, 0)
+        return (0, -value if reverse else value)
+
+    return sorted(sorted(medias), key=sort_value)
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import abc
+from contextlib import contextmanager
+
+PREFIX = "quick_gallery_"
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{{{inner}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int | float = 1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: tuple) -> abc.Iterator[str]:
+        yield f"{name}{format_labels(labels)} {self.value}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, fxn: abc.Callable[[], float] | None = None):
+        self.value = 0
+        self.fxn = fxn
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, name: str, labels: tuple) -> abc.Iterator[str]:
+        value = self.fxn() if self.fxn is not None else self.value
+        yield f"{name}{format_labels(labels)} {value}"
+
+
+class Timer:
+    kind = "summary"
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def timed_iter(self, iterable: abc.Iterable) -> abc.Iterator:
+        # only counts time spent producing items, not time the consumer spends
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                with self.lock:
+                    self.total += time.perf_counter() - start
+                return
+            with self.lock:
+                self.count += 1
+                self.total += time.perf_counter() - start
+            yield item
+
+    def samples(self, name: str, labels: tuple) -> abc.Iterator[str]:
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+        yield f"{name}_sum{format_labels(labels)} {self.total:.6f}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions: dict[str, str] = {}
+        self.metrics: dict[tuple[str, tuple], Counter | Gauge | Timer] = {}
+        # added to every rendered sample, e.g. the worker a process serves as
+        self.labels: tuple[tuple[str, str], ...] = ()
+
+    def get(self, cls, name: str, description: str, labels: dict, **kwargs):
+        key = (PREFIX + name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls(**kwargs)
+                    self.descriptions.setdefault(key[0], description)
+        return metric
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        return self.get(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str = "", fxn=None, **labels) -> Gauge:
+        metric = self.get(Gauge, name, description, labels)
+        if fxn is not None:
+            metric.fxn = fxn
+        return metric
+
+    def timer(self, name: str, description: str = "", **labels) -> Timer:
+        return self.get(Timer, name, description, labels)
+
+    def cache(self, name: str, hit: bool, amount: int = 1):
+        self.counter(
+            "cache_requests_total",
+            "Cache lookups by cache and result",
+            cache=name,
+            result="hit" if hit else "miss",
+        ).inc(amount)
+
+    def snapshot(self) -> tuple[list, dict[str, str]]:
+        # metrics are registered from server and scan threads while rendering
+        with self.lock:
+            items, descriptions = list(self.metrics.items()), dict(self.descriptions)
+        return sorted(items), descriptions
+
+    def render(self) -> str:
+        lines = []
+        seen = set()
+        items, descriptions = self.snapshot()
+        for (name, labels), metric in items:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {descriptions[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.samples(name, self.labels + labels))
+        return "\n".join(lines) + "\n"
+
+    def timings(self) -> list[tuple[str, int, float]]:
+        return [
+            (name.removeprefix(PREFIX) + format_labels(labels), m.count, m.total)
+            for (name, labels), m in self.snapshot()[0]
+            if isinstance(m, Timer) and m.count
+        ]
+
+    def counts(self) -> list[tuple[str, float]]:
+        return [
+            (name.removeprefix(PREFIX) + format_labels(labels), m.value)
+            for (name, labels), m in self.snapshot()[0]
+            if isinstance(m, Counter) and m.value
+        ]
+
+
+metrics = Registry()
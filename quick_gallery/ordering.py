@@ -0,0 +1,75 @@
+import hashlib
+import os
+from collections import abc
+from dataclasses import dataclass
+
+from .media import Media
+
+ORDERS = ("index", "random", "path", "mtime", "size")
+
+
+class OrderError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Ordering:
+    name: str
+    seed: str = ""
+    reverse: bool = False
+
+
+def parse_ordering(order: str | None, seed: str | None = None) -> Ordering | None:
+    # "-mtime" is newest first; "index" is the order the server was started with
+    if not order:
+        return None
+    name = order.removeprefix("-")
+    if name not in ORDERS:
+        raise OrderError(f"Unknown order {name!r}, expected one of {', '.join(ORDERS)}")
+    reverse = order.startswith("-")
+    if name == "index" and not reverse:
+        return None
+    return Ordering(name, (seed or "") if name == "random" else "", reverse)
+
+
+def shuffle_key(seed: str, path: str) -> bytes:
+    # a keyed hash instead of a shuffled list, so medias added later don't move
+    # the others around and the same seed always gives the same order
+    return hashlib.blake2b(
+        path.encode("utf8", "surrogateescape"),
+        digest_size=8,
+        key=seed.encode("utf8")[:64],
+    ).digest()
+
+
+def stat_value(name: str, media: Media | None) -> tuple:
+    # medias without a value go last, like sort_medias
+    if media is None:
+        return (1, 0)
+    if media.metadata is not None:
+        return (0, media.metadata.mtime_ns if name == "mtime" else media.metadata.size)
+    try:
+        stat = os.stat(media.path)
+    except OSError:
+        return (1, 0)
+    return (0, stat.st_mtime_ns if name == "mtime" else stat.st_size)
+
+
+def ordering_values(
+    ordering: Ordering,
+    records: abc.Iterable[dict],
+    lookup: abc.Callable[[dict], Media | None],
+) -> list:
+    values = []
+    for record in records:
+        media = lookup(record)
+        path = media.path if media is not None else record["src"]
+        if ordering.name == "random":
+            values.append(shuffle_key(ordering.seed, path))
+        elif ordering.name == "path":
+            values.append(path)
+        elif ordering.name == "index":
+            values.append(0)
+        else:
+            values.append(stat_value(ordering.name, media))
+    return values
@@ -0,0 +1,242 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+from collections import abc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .cache import default_cache_dir
+from .media import Media
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+ALGORITHMS = ("ahash", "dhash", "phash")
+DEFAULT_THRESHOLD = 6
+DCT_COSINES = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * DCT_SIZE)) for x in range(DCT_SIZE)]
+    for u in range(HASH_SIZE)
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ahash TEXT NOT NULL,
+    dhash TEXT NOT NULL,
+    phash TEXT NOT NULL
+);
+"""
+
+
+def default_hash_cache_path() -> Path:
+    return default_cache_dir() / "perceptual.sqlite"
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def bits_to_int(bits: abc.Iterable[bool]) -> int:
+    value = 0
+    for bit in bits:
+        value = value << 1 | bit
+    return value
+
+
+def average_hash(image) -> int:
+    pixels = image.resize((HASH_SIZE, HASH_SIZE), Image.Resampling.BOX).tobytes()
+    mean = sum(pixels) / len(pixels)
+    return bits_to_int(pixel > mean for pixel in pixels)
+
+
+def difference_hash(image) -> int:
+    pixels = image.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).tobytes()
+    return bits_to_int(
+        pixels[row + col] > pixels[row + col + 1]
+        for row in range(0, len(pixels), HASH_SIZE + 1)
+        for col in range(HASH_SIZE)
+    )
+
+
+def perceptual_hash(image) -> int:
+    pixels = image.resize((DCT_SIZE, DCT_SIZE), Image.Resampling.BOX).tobytes()
+    rows = list(zip(*[iter(pixels)] * DCT_SIZE))
+    # separable 2D DCT-II, keeping only the lowest HASH_SIZE x HASH_SIZE terms
+    partial = [
+        [sum(c * p for c, p in zip(cosines, row)) for cosines in DCT_COSINES]
+        for row in rows
+    ]
+    coefficients = [
+        sum(cosines[y] * partial[y][v] for y in range(DCT_SIZE))
+        for cosines in DCT_COSINES
+        for v in range(HASH_SIZE)
+    ]
+    median = sorted(coefficients)[len(coefficients) // 2]
+    return bits_to_int(c > median for c in coefficients)
+
+
+def image_hashes(media: Media) -> tuple[int, int, int] | None:
+    try:
+        with media.open() as fd, Image.open(fd) as image:
+            image.draft("L", (DCT_SIZE * 4, DCT_SIZE * 4))
+            image = ImageOps.exif_transpose(image).convert("L")
+            return average_hash(image), difference_hash(image), perceptual_hash(image)
+    except Exception as e:
+        logger.debug(f"Could not hash {media}: {e}")
+        return None
+
+
+class MultiIndex:
+    # pigeonhole: keys within `radius` bits of each other differ in at most
+    # radius // chunks bits on at least one chunk, so only those buckets are probed
+    def __init__(self, radius: int, chunks: int = 4, bits: int = HASH_SIZE**2):
+        self.radius = radius
+        self.chunk_bits = bits // chunks
+        self.mask = (1 << self.chunk_bits) - 1
+        self.tables: list[dict[int, list]] = [{} for _ in range(chunks)]
+        self.probes = [
+            sum(1 << bit for bit in flipped)
+            for flips in range(radius // chunks + 1)
+            for flipped in itertools.combinations(range(self.chunk_bits), flips)
+        ]
+
+    def parts(self, key: int) -> abc.Iterator[tuple[dict, int]]:
+        for i, table in enumerate(self.tables):
+            yield table, key >> (i * self.chunk_bits) & self.mask
+
+    def add(self, key: int, value):
+        for table, part in self.parts(key):
+            table.setdefault(part, []).append((key, value))
+
+    def search(self, key: int) -> abc.Iterator[tuple[int, object]]:
+        seen = set()
+        for table, part in self.parts(key):
+            for probe in self.probes:
+                for candidate, value in table.get(part ^ probe, ()):
+                    if value in seen:
+                        continue
+                    seen.add(value)
+                    if (distance := hamming(key, candidate)) <= self.radius:
+                        yield distance, value
+
+
+class HashCache:
+    def __init__(self, db_path: Path | str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def load(self) -> dict[str, tuple[int, int, tuple[int, int, int]]]:
+        rows = self.db.execute(
+            "SELECT path, size, mtime_ns, ahash, dhash, phash FROM hashes"
+        )
+        return {
+            path: (size, mtime_ns, tuple(int(h, 16) for h in hashes))
+            for path, size, mtime_ns, *hashes in rows
+        }
+
+    def store(self, rows: abc.Iterable[tuple[str, os.stat_result, tuple]]):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (path, stat.st_size, stat.st_mtime_ns, *(f"{h:016x}" for h in hashes))
+                for path, stat, hashes in rows
+            ),
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class SimilarityFinder:
+    def __init__(
+        self,
+        algorithm: str = "phash",
+        threshold: int = DEFAULT_THRESHOLD,
+        cache_path: Path | str | None = None,
+        workers: int | None = None,
+    ):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.cache_path = cache_path or default_hash_cache_path()
+        self.workers = workers
+
+    def hashes(self, medias: abc.Sequence[Media]) -> dict[int, int]:
+        if Image is None:
+            logger.warning("Install Pillow to group similar images")
+            return {}
+        column = ALGORITHMS.index(self.algorithm)
+        cache = HashCache(self.cache_path)
+        known = cache.load()
+        hashes = {}
+        missing = []
+        for i, media in enumerate(medias):
+            if media.media_type() != "image":
+                continue
+            try:
+                stat = media.stat()
+            except OSError:
+                continue
+            path = os.path.abspath(media)
+            cached = known.get(path)
+            if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                hashes[i] = cached[2][column]
+            else:
+                missing.append((i, path, stat))
+        if missing:
+            logger.info(f"Hashing {len(missing)} images")
+            with ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                computed = pool.map(
+                    image_hashes, [medias[i] for i, _, _ in missing], chunksize=64
+                )
+                rows = []
+                for (i, path, stat), result in zip(missing, computed):
+                    if result is not None:
+                        hashes[i] = result[column]
+                        rows.append((path, stat, result))
+            cache.store(rows)
+        cache.close()
+        return hashes
+
+    def clusters(self, medias: abc.Iterable[Media]) -> list[list[Media]]:
+        # single-linkage clusters in order of their first member
+        medias = list(medias)
+        parents = list(range(len(medias)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        index = MultiIndex(self.threshold)
+        for i, key in self.hashes(medias).items():
+            for _, j in index.search(key):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+            index.add(key, i)
+
+        clusters: dict[int, list[Media]] = {}
+        for i, media in enumerate(medias):
+            clusters.setdefault(find(i), []).append(media)
+        return list(clusters.values())
@@ -1,43 +1,632 @@
+import asyncio
+import base64
+import copy
+import gc
+import json
 import logging
-from collections import abc
+import os
+import posixpath
+import signal
+import socket
+import stat
+import threading
+import time
+import urllib.parse
+from collections import abc, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from aiohttp import web
 
 from .galleries import BaseGallery
-from .media import Media
+from .http_cache import IMMUTABLE, REVALIDATE, CachedPage
+from .index import GalleryIndex
+from .media import Media, public_path_mtime
+from .metrics import metrics
+from .ordering import OrderError, Ordering, ordering_values, parse_ordering
+from .streaming import MediaStreamer
+from .tag_index import tag_index
+from .tag_query import QueryError
+from .thumbnails import ThumbnailCache
+from .watcher import Changes, PollingWatcher
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EVENT_KEEPALIVE = 15
+# changes kept for clients that connect after their page was rendered
+MAX_REPLAY_EVENTS = 64
+# events that change the items, which pages must not miss
+SEQUENCED_EVENTS = ("add", "remove", "reset")
+INDEX_BATCH_SIZE = 500
+RANKING_ATTEMPTS = 3
+DEFAULT_UPCOMING = 5
+MAX_UPCOMING = 50
+MAX_TIMING_SAMPLES = 100
+THREAD_JOIN_TIMEOUT = 10
+
+
+def os_thread_count() -> int:
+    try:
+        return len(os.listdir("/proc/self/task"))
+    except OSError:
+        return threading.active_count()
+
 
 class AioHttpServer:
     def __init__(
-        self, host: str, port: int, gallery: BaseGallery, medias: abc.Iterable[Media]
+        self,
+        host: str,
+        port: int,
+        gallery: BaseGallery,
+        medias: abc.Iterable[Media],
+        thumbnails: ThumbnailCache | None = None,
+        watcher: PollingWatcher | None = None,
+        watch_interval: float = 2.0,
+        streamer: MediaStreamer | None = None,
+        workers: int = 1,
+        order: abc.Callable[[list[Media]], list[Media]] | None = None,
     ):
         self.host = host
         self.port = port
         self.gallery = gallery
-        self.gallery_html = gallery.html()
-        self.media_lookup: dict[str, Media] = {
-            self.media_path(media): media for media in medias
+        self.thumbnails = thumbnails
+        self.watcher = watcher
+        self.watch_interval = watch_interval
+        self.streamer = streamer or MediaStreamer()
+        self.workers = workers
+        self.subscribers: set[asyncio.Queue] = set()
+        self.sequence = 0
+        self.history: deque[tuple[int, bytes]] = deque(maxlen=MAX_REPLAY_EVENTS)
+        # medias may be a lazy scan; it is consumed by build_index once serving
+        self.source = medias
+        # scans may hold thread bound resources such as a catalog connection, so
+        # they are always consumed from the same thread
+        self.index_executor = ThreadPoolExecutor(1, thread_name_prefix="index")
+        self.order = order
+        self.medias: list[Media] = []
+        self.gallery.medias = self.medias
+        self.gallery.inline_assets = False
+        self.asset_pages = {
+            name: CachedPage(body, content_type, cache_control=IMMUTABLE)
+            for name, (content_type, body) in gallery.assets().files.items()
         }
-        self.app = web.Application()
+        self.gallery_page: CachedPage | None = None
+        self.gallery_page_stale = True
+        self.index = GalleryIndex([])
+        self.media_lookup: dict[str, Media] = {}
+        self.ready = False
+        self.progress = {"state": "indexing", "scanned": 0, "indexed": 0}
+        metrics.gauge(
+            "active_streams",
+            "Media responses currently being sent",
+            fxn=lambda: self.streamer.active_streams,
+        )
+        metrics.gauge(
+            "medias", "Medias known to the server", fxn=lambda: len(self.medias)
+        )
+        metrics.gauge(
+            "event_subscribers",
+            "Connected live event clients",
+            fxn=lambda: len(self.subscribers),
+        )
+        self.app = web.Application(middlewares=[self.timing_middleware])
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_shutdown.append(self.on_shutdown)
         self.app.router.add_get("/", self.handle_root)
+        self.app.router.add_get("/api/items", self.handle_items)
+        self.app.router.add_get("/api/tags", self.handle_tags)
+        self.app.router.add_get("/api/query", self.handle_query)
+        self.app.router.add_get("/api/status", self.handle_status)
+        self.app.router.add_get("/api/upcoming", self.handle_upcoming)
+        self.app.router.add_post("/api/timings", self.handle_timings)
+        self.app.router.add_get("/thumb/{name}", self.handle_thumbnail)
+        self.app.router.add_get("/assets/{name}", self.handle_asset)
 
-        for path in self.media_lookup.keys():
-            self.app.router.add_get(path, self.handle_static)
+        self.app.router.add_get("/events", self.handle_events)
+        self.app.router.add_get("/metrics", self.handle_metrics)
+        self.app.router.add_get("/media/{name}", self.handle_static)
+
+    @web.middleware
+    async def timing_middleware(self, request, handler):
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else "unmatched"
+        with metrics.timer(
+            "request_seconds", "Time spent in request handlers", route=name
+        ).time():
+            return await handler(request)
 
     @classmethod
     def media_path(cls, media: Media):
-        return str("/" / media.public_file)
+        return posixpath.join("/", media.public_file)
+
+    async def on_startup(self, app):
+        if not self.ready:
+            app["index_task"] = asyncio.create_task(self.build_index())
+        elif self.watcher is not None:
+            app["watch_task"] = asyncio.create_task(self.watch())
+
+    async def on_shutdown(self, app):
+        for name in ("index_task", "watch_task"):
+            if task := app.get(name):
+                task.cancel()
+        self.index_executor.shutdown(wait=False, cancel_futures=True)
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+    async def build_index(self):
+        # serve partial results while the library is scanned in batches off the
+        # event loop, then swap in the fully ordered index
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        # tag files are listed again once per build, not on every page render
+        tag_index.refresh()
+        medias = iter(self.source)
+        try:
+            while batch := await loop.run_in_executor(
+                self.index_executor, self.prepare_batch, medias
+            ):
+                self.add_batch(batch)
+                self.progress["seconds"] = round(time.perf_counter() - started, 3)
+                self.publish("progress", self.progress)
+            scanned = [r["src"] for r in self.index.records]
+            final = await loop.run_in_executor(
+                self.index_executor, self.final_index, self.medias
+            )
+        except Exception:
+            logger.exception("Could not build the gallery index")
+            self.progress["state"] = "failed"
+            self.publish("progress", self.progress)
+            return
+        self.apply_index(*final)
+        self.progress["seconds"] = round(time.perf_counter() - started, 3)
+        logger.info(
+            f"Indexed {len(self.index.records)} medias in {self.progress['seconds']}s"
+        )
+        if scanned != [r["src"] for r in self.index.records]:
+            self.publish("reset", self.progress)
+        self.publish("ready", self.progress)
+        if self.watcher is not None:
+            self.app["watch_task"] = asyncio.create_task(self.watch())
+
+    def build_index_now(self):
+        tag_index.refresh()
+        self.apply_index(*self.final_index(list(self.source)))
+
+    def prepare_batch(self, medias: abc.Iterator[Media]) -> list[tuple]:
+        return [
+            (media, self.gallery.record_for(media))
+            for media in islice(medias, INDEX_BATCH_SIZE)
+        ]
+
+    def add_batch(self, batch: list[tuple[Media, dict | None]]):
+        records = []
+        for media, record in batch:
+            self.medias.append(media)
+            self.media_lookup[self.media_path(media)] = media
+            if record is not None:
+                records.append(record)
+        self.index.add(records)
+        self.gallery_page_stale = True
+        self.progress["scanned"] = len(self.medias)
+        self.progress["indexed"] = len(self.index.records)
+        if records:
+            self.publish("add", records)
+
+    def final_index(self, medias: list[Media]) -> tuple:
+        if self.order is not None:
+            medias = self.order(medias)
+        self.gallery.medias = medias
+        lookup = {self.media_path(media): media for media in medias}
+        return medias, lookup, GalleryIndex(self.gallery.records())
+
+    def apply_index(self, medias: list[Media], lookup: dict, index: GalleryIndex):
+        self.medias = self.gallery.medias = medias
+        self.media_lookup = lookup
+        self.index = index
+        self.ready = True
+        self.gallery_page_stale = True
+        self.progress.update(
+            state="ready", scanned=len(medias), indexed=len(index.records)
+        )
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        changes = await loop.run_in_executor(None, self.watcher.snapshot)
+        known = {str(media) for media in self.medias}
+        changes.created = [path for path in changes.created if path not in known]
+        await self.apply_changes(changes)
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                changes = await loop.run_in_executor(None, self.watcher.poll)
+                await self.apply_changes(changes)
+            except Exception:
+                logger.exception("Error while applying filesystem changes")
+
+    async def apply_changes(self, changes: Changes):
+        if not changes:
+            return
+        loop = asyncio.get_running_loop()
+        created = await loop.run_in_executor(None, self.prepare_medias, changes.created)
+        deleted = set(changes.deleted)
+        removed_medias = [media for media in self.medias if str(media) in deleted]
+        if removed_medias:
+            self.medias[:] = [m for m in self.medias if str(m) not in deleted]
+            for media in removed_medias:
+                self.media_lookup.pop(self.media_path(media), None)
+            removed = self.index.remove({m.public_file for m in removed_medias})
+            self.publish("remove", [record["src"] for record in removed])
+        if created:
+            for media, _ in created:
+                self.medias.append(media)
+                self.media_lookup[self.media_path(media)] = media
+            records = [record for _, record in created]
+            self.index.add(records)
+            self.publish("add", records)
+        if created or removed_medias:
+            self.gallery_page_stale = True
+            logger.info(
+                f"Applied filesystem changes: {len(created)} added, {len(removed_medias)} removed"
+            )
+
+    def prepare_medias(self, paths: list[str]) -> list[tuple[Media, dict]]:
+        prepared = []
+        tag_index.invalidate({os.path.dirname(path) for path in paths})
+        for path in paths:
+            media = self.watcher.scanner.make_media(path)
+            media.sniff_mimetype()
+            if (record := self.gallery.record_for(media)) is not None:
+                prepared.append((media, record))
+        return prepared
+
+    def publish(self, event: str, data):
+        if event in SEQUENCED_EVENTS:
+            self.sequence += 1
+            message = self.event_message(event, data, self.sequence)
+            self.history.append((self.sequence, message))
+        else:
+            message = self.event_message(event, data)
+        for queue in self.subscribers:
+            queue.put_nowait(message)
+
+    @staticmethod
+    def event_message(event: str, data, sequence: int | None = None) -> bytes:
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        if sequence is not None:
+            # sent back as Last-Event-ID when the browser reconnects
+            message = f"id: {sequence}\n{message}"
+        return message.encode("utf8")
+
+    def replay(self, queue: asyncio.Queue, since: int):
+        # pages carry the sequence they were rendered at; changes after it are
+        # replayed, or the page is reset once they are no longer all kept
+        if since >= self.sequence:
+            return
+        if not self.history or self.history[0][0] > since + 1:
+            queue.put_nowait(self.event_message("reset", self.progress, self.sequence))
+            return
+        for sequence, message in self.history:
+            if sequence > since:
+                queue.put_nowait(message)
+
+    async def handle_events(self, request):
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        since = request.headers.get("Last-Event-ID") or request.query.get("since")
+        try:
+            self.replay(queue, int(since))
+        except (TypeError, ValueError):
+            pass
+        if not self.ready:
+            queue.put_nowait(self.event_message("progress", self.progress))
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    message = b": keepalive\n\n"
+                if message is None:
+                    break
+                await response.write(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.subscribers.discard(queue)
+        return response
+
+    async def handle_metrics(self, request):
+        return web.Response(
+            text=metrics.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    async def handle_asset(self, request):
+        page = self.asset_pages.get(request.match_info["name"])
+        if page is None:
+            return web.Response(status=404, text="404: Not Found")
+        return page.response(request)
+
+    async def handle_status(self, request):
+        return web.json_response(self.progress)
 
     async def handle_root(self, request):
-        return web.Response(text=self.gallery_html, content_type="text/html")
+        if self.gallery_page_stale or self.gallery_page is None:
+            self.gallery_page_stale = False
+            # the page holds the medias known at this sequence, even if more
+            # batches are added while it renders
+            gallery = copy.copy(self.gallery)
+            gallery.medias = list(self.medias)
+            gallery.sequence = self.sequence
+            # pages rendered mid-build subscribe to events to receive the rest
+            gallery.live = self.watcher is not None or not self.ready
+            loop = asyncio.get_running_loop()
+            self.gallery_page = await loop.run_in_executor(
+                None, self.render_page, gallery
+            )
+        return self.gallery_page.response(request)
+
+    @staticmethod
+    def render_page(gallery: BaseGallery) -> CachedPage:
+        return CachedPage(gallery.html())
+
+    async def query_ids(self, query) -> tuple[GalleryIndex, abc.Sequence[int]]:
+        # the index may be swapped while a ranking is computed, so callers page
+        # through the one the ids came from
+        index = self.index
+        try:
+            ordering = parse_ordering(query.get("order"), query.get("seed"))
+        except OrderError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        if ordering is not None and not await self.ensure_ranking(index, ordering):
+            logger.debug(f"Index changed while ranking {ordering}, using index order")
+            ordering = None
+        try:
+            ids = index.query(
+                mimetype=query.get("mimetype"),
+                tags=query.getall("tag", []),
+                query=query.get("q"),
+                ordering=ordering,
+            )
+        except QueryError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return index, ids
+
+    async def ensure_ranking(self, index: GalleryIndex, ordering: Ordering) -> bool:
+        loop = asyncio.get_running_loop()
+        for _ in range(RANKING_ATTEMPTS):
+            if ordering in index.rankings:
+                return True
+            version, records = index.version, list(index.records)
+            with metrics.timer(
+                "phase_seconds", "Time spent per phase", phase="ranking"
+            ).time():
+                values = await loop.run_in_executor(
+                    None, ordering_values, ordering, records, self.record_media
+                )
+            index.rank(ordering, values, version, reverse=ordering.reverse)
+        return ordering in index.rankings
+
+    def record_media(self, record: dict) -> Media | None:
+        return self.media_lookup.get(posixpath.join("/", record["src"]))
+
+    async def handle_items(self, request):
+        query = request.query
+        try:
+            offset = max(0, int(query.get("offset", 0)))
+            limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise web.HTTPBadRequest(text="offset and limit must be integers")
+        limit = min(max(limit, 0), MAX_PAGE_SIZE)
+        index, ids = await self.query_ids(query)
+        return web.json_response(
+            {
+                "total": len(ids),
+                "offset": offset,
+                "items": index.page(ids, offset, limit),
+                "indexing": not self.ready,
+            }
+        )
+
+    async def handle_upcoming(self, request):
+        # the medias the client will navigate to next, wrapping around the end,
+        # with their sizes for its prefetch budget and preload hints for proxies
+        query = request.query
+        try:
+            position = int(query.get("position", 0))
+            limit = int(query.get("limit", DEFAULT_UPCOMING))
+            direction = -1 if int(query.get("direction", 1)) < 0 else 1
+        except ValueError:
+            raise web.HTTPBadRequest(
+                text="position, limit and direction must be integers"
+            )
+        index, ids = await self.query_ids(query)
+        limit = min(max(limit, 0), MAX_UPCOMING, max(len(ids) - 1, 0))
+        positions = [(position + direction * (i + 1)) % len(ids) for i in range(limit)]
+        items = [
+            {"position": p, "index": ids[p], **index.records[ids[p]]} for p in positions
+        ]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.add_sizes, items)
+        links = ", ".join(
+            f'</{urllib.parse.quote(item["src"])}>; rel=preload; as={item["mimetype"].split("/")[0]}'
+            for item in items
+        )
+        return web.json_response(
+            {"items": items}, headers={"Link": links} if links else None
+        )
+
+    def add_sizes(self, items: list[dict]):
+        for item in items:
+            if (media := self.record_media(item)) is not None:
+                try:
+                    item["size"] = media.stat().st_size
+                except OSError:
+                    pass
+
+    async def handle_timings(self, request):
+        try:
+            samples = (await request.json())["samples"][:MAX_TIMING_SAMPLES]
+            timings = [(float(s["seconds"]), bool(s["prefetched"])) for s in samples]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text="expected {samples: [{seconds, prefetched}]}")
+        for seconds, prefetched in timings:
+            metrics.timer(
+                "slide_display_seconds",
+                "Time from navigating to a slide until its media could be shown",
+                prefetched="yes" if prefetched else "no",
+            ).observe(seconds)
+        return web.Response(status=204)
 
-    async def handle_static(self, request):
-        media = self.media_lookup.get(request.path)
-        if media and media.is_file():
-            return web.FileResponse(media)
-        return web.Response(status=404, text="404: Not Found")
+    async def handle_tags(self, request):
+        return web.json_response(dict(self.index.tag_counts.most_common()))
+
+    async def handle_query(self, request):
+        query = request.query
+        try:
+            bitmap = self.index.bitmap(
+                mimetype=query.get("mimetype"),
+                tags=query.getall("tag", []),
+                query=query.get("q"),
+            )
+        except QueryError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        size = len(self.index.records)
+        encoded = base64.b64encode(bitmap.to_bytes((size + 7) // 8, "little"))
+        return web.json_response(
+            {
+                "total": bitmap.bit_count(),
+                "size": size,
+                "counts": self.index.counts(bitmap),
+                "bitmap": encoded.decode("ascii"),
+            }
+        )
+
+    async def handle_static(self, request, media=None):
+        media = media or self.media_lookup.get(request.path)
+        if media is None:
+            return web.Response(status=404, text="404: Not Found")
+        loop = asyncio.get_running_loop()
+        try:
+            media_stat = await loop.run_in_executor(None, media.stat)
+        except OSError:
+            return web.Response(status=404, text="404: Not Found")
+        if not stat.S_ISREG(media_stat.st_mode):
+            return web.Response(status=404, text="404: Not Found")
+        respond = self.streamer.respond if media.local else self.streamer.respond_member
+        return await respond(
+            request,
+            media,
+            media_stat,
+            content_type=media.mimetype(),
+            headers={"Cache-Control": self.cache_control(media, media_stat)},
+        )
+
+    @staticmethod
+    def cache_control(media: Media, media_stat: os.stat_result) -> str:
+        if public_path_mtime(media.public_name) == media_stat.st_mtime_ns:
+            return IMMUTABLE
+        return REVALIDATE
+
+    async def handle_thumbnail(self, request):
+        media = self.media_lookup.get(f"/media/{request.match_info['name']}")
+        if media is None:
+            return web.Response(status=404, text="404: Not Found")
+        if self.thumbnails is not None:
+            if thumbnail := await self.thumbnails.thumbnail(media):
+                loop = asyncio.get_running_loop()
+                media_stat = await loop.run_in_executor(None, media.stat)
+                cache_control = self.cache_control(media, media_stat)
+                return web.FileResponse(
+                    thumbnail, headers={"Cache-Control": cache_control}
+                )
+        return await self.handle_static(request, media)
 
     def start(self):
-        web.run_app(self.app, host=self.host, port=self.port, print=logger.info)
+        if self.workers > 1:
+            # workers share the index copy-on-write, so it is built before forking
+            self.build_index_now()
+            self.run_workers()
+        else:
+            self.run(host=self.host, port=self.port)
+
+    def run(self, print_fxn=logger.info, **listen):
+        try:
+            web.run_app(self.app, print=print_fxn, **listen)
+        finally:
+            if self.thumbnails is not None:
+                self.thumbnails.close()
+
+    def run_workers(self):
+        # pre-fork: the index and media records built in __init__ are shared
+        # copy-on-write with every worker, which accept on one listening socket
+        sock = socket.create_server((self.host, self.port), backlog=1024)
+        self.stop_threads()
+        gc.freeze()
+        pids = set()
+        for worker in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                self.run_worker(sock, worker)
+            pids.add(pid)
+        sock.close()
+        logger.info(
+            f"======== Running on http://{self.host}:{self.port} with {self.workers} workers ========"
+        )
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_workers(pids))
+        try:
+            self.wait_workers(pids)
+        except KeyboardInterrupt:
+            self.stop_workers(pids)
+            self.wait_workers(pids)
+
+    def stop_threads(self):
+        # a child forked while another thread holds a lock would deadlock on it,
+        # so every pool left over from building the index is stopped first
+        tag_index.close()
+        self.index_executor.shutdown()
+        deadline = time.monotonic() + THREAD_JOIN_TIMEOUT
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(max(deadline - time.monotonic(), 0))
+        # joined threads can take a moment longer to exit at the OS level
+        while os_thread_count() > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if (running := os_thread_count() - 1) > 0:
+            logger.warning(f"Forking workers with {running} other threads running")
+
+    def run_worker(self, sock: socket.socket, worker: int):
+        status = 0
+        # each worker only knows its own requests, so its samples are labelled
+        metrics.labels = (("worker", str(worker)),)
+        try:
+            logger.debug(f"Worker {worker} started with pid {os.getpid()}")
+            self.run(print_fxn=None, sock=sock)
+        except (KeyboardInterrupt, SystemExit):
+            # Ctrl-C reaches every worker in the terminal's process group
+            logger.debug(f"Worker {worker} stopped")
+        except BaseException:
+            logger.exception(f"Worker {worker} crashed")
+            status = 1
+        finally:
+            os._exit(status)
+
+    @staticmethod
+    def wait_workers(pids: set[int]):
+        while pids:
+            pid, status = os.wait()
+            pids.discard(pid)
+            if status:
+                logger.warning(f"Worker {pid} exited with status {status}")
+
+    @staticmethod
+    def stop_workers(pids: set[int]):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
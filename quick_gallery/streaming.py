@@ -0,0 +1,368 @@
+import asyncio
+import email.utils
+import logging
+import math
+import os
+import time
+import uuid
+
+from aiohttp import web
+
+from .http_cache import etag_matches
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BYTES_SERVED = metrics.counter("media_bytes_served_total", "Media bytes sent")
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_MAX_OPEN_FILES = 256
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range_spec(spec: str, size: int) -> tuple[int, int] | None:
+    # raises ValueError for malformed specs, returns None for unsatisfiable ones
+    start, dash, end = spec.strip().partition("-")
+    if not dash:
+        raise ValueError(spec)
+    if not start:
+        suffix = int(end)
+        return (max(size - suffix, 0), size - 1) if suffix and size else None
+    start = int(start)
+    end = int(end) if end else size - 1
+    if end < start and start < size:
+        raise ValueError(spec)
+    return (start, min(end, size - 1)) if start < size else None
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    # returns inclusive (start, end) pairs, or None when the header should be ignored
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    try:
+        ranges = [parse_range_spec(spec, size) for spec in specs.split(",")]
+    except ValueError:
+        return None
+    ranges = [r for r in ranges if r is not None]
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def etag_for(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def last_modified_for(stat: os.stat_result) -> str:
+    # rounded up like FileResponse, so a client echoing it back compares >= mtime
+    return email.utils.formatdate(math.ceil(stat.st_mtime), usegmt=True)
+
+
+def not_modified(request: web.BaseRequest, stat: os.stat_result) -> bool:
+    # the same precedence FileResponse applies on the sendfile path
+    if "If-None-Match" in request.headers:
+        return etag_matches(request, etag_for(stat))
+    since = request.if_modified_since
+    return since is not None and stat.st_mtime <= since.timestamp()
+
+
+class BoundedFileResponse(web.FileResponse):
+    def __init__(self, streamer: "MediaStreamer", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streamer = streamer
+
+    async def prepare(self, request: web.BaseRequest):
+        self.streamer.active_streams += 1
+        try:
+            async with self.streamer.open_files:
+                writer = await super().prepare(request)
+                if request.method != "HEAD" and self.content_length:
+                    BYTES_SERVED.inc(self.content_length)
+                return writer
+        finally:
+            self.streamer.active_streams -= 1
+
+
+class TokenBucket:
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.users = 0
+
+    async def consume(self, amount: int):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount or self.tokens >= self.rate:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class MediaStreamer:
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        rate_limit: int | None = None,
+        max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+    ):
+        self.chunk_size = chunk_size
+        self.rate_limit = rate_limit
+        self.open_files = asyncio.Semaphore(max_open_files)
+        self.buckets: dict[str, TokenBucket] = {}
+        self.active_streams = 0
+
+    async def respond(
+        self,
+        request: web.Request,
+        path: os.PathLike | str,
+        stat: os.stat_result,
+        content_type: str | None = None,
+        headers: dict | None = None,
+    ) -> web.StreamResponse:
+        range_header = request.headers.get("Range")
+        if range_header and not self.if_range_matches(request, stat):
+            range_header = None
+        multiple = range_header is not None and "," in range_header
+        ignored = range_header is None and "Range" in request.headers
+        if self.rate_limit is None and not multiple and not ignored:
+            # zero-copy sendfile path; aiohttp validates single ranges itself, and
+            # only guesses a content type from the path when none is given. It
+            # only understands dated If-Range, so a stale ETag one streams instead
+            if content_type is not None:
+                headers = {**(headers or {}), "Content-Type": content_type}
+            return BoundedFileResponse(
+                self, path, chunk_size=self.chunk_size, headers=headers
+            )
+        return await self.stream(
+            request, path, stat, range_header, content_type, headers or {}
+        )
+
+    async def respond_member(
+        self,
+        request: web.Request,
+        media,
+        stat: os.stat_result,
+        content_type: str | None = None,
+        headers: dict | None = None,
+    ) -> web.StreamResponse:
+        # stored members are a plain byte range of their archive, compressed
+        # ones can only be decompressed front to back and ignore Range
+        if not media.member.compressed:
+            range_header = request.headers.get("Range")
+            if range_header and not self.if_range_matches(request, stat):
+                range_header = None
+            return await self.stream(
+                request,
+                media.archive,
+                stat,
+                range_header,
+                content_type,
+                headers or {},
+                offset=media.member.offset,
+            )
+        return await self.stream_sequential(
+            request, media, stat, content_type, headers or {}
+        )
+
+    @staticmethod
+    def if_range_matches(request: web.Request, stat: os.stat_result) -> bool:
+        if_range = request.headers.get("If-Range")
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag_for(stat)
+        try:
+            since = email.utils.parsedate_to_datetime(if_range).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return stat.st_mtime <= since
+
+    async def stream(
+        self,
+        request: web.Request,
+        path: os.PathLike | str,
+        stat: os.stat_result,
+        range_header: str | None,
+        content_type: str | None,
+        headers: dict,
+        offset: int = 0,
+    ) -> web.StreamResponse:
+        size = stat.st_size
+        content_type = content_type or "application/octet-stream"
+        headers = self.validator_headers(headers, stat, "bytes")
+        if not_modified(request, stat):
+            return web.Response(status=304, headers=headers)
+        try:
+            ranges = parse_range(range_header, size) if range_header else None
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return web.Response(status=416, headers=headers)
+
+        response = web.StreamResponse(headers=headers)
+        parts, closing = self.plan_parts(response, ranges, size, content_type)
+        bucket = self.acquire_bucket(request.remote)
+        self.active_streams += 1
+        try:
+            async with self.open_files:
+                loop = asyncio.get_running_loop()
+                fd = await loop.run_in_executor(None, os.open, path, os.O_RDONLY)
+                try:
+                    await response.prepare(request)
+                    for head, start, end in parts:
+                        if head:
+                            await response.write(head)
+                        await self.write_range(
+                            response, fd, offset + start, offset + end, bucket
+                        )
+                    if closing:
+                        await response.write(closing)
+                finally:
+                    os.close(fd)
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.debug(f"Client went away while streaming {path}")
+        finally:
+            self.active_streams -= 1
+            self.release_bucket(request.remote)
+        return response
+
+    async def stream_sequential(
+        self,
+        request: web.Request,
+        media,
+        stat: os.stat_result,
+        content_type: str | None,
+        headers: dict,
+    ) -> web.StreamResponse:
+        headers = self.validator_headers(headers, stat, "none")
+        if not_modified(request, stat):
+            return web.Response(status=304, headers=headers)
+        response = web.StreamResponse(headers=headers)
+        response.content_type = content_type or "application/octet-stream"
+        response.content_length = stat.st_size
+        bucket = self.acquire_bucket(request.remote)
+        self.active_streams += 1
+        try:
+            async with self.open_files:
+                loop = asyncio.get_running_loop()
+                fd = await loop.run_in_executor(None, media.open)
+                try:
+                    await response.prepare(request)
+                    while chunk := await loop.run_in_executor(
+                        None, fd.read, self.chunk_size
+                    ):
+                        if bucket is not None:
+                            await bucket.consume(len(chunk))
+                        await response.write(chunk)
+                        BYTES_SERVED.inc(len(chunk))
+                finally:
+                    fd.close()
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.debug(f"Client went away while streaming {media}")
+        finally:
+            self.active_streams -= 1
+            self.release_bucket(request.remote)
+        return response
+
+    @staticmethod
+    def validator_headers(headers: dict, stat: os.stat_result, ranges: str) -> dict:
+        return {
+            **headers,
+            "Accept-Ranges": ranges,
+            "ETag": etag_for(stat),
+            "Last-Modified": last_modified_for(stat),
+        }
+
+    @staticmethod
+    def plan_parts(
+        response: web.StreamResponse,
+        ranges: list[tuple[int, int]] | None,
+        size: int,
+        content_type: str,
+    ) -> tuple[list[tuple[bytes | None, int, int]], bytes | None]:
+        if ranges is None:
+            response.content_type = content_type
+            response.content_length = size
+            return [(None, 0, size - 1)], None
+        response.set_status(206)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response.content_type = content_type
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response.content_length = end - start + 1
+            return [(None, start, end)], None
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("ascii"),
+                start,
+                end,
+            )
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode("ascii")
+        response.content_type = "multipart/byteranges"
+        response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        response.content_length = sum(
+            len(head) + end - start + 1 for head, start, end in parts
+        ) + len(closing)
+        return parts, closing
+
+    async def write_range(
+        self,
+        response: web.StreamResponse,
+        fd: int,
+        start: int,
+        end: int,
+        bucket: TokenBucket | None,
+    ):
+        loop = asyncio.get_running_loop()
+        position = start
+        while position <= end:
+            length = min(self.chunk_size, end - position + 1)
+            if bucket is not None:
+                await bucket.consume(length)
+            chunk = await loop.run_in_executor(None, os.pread, fd, length, position)
+            if not chunk:
+                break
+            await response.write(chunk)
+            BYTES_SERVED.inc(len(chunk))
+            position += len(chunk)
+
+    def acquire_bucket(self, remote: str | None) -> TokenBucket | None:
+        if self.rate_limit is None:
+            return None
+        bucket = self.buckets.get(remote)
+        if bucket is None:
+            bucket = self.buckets[remote] = TokenBucket(self.rate_limit)
+        bucket.users += 1
+        return bucket
+
+    def release_bucket(self, remote: str | None):
+        if (bucket := self.buckets.get(remote)) is not None:
+            bucket.users -= 1
+            if bucket.users <= 0:
+                del self.buckets[remote]
+
+
+def parse_size(value: str) -> int:
+    units = {"k": 1024, "m": 1024**2, "g": 1024**3}
+    value = value.strip().lower().removesuffix("b")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+from collections import abc, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def tag_file_stems(name: str) -> abc.Iterator[str]:
+    # "{stem}-*.tags" can match any stem that ends right before a dash
+    base = name[: -len(".tags")]
+    for i, char in enumerate(base):
+        if char == "-":
+            yield base[:i]
+
+
+def read_tag_file(path: str) -> frozenset[str]:
+    with open(path) as fd:
+        return frozenset(tag.lower() for tag in fd.read().splitlines())
+
+
+class TagIndex:
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+        self.lock = threading.Lock()
+        self.pool: ThreadPoolExecutor | None = None
+        self.directories: dict[str, dict[str, list[str]]] = {}
+        self.parsed: dict[str, tuple[int, frozenset[str]]] = {}
+
+    def tag_files(self, directory: str, stem: str) -> list[str]:
+        index = self.directories.get(directory)
+        metrics.cache("tag_directories", hit=index is not None)
+        if index is None:
+            with self.lock:
+                index = self.directories.get(directory)
+                if index is None:
+                    index = self.directories[directory] = self.index_directory(
+                        directory
+                    )
+        return index.get(stem, [])
+
+    def tags(self, directory: str, stem: str) -> set[str]:
+        tags = set()
+        for tag_file in self.tag_files(directory, stem):
+            if cached := self.parsed.get(tag_file):
+                tags.update(cached[1])
+        return tags
+
+    def index_directory(self, directory: str) -> dict[str, list[str]]:
+        by_stem = defaultdict(list)
+        to_read = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".tags"):
+                        continue
+                    try:
+                        mtime_ns = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue
+                    for stem in tag_file_stems(entry.name):
+                        by_stem[stem].append(entry.path)
+                    cached = self.parsed.get(entry.path)
+                    if cached is None or cached[0] != mtime_ns:
+                        to_read.append((entry.path, mtime_ns))
+                    else:
+                        metrics.cache("tag_files", hit=True)
+        except OSError as e:
+            logger.debug(f"Could not index tag files: {e}")
+            return {}
+        metrics.cache("tag_files", hit=False, amount=len(to_read))
+        if to_read:
+            self.read_all(to_read)
+        return dict(by_stem)
+
+    def read_all(self, tag_files: list[tuple[str, int]]):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="tags")
+        paths = [path for path, _ in tag_files]
+        results = self.pool.map(self.safe_read, paths)
+        for (path, mtime_ns), tags in zip(tag_files, results):
+            self.parsed[path] = (mtime_ns, tags)
+
+    def safe_read(self, path: str) -> frozenset[str]:
+        try:
+            return read_tag_file(path)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.debug(f"Could not read tag file: {e}")
+            return frozenset()
+
+    def invalidate(self, directories: abc.Iterable[str]):
+        with self.lock:
+            for directory in directories:
+                self.directories.pop(directory, None)
+
+    def refresh(self):
+        with self.lock:
+            self.directories.clear()
+
+    def close(self):
+        # the pool is created again the next time tag files need reading
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+tag_index = TagIndex()
@@ -0,0 +1,142 @@
+import re
+from collections import abc
+from dataclasses import dataclass
+
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+KEYWORDS = {"and", "or", "not"}
+
+
+class QueryError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Tag:
+    name: str
+
+
+@dataclass(frozen=True)
+class Not:
+    operand: "Node"
+
+
+@dataclass(frozen=True)
+class And:
+    operands: tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    operands: tuple["Node", ...]
+
+
+Node = Tag | Not | And | Or
+
+
+def tokenize(query: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN_RE.match(query, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"Unexpected character at {position}: {query[position]!r}")
+        position = match.end()
+        lparen, rparen, quoted, word = match.groups()
+        if lparen:
+            tokens.append(("(", lparen))
+        elif rparen:
+            tokens.append((")", rparen))
+        elif quoted is not None:
+            tokens.append(("tag", quoted.lower()))
+        elif word.lower() in KEYWORDS:
+            tokens.append((word.lower(), word))
+        elif word.startswith("-") and len(word) > 1:
+            tokens.append(("not", "-"))
+            tokens.append(("tag", word[1:].lower()))
+        else:
+            tokens.append(("tag", word.lower()))
+    return tokens
+
+
+class Parser:
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self) -> tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise QueryError("Empty query")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QueryError(f"Unexpected token: {self.tokens[self.position][1]!r}")
+        return node
+
+    def parse_or(self) -> Node:
+        operands = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def parse_and(self) -> Node:
+        operands = [self.parse_not()]
+        while self.peek() in {"and", "not", "tag", "("}:
+            if self.peek() == "and":
+                self.take()
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def parse_not(self) -> Node:
+        if self.peek() == "not":
+            self.take()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self) -> Node:
+        kind = self.peek()
+        if kind == "(":
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise QueryError("Missing closing parenthesis")
+            self.take()
+            return node
+        if kind == "tag":
+            return Tag(self.take()[1])
+        if kind is None:
+            raise QueryError("Unexpected end of query")
+        raise QueryError(f"Unexpected token: {self.tokens[self.position][1]!r}")
+
+
+def parse_query(query: str) -> Node:
+    return Parser(query).parse()
+
+
+def evaluate(node: Node, bitmaps: abc.Mapping[str, int], universe: int) -> int:
+    match node:
+        case Tag(name):
+            return bitmaps.get(name, 0)
+        case Not(operand):
+            return universe & ~evaluate(operand, bitmaps, universe)
+        case And(operands):
+            result = universe
+            for operand in operands:
+                result &= evaluate(operand, bitmaps, universe)
+            return result
+        case Or(operands):
+            result = 0
+            for operand in operands:
+                result |= evaluate(operand, bitmaps, universe)
+            return result
+    raise QueryError(f"Unknown query node: {node!r}")
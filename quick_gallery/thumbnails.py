@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from collections import abc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import BinaryIO
+
+from .media import Media
+from .metrics import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 480
+FFMPEG = shutil.which("ffmpeg")
+
+
+def generate_image_thumbnail(source: str | BinaryIO, target: str, size: int):
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert("RGB").save(target, "JPEG", quality=80, optimize=True)
+
+
+def generate_video_poster(source: str, target: str, size: int):
+    subprocess.run(
+        [
+            FFMPEG,
+            "-loglevel",
+            "error",
+            "-y",
+            "-ss",
+            "1",
+            "-i",
+            source,
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale='min({size},iw)':-2",
+            "-f",
+            "image2",
+            target,
+        ],
+        check=True,
+        timeout=60,
+    )
+
+
+def generate_thumbnail(source: Media, target: str, size: int, media_type: str) -> bool:
+    tmp_target = f"{target}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if media_type == "image":
+            with source.open() as fd:
+                generate_image_thumbnail(fd, tmp_target, size)
+        else:
+            generate_video_poster(str(source), tmp_target, size)
+        os.replace(tmp_target, target)
+        return True
+    except Exception as e:
+        logger.debug(f"Could not generate thumbnail for {source}: {e}")
+        return False
+    finally:
+        if os.path.exists(tmp_target):
+            os.unlink(tmp_target)
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir: Path, size=THUMBNAIL_SIZE, workers=None):
+        self.cache_dir = Path(cache_dir) / "thumbnails" / str(size)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.workers = workers
+        self.pool: ProcessPoolExecutor | None = None
+        self.pool_lock = threading.Lock()
+        self.pending: dict[Path, asyncio.Future] = {}
+        self.failed: set[Path] = set()
+
+    def supported_types(self) -> set[str]:
+        types = set()
+        if Image is not None:
+            types.add("image")
+        if FFMPEG is not None:
+            types.add("video")
+        return types
+
+    def supports(self, media: Media) -> bool:
+        # ffmpeg needs a real file, so video posters skip archive members
+        if not media.local and media.media_type() == "video":
+            return False
+        return media.media_type() in self.supported_types()
+
+    def thumbnail_path(self, media: Media) -> Path:
+        stat = media.stat()
+        key = f"{os.path.abspath(media)}:{stat.st_mtime_ns}:{stat.st_size}"
+        digest = hashlib.md5(key.encode("utf8")).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.jpg"
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.pool
+
+    def submit(self, media: Media, target: Path):
+        return self.executor().submit(
+            generate_thumbnail, media, str(target), self.size, media.media_type()
+        )
+
+    async def generate(self, media: Media, target: Path) -> bool:
+        # submitting may spawn a pool process, which blocks, so it runs in a thread
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self.submit, media, target)
+        return await asyncio.wrap_future(future)
+
+    async def thumbnail(self, media: Media) -> Path | None:
+        if not self.supports(media):
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            target = await loop.run_in_executor(None, self.thumbnail_path, media)
+        except OSError:
+            return None
+        if target in self.failed:
+            return None
+        exists = await loop.run_in_executor(None, target.exists)
+        metrics.cache("thumbnails", hit=exists)
+        if exists:
+            return target
+        if target not in self.pending:
+            future = asyncio.ensure_future(self.generate(media, target))
+            self.pending[target] = future
+            future.add_done_callback(lambda _: self.pending.pop(target, None))
+        if await asyncio.shield(self.pending[target]):
+            return target
+        self.failed.add(target)
+        return None
+
+    def prewarm(self, medias: abc.Iterable[Media]) -> int:
+        futures = {}
+        for media in medias:
+            if not self.supports(media):
+                continue
+            try:
+                target = self.thumbnail_path(media)
+            except OSError:
+                continue
+            if not target.exists():
+                futures[self.submit(media, target)] = media
+        generated = 0
+        for i, future in enumerate(as_completed(futures), 1):
+            if future.result():
+                generated += 1
+            else:
+                logger.warning(f"Could not generate thumbnail: {futures[future]}")
+            if i % 1000 == 0:
+                logger.info(f"Generated {i}/{len(futures)} thumbnails")
+        return generated
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
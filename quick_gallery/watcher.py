@@ -0,0 +1,95 @@
+import logging
+import os
+from collections import abc
+from dataclasses import dataclass, field
+
+from .discovery import MediaScanner
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DirectoryState:
+    mtime_ns: int
+    depth: int
+    files: set[str] = field(default_factory=set)
+    subdirs: set[str] = field(default_factory=set)
+
+
+@dataclass
+class Changes:
+    created: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.created or self.deleted)
+
+
+class PollingWatcher:
+    def __init__(self, roots: abc.Iterable[str], scanner: MediaScanner):
+        self.roots = [str(root) for root in roots]
+        self.scanner = scanner
+        self.directories: dict[str, DirectoryState] = {}
+
+    def snapshot(self) -> Changes:
+        changes = Changes()
+        for root in self.roots:
+            self.add_directory(root, 0, changes)
+        logger.debug(f"Watching {len(self.directories)} directories")
+        return changes
+
+    def add_directory(self, path: str, depth: int, changes: Changes):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            files, subdirs = self.scanner.list_dir(path)
+        except OSError:
+            return
+        state = DirectoryState(mtime_ns, depth)
+        self.directories[path] = state
+        state.files = {file for file in files if self.scanner.is_included(file)}
+        changes.created.extend(state.files)
+        if self.scanner.max_depth is None or depth < self.scanner.max_depth:
+            state.subdirs = {d for d in subdirs if not self.scanner.is_excluded(d)}
+            for subdir in state.subdirs:
+                self.add_directory(subdir, depth + 1, changes)
+
+    def remove_directory(self, path: str, changes: Changes):
+        state = self.directories.pop(path, None)
+        if state is None:
+            return
+        changes.deleted.extend(state.files)
+        for subdir in state.subdirs:
+            self.remove_directory(subdir, changes)
+
+    def poll(self) -> Changes:
+        changes = Changes()
+        for path, state in list(self.directories.items()):
+            if path not in self.directories:
+                continue
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime_ns != state.mtime_ns:
+                self.rescan_directory(path, state, mtime_ns, changes)
+        return changes
+
+    def rescan_directory(
+        self, path: str, state: DirectoryState, mtime_ns: int, changes: Changes
+    ):
+        try:
+            files, subdirs = self.scanner.list_dir(path)
+        except OSError:
+            return
+        state.mtime_ns = mtime_ns
+        files = {file for file in files if self.scanner.is_included(file)}
+        changes.created.extend(files - state.files)
+        changes.deleted.extend(state.files - files)
+        state.files = files
+        if self.scanner.max_depth is None or state.depth < self.scanner.max_depth:
+            subdirs = {d for d in subdirs if not self.scanner.is_excluded(d)}
+            for removed in state.subdirs - subdirs:
+                self.remove_directory(removed, changes)
+            for added in subdirs - state.subdirs:
+                self.add_directory(added, state.depth + 1, changes)
+            state.subdirs = subdirs
@@ -26,7 +26,9 @@ setup(
             "isort",
             "pyright",
             "bump2version",
-        ]
+        ],
+        "thumbnails": ["Pillow"],
+        "compression": ["brotli"],
     },
     tests_require=["pytest"],
     entry_points={
@@ -35,4 +37,3 @@ setup(
         ],
     },
 )
-
@@ -0,0 +1,53 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from quick_gallery.archives import ArchiveIndex, archive_medias, safe_member_name
+
+NAMES = ["ok.jpg", "sub/ok.jpg", "/etc/evil.jpg", "../evil.jpg", "sub/../../evil.jpg"]
+
+
+@pytest.mark.parametrize(
+    "name, safe",
+    [
+        ("a.jpg", True),
+        ("sub/dir/a.jpg", True),
+        ("sub/../a.jpg", True),
+        ("./a.jpg", True),
+        ("/a.jpg", False),
+        ("../a.jpg", False),
+        ("sub/../../a.jpg", False),
+        ("sub/..", False),
+        ("..", False),
+        (".", False),
+    ],
+)
+def test_safe_member_name(name, safe):
+    assert safe_member_name(name) is safe
+
+
+def write_zip(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in NAMES:
+            archive.writestr(zipfile.ZipInfo(name), b"data")
+
+
+def write_tar(path):
+    with tarfile.open(path, "w") as archive:
+        for name in NAMES:
+            info = tarfile.TarInfo(name)
+            info.size = 4
+            archive.addfile(info, io.BytesIO(b"data"))
+
+
+@pytest.mark.parametrize("name, write", [("a.zip", write_zip), ("a.tar", write_tar)])
+def test_unsafe_members_are_skipped(tmp_path, name, write):
+    path = str(tmp_path / name)
+    write(path)
+    medias = list(archive_medias(path, ArchiveIndex(tmp_path / "cache")))
+    assert [media.member.name for media in medias] == ["ok.jpg", "sub/ok.jpg"]
+    assert all(media.path.startswith(path + "/") for media in medias)
+    with medias[0].open() as fd:
+        assert fd.read() == b"data"
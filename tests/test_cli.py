@@ -0,0 +1,17 @@
+import click
+import pytest
+
+from quick_gallery.cli import ByteSize
+
+
+@pytest.mark.parametrize(
+    "value, size", [("512", 512), ("256k", 256 * 1024), ("1.5MB", 1572864)]
+)
+def test_byte_size(value, size):
+    assert ByteSize().convert(value, None, None) == size
+
+
+@pytest.mark.parametrize("value", ["0", "-5", "0.0001k", "abc", "", "inf", "10x"])
+def test_byte_size_rejects(value):
+    with pytest.raises(click.BadParameter):
+        ByteSize().convert(value, None, None)
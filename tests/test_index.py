@@ -0,0 +1,152 @@
+import random
+
+import pytest
+
+from quick_gallery.index import DENSE_RATIO, GalleryIndex, Postings, bitmap_ids
+from quick_gallery.tag_query import And, Not, Or, QueryError, Tag, parse_query
+
+TAGS = ["cat", "dog", "beach", "night", "rare"]
+
+
+def make_records(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        tags = [tag for tag in TAGS[:-1] if rng.random() < 0.4]
+        if i % 97 == 0:
+            tags.append("rare")
+        mimetype = rng.choice(["image/jpeg", "image/png", "video/mp4"])
+        records.append({"src": f"media/{i}", "mimetype": mimetype, "tags": tags})
+    return records
+
+
+def expected_ids(node, records: list[dict]) -> set[int]:
+    everything = set(range(len(records)))
+    match node:
+        case Tag(name):
+            return {i for i, r in enumerate(records) if name in r["tags"]}
+        case Not(operand):
+            return everything - expected_ids(operand, records)
+        case And(operands):
+            return set.intersection(*(expected_ids(o, records) for o in operands))
+        case Or(operands):
+            return set.union(*(expected_ids(o, records) for o in operands))
+
+
+@pytest.mark.parametrize(
+    "query, parsed",
+    [
+        ("cat", Tag("cat")),
+        ("cat dog", And((Tag("cat"), Tag("dog")))),
+        ("cat or dog beach", Or((Tag("cat"), And((Tag("dog"), Tag("beach")))))),
+        ("(cat or dog) beach", And((Or((Tag("cat"), Tag("dog"))), Tag("beach")))),
+        ("not cat and -dog", And((Not(Tag("cat")), Not(Tag("dog"))))),
+        ("NOT not Cat", Not(Not(Tag("cat")))),
+        ('"Night Sky" or rare', Or((Tag("night sky"), Tag("rare")))),
+    ],
+)
+def test_parse_precedence(query, parsed):
+    assert parse_query(query) == parsed
+
+
+@pytest.mark.parametrize(
+    "query", ["", "   ", "cat or", "(cat", "cat)", "not", "and cat", "()"]
+)
+def test_parse_errors(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "cat",
+        "cat dog",
+        "cat or dog",
+        "not cat",
+        "-cat -dog",
+        "(cat or dog) and not beach",
+        "rare or (night and not (cat or dog))",
+        "not (cat and dog) or rare",
+        "missing or cat",
+        "not missing",
+    ],
+)
+def test_query_matches_sets(query):
+    records = make_records(2000)
+    index = GalleryIndex(records)
+    expected = sorted(expected_ids(parse_query(query), records))
+    assert list(index.query(query=query)) == expected
+
+
+def test_filters_combine():
+    records = make_records(500)
+    index = GalleryIndex(records)
+    ids = index.query(mimetype="image", tags=["night", "rare"], query="not cat")
+    expected = [
+        i
+        for i, r in enumerate(records)
+        if r["mimetype"].startswith("image/")
+        and {"night", "rare"} & set(r["tags"])
+        and "cat" not in r["tags"]
+    ]
+    assert list(ids) == expected
+
+
+def test_sparse_and_dense_postings_agree():
+    records = make_records(3000, seed=1)
+    keys = [r["tags"] for r in records]
+    postings = Postings(keys, len(keys))
+    assert "rare" in postings.sparse and "cat" in postings.dense
+    for tag in TAGS:
+        ids = [i for i, tags in enumerate(keys) if tag in tags]
+        assert bitmap_ids(postings.get(tag), len(keys)) == ids
+        assert postings.count(tag) == len(ids)
+    selection = sum(1 << i for i in range(0, 3000, 3))
+    counts = postings.counts(selection)
+    for tag in TAGS:
+        assert counts[tag] == sum(1 for i in range(0, 3000, 3) if tag in keys[i]), tag
+
+
+def test_postings_grow_in_batches():
+    records = make_records(3000, seed=2)
+    whole = GalleryIndex([dict(r) for r in records])
+    batched = GalleryIndex([])
+    for start in range(0, len(records), 250):
+        batched.add([dict(r) for r in records[start:][:250]])
+    for tag in TAGS:
+        assert list(batched.query(tags=[tag])) == list(whole.query(tags=[tag]))
+    assert batched.tag_counts == whole.tag_counts
+
+
+def test_sparse_key_becomes_dense():
+    padding = DENSE_RATIO * 4
+    postings = Postings([["a"]] + [[] for _ in range(padding)], padding + 1)
+    assert "a" in postings.sparse
+    postings.extend([["a"]] * 10, 10)
+    assert "a" in postings.dense and "a" not in postings.sparse
+    assert postings.count("a") == 11
+    ids = bitmap_ids(postings.get("a"), postings.size)
+    assert ids == [0] + list(range(padding + 1, padding + 11))
+
+
+def test_remove_rebuilds():
+    records = make_records(300)
+    index = GalleryIndex(records)
+    removed = index.remove({"media/0", "media/97"})
+    assert [r["src"] for r in removed] == ["media/0", "media/97"]
+    assert index.tag_counts["rare"] == sum("rare" in r["tags"] for r in records)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_rank_ties_keep_index_order(reverse):
+    records = make_records(50)
+    index = GalleryIndex(records)
+    values = [i % 3 for i in range(len(records))]
+    assert index.rank("mod3", values, index.version, reverse=reverse)
+    ids = list(index.query(ordering="mod3"))
+    expected = sorted(range(len(records)), key=lambda i: (values[i], i))
+    if reverse:
+        expected = sorted(range(len(records)), key=lambda i: (-values[i], i))
+    assert ids == expected
+    assert not index.rank("stale", values, index.version - 1)
@@ -0,0 +1,153 @@
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from quick_gallery.streaming import (
+    MediaStreamer,
+    RangeNotSatisfiable,
+    etag_for,
+    parse_range,
+)
+
+BODY = bytes(range(256)) * 40
+SIZE = len(BODY)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [(0, 99)]),
+        ("bytes=100-", [(100, SIZE - 1)]),
+        ("bytes=-100", [(SIZE - 100, SIZE - 1)]),
+        ("bytes=-999999", [(0, SIZE - 1)]),
+        ("bytes=10-999999", [(10, SIZE - 1)]),
+        ("bytes=0-0, 10-19,-5", [(0, 0), (10, 19), (SIZE - 5, SIZE - 1)]),
+        ("bytes=0-9, 999999-", [(0, 9)]),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize(
+    "header", ["items=0-1", "bytes=", "bytes=abc", "bytes=9-1", "bytes=" + "0-0," * 17]
+)
+def test_parse_range_ignored(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=999999-", "bytes=-0", "bytes=10240-10300"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+@pytest.fixture(params=["sendfile", "stream"])
+def streamer(request):
+    rate_limit = None if request.param == "sendfile" else 1024**3
+    return MediaStreamer(chunk_size=1000, rate_limit=rate_limit)
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / "media.bin"
+    path.write_bytes(BODY)
+    os.utime(path, ns=(1_700_000_000_250_000_000,) * 2)
+    return path
+
+
+def fetch(streamer: MediaStreamer, path, headers: dict):
+    async def handler(request):
+        stat = os.stat(path)
+        return await streamer.respond(request, path, stat, "application/test")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/media", handler)
+        async with TestClient(TestServer(app)) as client:
+            async with client.get("/media", headers=headers) as response:
+                return response.status, response.headers, await response.read()
+
+    return asyncio.run(run())
+
+
+def test_full_body(streamer, media):
+    status, headers, body = fetch(streamer, media, {})
+    assert status == 200 and body == BODY
+    assert headers["Content-Type"] == "application/test"
+    assert headers["ETag"] == etag_for(os.stat(media))
+    assert headers["Last-Modified"] == "Tue, 14 Nov 2023 22:13:21 GMT"
+
+
+@pytest.mark.parametrize(
+    "range_header, start, end",
+    [("bytes=5-2004", 5, 2004), ("bytes=-300", SIZE - 300, SIZE - 1)],
+)
+def test_single_range(streamer, media, range_header, start, end):
+    status, headers, body = fetch(streamer, media, {"Range": range_header})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {start}-{end}/{SIZE}"
+    assert body == BODY[start:][: end - start + 1]
+
+
+def test_multipart_range(streamer, media):
+    status, headers, body = fetch(streamer, media, {"Range": "bytes=0-9,-10"})
+    assert status == 206
+    content_type, _, boundary = headers["Content-Type"].partition("; boundary=")
+    assert content_type == "multipart/byteranges"
+    parts = body.split(f"--{boundary}".encode())
+    assert parts[0] == b"\r\n" and parts[-1] == b"--\r\n"
+    assert parts[1].endswith(b"\r\n\r\n" + BODY[:10] + b"\r\n")
+    assert f"Content-Range: bytes {SIZE - 10}-{SIZE - 1}/{SIZE}".encode() in parts[2]
+    assert parts[2].endswith(BODY[-10:] + b"\r\n")
+    assert int(headers["Content-Length"]) == len(body)
+
+
+def test_unsatisfiable_range(streamer, media):
+    status, headers, _ = fetch(streamer, media, {"Range": "bytes=999999-"})
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+@pytest.mark.parametrize(
+    "if_range, partial",
+    [
+        ("etag", True),
+        ('"stale"', False),
+        ("Tue, 14 Nov 2023 22:13:21 GMT", True),
+        ("Tue, 14 Nov 2023 22:13:20 GMT", False),
+    ],
+)
+def test_if_range(streamer, media, if_range, partial):
+    if if_range == "etag":
+        if_range = etag_for(os.stat(media))
+    headers = {"Range": "bytes=0-9", "If-Range": if_range}
+    status, _, body = fetch(streamer, media, headers)
+    assert (status, body) == ((206, BODY[:10]) if partial else (200, BODY))
+
+
+@pytest.mark.parametrize(
+    "headers, status",
+    [
+        ({"If-None-Match": "etag"}, 304),
+        ({"If-None-Match": '"stale", etag'}, 304),
+        ({"If-None-Match": "*"}, 304),
+        ({"If-None-Match": '"stale"'}, 200),
+        ({"If-Modified-Since": "Tue, 14 Nov 2023 22:13:21 GMT"}, 304),
+        ({"If-Modified-Since": "Tue, 14 Nov 2023 22:13:20 GMT"}, 200),
+        (
+            {
+                "If-None-Match": '"stale"',
+                "If-Modified-Since": "Tue, 14 Nov 2023 22:13:21 GMT",
+            },
+            200,
+        ),
+    ],
+)
+def test_conditional_get(streamer, media, headers, status):
+    etag = etag_for(os.stat(media))
+    headers = {k: v.replace("etag", etag) for k, v in headers.items()}
+    assert fetch(streamer, media, headers)[0] == status